@@ -2,12 +2,24 @@ import numpy as np
 import os
 import tifffile
 import nd2
+import zarr
+import dask.array as da
 import re
 import webbrowser
+import json
+import hashlib
+import tempfile
+import concurrent.futures
+import collections
+import shutil
+import numcodecs
 from bioio import BioImage
+from bioio.writers import OmeTiffWriter
+from ome_types import to_xml, from_xml
+from ome_types.model import OME, CommentAnnotation
 from PyQt5.QtCore import Qt, pyqtSignal, QUrl, QRegularExpression
 from PyQt5.QtGui import QBrush, QKeySequence, QPainter, QFontMetrics, QTextDocument, QColor, QRegularExpressionValidator
-from PyQt5.QtWidgets import QLabel, QVBoxLayout, QHBoxLayout, QFormLayout, QWidget, QLineEdit, QScrollArea, QListWidget, QMessageBox, QTableWidget, QHeaderView, QTableWidgetItem, QAbstractItemView, QPushButton, QFileDialog, QListWidgetItem, QDialog, QShortcut, QRadioButton, QSpinBox, QComboBox, QGroupBox
+from PyQt5.QtWidgets import QLabel, QVBoxLayout, QHBoxLayout, QFormLayout, QWidget, QLineEdit, QScrollArea, QListWidget, QMessageBox, QTableWidget, QHeaderView, QTableWidgetItem, QAbstractItemView, QPushButton, QFileDialog, QListWidgetItem, QDialog, QShortcut, QRadioButton, QSpinBox, QComboBox, QGroupBox, QCheckBox
 
 import logging
 import igraph as ig
@@ -22,9 +34,50 @@ output_suffixes = {'zprojection': '_vPR',
                    'graph_filtering': '_vGF',
                    'events_selection': '_vES',
                    'image_cropping': '_vCR'}
-imagetypes = ['.nd2', '.tif', '.tiff', '.ome.tif', '.ome.tiff']
+imagetypes = ['.nd2', '.tif', '.tiff', '.ome.tif', '.ome.tiff', '.ome.zarr', '.zarr', '.vreg']
+# OME-Zarr images are directories
+zarrtypes = ['.ome.zarr', '.zarr']
+# virtual registered images (JSON descriptor referencing an image and a transformation matrix, see write_virtual_registered_image())
+virtualtypes = ['.vreg']
+virtual_registered_image_version = 1
 graphtypes = ['.graphmlz']
 matrixtypes = ['.txt', '.csv']
+# format of output images (label: extension)
+output_formats = {'OME-TIFF': '.ome.tif',
+                  'OME-Zarr': '.ome.zarr'}
+# compression of output images (label: tifffile.TiffWriter.write() keyword arguments)
+output_compressions = {'zlib': {'compression': 'zlib'},
+                       'zstd': {'compression': 'zstd'},
+                       'LZW (with predictor)': {'compression': 'lzw', 'predictor': True},
+                       'none': {'compression': None}}
+# compression of OME-Zarr output images (label: numcodecs compressor). LZW is not available.
+output_zarr_compressors = {'zlib': numcodecs.Zlib(level=6),
+                           'zstd': numcodecs.Zstd(),
+                           'none': None}
+# tile size (Y, X) of tiled output images
+output_tile_shape = (256, 256)
+# folder used to cache image metadata (see Image.read_attr()). Set to None to disable caching.
+metadata_cache_folder = os.path.join(os.path.expanduser('~'), '.cache', 'VLabApp', 'metadata')
+metadata_cache_version = 1
+# folder used to cache the sharpness of z sections used to find the Z section with best focus (see Image.z_projection()). Set to None to disable caching.
+focus_cache_folder = os.path.join(os.path.expanduser('~'), '.cache', 'VLabApp', 'focus')
+focus_cache_version = 1
+# with best focus tracking (see Image.z_projection()), number of time frames between two searches of the Z section with best focus over all z sections
+focus_tracking_interval = 10
+# number of threads used to decode image data (compressed tiff pages, nd2 frames and zarr chunks) when reading images.
+# None: library defaults. Can be set per image (see Image). Set by the pipeline according to its number of processes.
+decode_threads = None
+# local folder used to stage copies of input images (e.g. from network shares) before reading image data (see stage_image()).
+# Disabled by default (None), enabled by setting environment variable VLABAPP_STAGING_FOLDER (inherited by worker processes).
+staging_folder = os.environ.get('VLABAPP_STAGING_FOLDER') or None
+# maximum total size (in bytes) of the staged images (least recently used images are removed first).
+# Set with environment variable VLABAPP_STAGING_MAX_SIZE (in GB, default: 50 GB).
+staging_max_size = int(float(os.environ.get('VLABAPP_STAGING_MAX_SIZE', '50')) * 1024**3)
+# maximum total size (in bytes) of images read ahead and held in memory by a process (see prefetch_image())
+prefetch_memory_budget = 4 * 1024**3
+# images read ahead (path: dict with keys 'signature', 'nbytes' and 'future')
+_prefetched_images = {}
+_prefetch_executor = None
 
 
 def splitext(path):
@@ -64,15 +117,579 @@ def splitext(path):
 
     >>> splitext('project-v0.4.17.zip')
     ('project-v0.4.17', '.zip')
+
+    Paths selecting a single field of view (see field_of_view_path()) are
+    split into the root of the image with an "_F<field of view>" suffix
+    and the extension of the image (root + ext != path in this case):
+
+    >>> splitext('foo.nd2#F3')
+    ('foo_F3', '.nd2')
     """
+    path, field_of_view = split_field_of_view_path(path)
     root, ext = os.path.splitext(path)
     ext2 = '.ome'
     if root.endswith(ext2):
         root, ext2 = os.path.splitext(root)
         ext = ext2 + ext
+    if field_of_view is not None:
+        root = root + '_F' + str(field_of_view)
     return (root, ext)
 
 
+def field_of_view_path(path, field_of_view):
+    """
+    Return a path selecting a single field of view of a multi-position image
+    (e.g. 'foo.nd2#F3' for the 4th field of view of 'foo.nd2').
+    Such paths can be used as input of the Image class (and of module main functions),
+    only the frames of the selected field of view are then read.
+
+    Parameters
+    ----------
+    path: str
+        image path.
+    field_of_view: int
+        index of the field of view (F axis).
+
+    Returns
+    -------
+    str
+        the path with field of view selection.
+    """
+    return path + '#F' + str(int(field_of_view))
+
+
+def split_field_of_view_path(path):
+    """
+    Split a path created with field_of_view_path() into the image path and the field of view.
+
+    Parameters
+    ----------
+    path: str
+        a path name.
+
+    Returns
+    -------
+    (str, int or None)
+        a tuple (image path, field of view). Field of view is None if `path` does not select a field of view.
+    """
+    m = re.fullmatch(r'(.*)#F(\d+)', path, flags=re.DOTALL)
+    if m is None:
+        return (path, None)
+    return (m.group(1), int(m.group(2)))
+
+
+def expand_fields_of_view(paths):
+    """
+    Replace each multi-position image (F axis with size > 1) by one path per field of view (see field_of_view_path()).
+    Used to fan out the processing of multi-position images, with one independent job per field of view
+    (output files get an "_F<field of view>" suffix, see splitext()).
+    Paths of images with one field of view or that cannot be read are kept as is.
+
+    Parameters
+    ----------
+    paths: list of str
+        image paths.
+
+    Returns
+    -------
+    list of str
+        image paths, with multi-position images expanded.
+    """
+    expanded_paths = []
+    for path in paths:
+        try:
+            n = Image(path).sizes['F']
+        except Exception:
+            n = 1
+        if n > 1 and split_field_of_view_path(path)[1] is None:
+            expanded_paths.extend(field_of_view_path(path, f) for f in range(n))
+        else:
+            expanded_paths.append(path)
+    return expanded_paths
+
+
+def isfile(path):
+    """
+    Same as os.path.isfile() but also return True for OME-Zarr images,
+    which are directories with a .zarr extension (see `zarrtypes`).
+    For paths selecting a single field of view (see field_of_view_path()), check the image path.
+
+    Parameters
+    ----------
+    path: str
+        a path name.
+
+    Returns
+    -------
+    bool
+    """
+    path = split_field_of_view_path(path)[0]
+    return os.path.isfile(path) or (os.path.isdir(path) and splitext(os.path.normpath(path))[1] in zarrtypes)
+
+
+def get_output_extension(output_compression=None):
+    """
+    Return the extension of output images corresponding to output compression settings.
+
+    Parameters
+    ----------
+    output_compression: dict or None
+        output compression settings (see get_tifffile_kwargs()).
+
+    Returns
+    -------
+    str
+        '.ome.tif' or '.ome.zarr'.
+    """
+    if output_compression is None:
+        return output_formats['OME-TIFF']
+    output_format = output_compression.get('format', 'OME-TIFF')
+    if output_format not in output_formats:
+        logging.getLogger(__name__).error('Invalid output format %s', output_format)
+        raise ValueError(f"Invalid output format {output_format}")
+    return output_formats[output_format]
+
+
+def get_tifffile_kwargs(output_compression=None):
+    """
+    Return tifffile.TiffWriter.write() keyword arguments corresponding to output compression settings.
+
+    Parameters
+    ----------
+    output_compression: dict or None
+        output compression settings, with keys 'compression' (a key of `output_compressions`)
+        and 'tiled' (bool). If None, use zlib compression without tiling.
+        Optional keys 'format' (a key of `output_formats`, default 'OME-TIFF') and 'levels'
+        (number of multiscale levels, default 1) are only used for OME-Zarr output (see OmeZarrStreamWriter).
+
+    Returns
+    -------
+    dict
+        keyword arguments for tifffile.TiffWriter.write() (or tifffile_kwargs for bioio OmeTiffWriter.save()).
+    """
+    if output_compression is None:
+        output_compression = {'compression': 'zlib', 'tiled': False}
+    if output_compression['compression'] not in output_compressions:
+        logging.getLogger(__name__).error('Invalid output compression %s', output_compression['compression'])
+        raise ValueError(f"Invalid output compression {output_compression['compression']}")
+    kwargs = dict(output_compressions[output_compression['compression']])
+    if output_compression['tiled']:
+        kwargs['tile'] = output_tile_shape
+    return kwargs
+
+
+def _metadata_cache_path(path):
+    """
+    Return the path to the metadata cache file for image `path`.
+    """
+    key = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()
+    return os.path.join(metadata_cache_folder, key[:2], key+'.json')
+
+
+def read_metadata_cache(path):
+    """
+    Read cached metadata for image `path`.
+
+    Parameters
+    ----------
+    path: str
+        image path.
+
+    Returns
+    -------
+    dict or None
+        cached metadata (keys 'sizes', 'dtype', 'channel_names', 'physical_pixel_sizes' and 'vlabapp_annotations')
+        or None if caching is disabled, if the image is not in the cache or if the image was modified since it was cached
+        (different file size or modification time).
+    """
+    # OME-Zarr images (directories) are not cached: their modification time is not updated when the image is rewritten
+    if metadata_cache_folder is None or os.path.isdir(path):
+        return None
+    try:
+        stat = os.stat(path)
+        with open(_metadata_cache_path(path), 'r') as f:
+            metadata = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if metadata.get('version') != metadata_cache_version or metadata.get('path') != os.path.abspath(path) or metadata.get('size') != stat.st_size or metadata.get('mtime_ns') != stat.st_mtime_ns:
+        return None
+    return metadata
+
+
+def write_metadata_cache(path, metadata):
+    """
+    Save metadata for image `path` to the cache.
+    Errors are logged (DEBUG level) and ignored.
+
+    Parameters
+    ----------
+    path: str
+        image path.
+    metadata: dict
+        metadata (keys 'sizes', 'dtype', 'channel_names', 'physical_pixel_sizes' and 'vlabapp_annotations').
+    """
+    if metadata_cache_folder is None or os.path.isdir(path):
+        return
+    try:
+        stat = os.stat(path)
+        metadata = dict(metadata, version=metadata_cache_version, path=os.path.abspath(path), size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+        cache_path = _metadata_cache_path(path)
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        # write to a temporary file and rename it, to avoid partially written files when multiple processes write the same entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(metadata, f)
+            os.replace(tmp_path, cache_path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+    except (OSError, TypeError, ValueError):
+        logging.getLogger(__name__).debug('Cannot write metadata cache for %s', path, exc_info=True)
+
+
+def stage_image(path):
+    """
+    Return the path to a local copy of image `path` in `staging_folder`, copying the image if needed.
+    Copies are identified by image path, file size and modification time (modified images are copied again)
+    and the least recently used copies are removed when the total size exceeds `staging_max_size`.
+    Errors are logged (WARNING level) and ignored.
+
+    Parameters
+    ----------
+    path: str
+        image path.
+
+    Returns
+    -------
+    str
+        path to the local copy, or `path` if staging is disabled, if the image is a directory (OME-Zarr),
+        if the image is larger than `staging_max_size` or if staging failed.
+    """
+    if staging_folder is None or not os.path.isfile(path):
+        return path
+    try:
+        stat = os.stat(path)
+        if stat.st_size > staging_max_size:
+            return path
+        key = hashlib.sha1(f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}".encode('utf-8')).hexdigest()
+        staged_path = os.path.join(staging_folder, key + splitext(path)[1])
+        if os.path.isfile(staged_path):
+            # update modification time, used to find least recently used copies
+            os.utime(staged_path)
+            return staged_path
+        os.makedirs(staging_folder, exist_ok=True)
+        # remove least recently used copies
+        staged_files = []
+        for entry in os.scandir(staging_folder):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                entry_stat = entry.stat()
+                staged_files.append((entry_stat.st_mtime_ns, entry_stat.st_size, entry.path))
+        staged_files.sort()
+        total_size = sum(x[1] for x in staged_files)
+        while staged_files and total_size + stat.st_size > staging_max_size:
+            _, size, staged_file = staged_files.pop(0)
+            try:
+                os.remove(staged_file)
+                total_size -= size
+            except OSError:
+                # e.g. file opened by another process (Windows)
+                pass
+        logging.getLogger(__name__).info('Staging %s to %s', path, staged_path)
+        # copy to a temporary file and rename it, to avoid partially copied files when multiple processes stage the same image
+        fd, tmp_path = tempfile.mkstemp(dir=staging_folder, suffix='.tmp')
+        os.close(fd)
+        try:
+            shutil.copyfile(path, tmp_path)
+            os.replace(tmp_path, staged_path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        return staged_path
+    except OSError:
+        logging.getLogger(__name__).warning('Cannot stage %s, reading from original location', path, exc_info=True)
+        return path
+
+
+def _reset_prefetch():
+    # threads are not inherited by forked processes (e.g. process pool workers)
+    global _prefetch_executor
+    _prefetch_executor = None
+    _prefetched_images.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_prefetch)
+
+
+def split_projection_type(projection_type):
+    """
+    Split a z-projection type into its name and parameter (see Image.z_projection()).
+
+    Parameters
+    ----------
+    projection_type: str
+        the projection type (max, min, std, avg, mean, median, percentile:<p> or trimmed_mean:<p>).
+
+    Returns
+    -------
+    str
+        projection type name (max, min, std, avg, mean, median, percentile or trimmed_mean).
+    float or None
+        projection type parameter (percentile or percentage trimmed at each end), None if not relevant.
+        Raise ValueError if the projection type is not valid.
+    """
+    if projection_type in ['max', 'min', 'std', 'avg', 'mean', 'median']:
+        return projection_type, None
+    m = re.fullmatch(r'(percentile|trimmed_mean):(\d+(?:\.\d*)?)', str(projection_type))
+    if m is None:
+        raise ValueError(f"Invalid projection type {projection_type}")
+    parameter = float(m.group(2))
+    if (m.group(1) == 'percentile' and parameter > 100) or (m.group(1) == 'trimmed_mean' and parameter >= 50):
+        raise ValueError(f"Invalid projection type {projection_type}")
+    return m.group(1), parameter
+
+
+def _focus_cache_path(path, focus_method):
+    """
+    Return the path to the focus cache file for image `path` and focus method `focus_method`.
+    """
+    key = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()
+    return os.path.join(focus_cache_folder, key[:2], key+'_'+focus_method+'.npz')
+
+
+def read_focus_cache(path, focus_method, shape):
+    """
+    Read cached sharpness of the z sections of image `path`.
+
+    Parameters
+    ----------
+    path: str
+        image path.
+    focus_method: str
+        focus method used to estimate sharpness (see Image.z_projection()).
+    shape: tuple of int
+        image shape (F, T, C, Z) in the file.
+
+    Returns
+    -------
+    ndarray or None
+        sharpness with shape `shape` (NaN for z sections not in the cache)
+        or None if caching is disabled, if the image is not in the cache or if the image was modified since it was cached
+        (different file size or modification time).
+    """
+    # OME-Zarr images (directories) are not cached: their modification time is not updated when the image is rewritten
+    if focus_cache_folder is None or os.path.isdir(path):
+        return None
+    try:
+        stat = os.stat(path)
+        with np.load(_focus_cache_path(path, focus_method), allow_pickle=False) as cache:
+            if int(cache['version']) != focus_cache_version or str(cache['path']) != os.path.abspath(path) or int(cache['size']) != stat.st_size or int(cache['mtime_ns']) != stat.st_mtime_ns:
+                return None
+            sharpness = cache['sharpness']
+    except (OSError, ValueError, KeyError):
+        return None
+    if sharpness.shape != tuple(shape):
+        return None
+    return sharpness
+
+
+def write_focus_cache(path, focus_method, sharpness):
+    """
+    Save sharpness of the z sections of image `path` to the cache, merged with already cached values.
+    Errors are logged (DEBUG level) and ignored.
+
+    Parameters
+    ----------
+    path: str
+        image path.
+    focus_method: str
+        focus method used to estimate sharpness (see Image.z_projection()).
+    sharpness: ndarray
+        sharpness with shape (F, T, C, Z) (image shape in the file), NaN for unknown values.
+    """
+    if focus_cache_folder is None or os.path.isdir(path):
+        return
+    try:
+        cached_sharpness = read_focus_cache(path, focus_method, sharpness.shape)
+        if cached_sharpness is not None:
+            # keep values cached in the meantime (e.g. by another process)
+            sharpness = np.where(np.isnan(sharpness), cached_sharpness, sharpness)
+        stat = os.stat(path)
+        cache_path = _focus_cache_path(path, focus_method)
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        # write to a temporary file and rename it, to avoid partially written files when multiple processes write the same entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, version=focus_cache_version, path=os.path.abspath(path), size=stat.st_size, mtime_ns=stat.st_mtime_ns, sharpness=sharpness)
+            os.replace(tmp_path, cache_path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+    except (OSError, ValueError):
+        logging.getLogger(__name__).debug('Cannot write focus cache for %s', path, exc_info=True)
+
+
+def _file_signature(path):
+    stat = os.stat(split_field_of_view_path(path)[0])
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+def _read_prefetched_image(path):
+    image = Image(path)
+    image._use_prefetched = False
+    return image.imread()
+
+
+def prefetch_image(path, memory_budget=None):
+    """
+    Start reading image `path` in a background thread.
+    The next call to Image(path).imread() (without lazy=True) in the same process uses the prefetched data
+    instead of reading the file, waiting for the background thread to finish if needed.
+    Prefetched data are discarded if the file was modified in between.
+
+    Parameters
+    ----------
+    path: str
+        image path.
+    memory_budget: int or None
+        maximum total size (in bytes) of prefetched images held in memory (None: use `prefetch_memory_budget`).
+
+    Returns
+    -------
+    bool
+        True if the image is being prefetched, False otherwise (image not found or not supported,
+        OME-Zarr image or not enough memory budget).
+    """
+    global _prefetch_executor
+    if memory_budget is None:
+        memory_budget = prefetch_memory_budget
+    if path in _prefetched_images:
+        return True
+    # OME-Zarr images are not prefetched: their modification time is not updated when the image is rewritten
+    if not os.path.isfile(split_field_of_view_path(path)[0]):
+        return False
+    try:
+        signature = _file_signature(path)
+        image = Image(path)
+    except Exception:
+        return False
+    nbytes = int(np.prod(image.shape)) * np.dtype(image.dtype).itemsize
+    if nbytes + sum(x['nbytes'] for x in _prefetched_images.values()) > memory_budget:
+        return False
+    if _prefetch_executor is None:
+        _prefetch_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='prefetch')
+    _prefetched_images[path] = {'signature': signature,
+                                'nbytes': nbytes,
+                                'future': _prefetch_executor.submit(_read_prefetched_image, path)}
+    return True
+
+
+def pop_prefetched_image(path):
+    """
+    Remove image `path` from the prefetched images and return its data.
+
+    Parameters
+    ----------
+    path: str
+        image path.
+
+    Returns
+    -------
+    ndarray or None
+        the 6D image (FTCZYX) or None if the image was not prefetched, if reading failed or if the file was modified.
+    """
+    prefetched = _prefetched_images.pop(path, None)
+    if prefetched is None:
+        return None
+    try:
+        image = prefetched['future'].result()
+        if _file_signature(path) != prefetched['signature']:
+            return None
+    except Exception:
+        # errors are reported when reading the file again
+        return None
+    return image
+
+
+def clear_prefetched_images(keep=()):
+    """
+    Discard prefetched images.
+
+    Parameters
+    ----------
+    keep: list of str
+        paths of prefetched images to keep.
+    """
+    for path in list(_prefetched_images.keys()):
+        if path not in keep:
+            prefetched = _prefetched_images.pop(path)
+            prefetched['future'].cancel()
+
+
+def prefetch_images(paths, memory_budget=None):
+    """
+    Iterate over `paths`, reading the next images in a background thread (see prefetch_image())
+    while the current image is processed. Images are prefetched in order, as long as they fit in the memory budget.
+
+    Parameters
+    ----------
+    paths: list of str
+        image paths.
+    memory_budget: int or None
+        maximum total size (in bytes) of prefetched images held in memory (None: use `prefetch_memory_budget`).
+
+    Yields
+    ------
+    str
+        image path, to be read with Image(path).imread().
+
+    Examples
+    --------
+    >>> for path in prefetch_images(paths):
+    ...     image = Image(path)
+    ...     image.imread()
+    ...     process(image)
+    """
+    try:
+        for i, path in enumerate(paths):
+            for next_path in paths[i:]:
+                if not prefetch_image(next_path, memory_budget):
+                    break
+            yield path
+            # discard the current image if it was not used
+            clear_prefetched_images(keep=paths[i+1:])
+    finally:
+        clear_prefetched_images()
+
+
+def run_prefetched(function, arguments, prefetch_path=None):
+    """
+    Call function(*arguments) while the image `prefetch_path` (e.g. input image of the next job) is read in a background thread.
+    Used to overlap reading and processing of successive jobs run by the same process (e.g. in a process pool).
+    Prefetched images that were not used (e.g. prefetched for a job run by another process) are discarded,
+    except the one for the current job (first argument).
+
+    Parameters
+    ----------
+    function: callable
+        the function to call (e.g. a module main function).
+    arguments: tuple
+        function arguments. The first argument is the input image path.
+    prefetch_path: str or None
+        path of the image to prefetch.
+
+    Returns
+    -------
+    the value returned by function.
+    """
+    clear_prefetched_images(keep=arguments[:1])
+    if prefetch_path is not None:
+        prefetch_image(prefetch_path)
+    return function(*arguments)
+
+
 class CollapsibleWidget(QWidget):
     def __init__(self, text, parent=None, collapsed_icon="▶", expanded_icon="▼", expanded=True):
         super().__init__(parent)
@@ -352,11 +969,11 @@ class DropFilesTableWidget2(QTableWidget):
     def dropEvent(self, event):
         for url in event.mimeData().urls():
             if url.isLocalFile():
-                if os.path.isfile(url.toLocalFile()):
+                if isfile(url.toLocalFile()):
                     self.add_files([url.toLocalFile()])
-                if os.path.isdir(url.toLocalFile()):
+                elif os.path.isdir(url.toLocalFile()):
                     d = url.toLocalFile()
-                    # keep only files (not folders)
+                    # keep only files (not folders, except OME-Zarr images)
                     self.add_files([os.path.join(d, f) for f in os.listdir(d)])
 
     def remove_selected(self):
@@ -490,20 +1107,20 @@ class FileTableWidget2(QWidget):
             if re.search(re_pattern, file_path):
                 basename = re.sub(re_pattern, '', file_path)
                 path_1 = os.path.normpath(file_path)
-                if os.path.isfile(basename + self.suffix_2.text()):
+                if isfile(basename + self.suffix_2.text()):
                     path_2 = os.path.normpath(basename + self.suffix_2.text())
             re_pattern = self.suffix_2.text() + '$'
             if re.search(re_pattern, file_path):
                 basename = re.sub(re_pattern, '', file_path)
                 path_2 = os.path.normpath(file_path)
-                if os.path.isfile(basename + self.suffix_1.text()):
+                if isfile(basename + self.suffix_1.text()):
                     path_1 = os.path.normpath(basename + self.suffix_1.text())
             if path_1 is not None and path_2 is not None:
                 if self.filter_name.text() in os.path.basename(path_1) and self.filter_name.text() in os.path.basename(path_2):
                     if self.filter_name_exclude.text() == '' or (not self.filter_name_exclude.text() in os.path.basename(path_1) and self.filter_name_exclude.text() not in os.path.basename(path_2)):
                         if len(self.file_table.findItems(path_2, Qt.MatchExactly)) == 0 and len(self.file_table.findItems(path_1, Qt.MatchExactly)) == 0:
                             if (path_1, path_2) not in filtered_filenames:
-                                if os.path.isfile(path_1) and os.path.isfile(path_1):
+                                if isfile(path_1) and isfile(path_2):
                                     filtered_filenames.append((path_1, path_2))
         return filtered_filenames
 
@@ -623,7 +1240,7 @@ class ImageMatrixTableWidget2(QWidget):
             if len(self.filetypes.text().split()) == 0 or splitext(image_path)[1] in self.filetypes.text().split():
                 if self.filter_name.text() in os.path.basename(image_path):
                     if self.filter_name_exclude.text() == '' or self.filter_name_exclude.text() not in os.path.basename(image_path):
-                        if os.path.isfile(image_path):
+                        if isfile(image_path):
                             if len(self.file_table.findItems(image_path, Qt.MatchExactly)) == 0:
                                 # search for candidate registration matrix paths
                                 candidate_paths = [path for path in os.listdir(os.path.dirname(image_path)) if any(path.endswith(matricestype) for matricestype in matrixtypes) and output_suffixes['registration'] in path and os.path.basename(path).split('_')[0] == splitext(os.path.basename(image_path))[0].split('_')[0]]
@@ -709,11 +1326,11 @@ class DropFilesListWidget(QListWidget):
     def dropEvent(self, event):
         for url in event.mimeData().urls():
             if url.isLocalFile():
-                if os.path.isfile(url.toLocalFile()):
+                if isfile(url.toLocalFile()):
                     self.add_files([url.toLocalFile()])
-                if os.path.isdir(url.toLocalFile()):
+                elif os.path.isdir(url.toLocalFile()):
                     d = url.toLocalFile()
-                    # keep only files (not folders)
+                    # keep only files (not folders, except OME-Zarr images)
                     self.add_files([os.path.join(d, f) for f in os.listdir(d)])
 
     def remove_selected(self):
@@ -826,7 +1443,7 @@ class FileListWidget(QWidget):
             if len(self.filetypes.text().split()) == 0 or splitext(file_path)[1] in self.filetypes.text().split():
                 if self.filter_name.text() in os.path.basename(file_path):
                     if self.filter_name_exclude.text() == '' or self.filter_name_exclude.text() not in os.path.basename(file_path):
-                        if os.path.isfile(file_path):
+                        if isfile(file_path):
                             if len(self.file_list.findItems(file_path, Qt.MatchExactly)) == 0:
                                 if file_path not in filtered_filenames:
                                     filtered_filenames.append(file_path)
@@ -1000,8 +1617,8 @@ class DropFileLineEdit(QLineEdit):
     def dropEvent(self, event):
         for url in event.mimeData().urls():
             if url.isLocalFile():
-                if os.path.isfile(url.toLocalFile()):
-                    filename = url.toLocalFile()
+                if isfile(url.toLocalFile()):
+                    filename = os.path.normpath(url.toLocalFile())
                     if self.filetypes is None or len(self.filetypes) == 0 or splitext(filename)[1] in self.filetypes:
                         self.setText(os.path.normpath(filename))
 
@@ -1186,7 +1803,7 @@ class OutputSettings(QWidget):
     A QWidget to enter output settings.
     """
 
-    def __init__(self, parent=None, output_suffix='', extensions=None, pipeline_layout=False):
+    def __init__(self, parent=None, output_suffix='', extensions=None, pipeline_layout=False, allow_zarr=False):
         """
         Parameters
         ----------
@@ -1196,7 +1813,10 @@ class OutputSettings(QWidget):
             list of filename extensions including the '.' (one extension per output file). E.g. ['.csv','.ome.tif'].
             Only used to display output filenames.
         pipeline_layout: bool
-            the widget is used in the pipeline module and the choice of folder is not shown.
+            the widget is used in the pipeline module and the choice of folder and output compression is not shown
+            (output compression is chosen in pipeline settings).
+        allow_zarr: bool
+            allow OME-Zarr output format (instead of OME-TIFF). Only for modules saving images with open_image_writer().
         """
         super().__init__(parent)
 
@@ -1225,6 +1845,8 @@ class OutputSettings(QWidget):
             label.setEnabled(False)
             label.textChanged.connect(label.setToolTip)
             self.output_filename_labels.append(label)
+        self.output_compression = OutputCompressionSettings(allow_zarr=allow_zarr)
+        self.output_compression.changed.connect(self.update_output_filename_labels)
 
         layout = QVBoxLayout()
         if not self.pipeline_layout:
@@ -1249,6 +1871,8 @@ class OutputSettings(QWidget):
         for label in self.output_filename_labels:
             layout3.addWidget(label)
         layout2.addRow("Filename:", layout3)
+        if not self.pipeline_layout and '.ome.tif' in self.extensions:
+            layout2.addRow("Format:" if allow_zarr else "Compression:", self.output_compression)
         layout.addLayout(layout2)
         layout.setContentsMargins(0, 0, 0, 0)
         self.setLayout(layout)
@@ -1263,6 +1887,8 @@ class OutputSettings(QWidget):
             output_path = os.path.abspath(self.output_folder.text())
 
         for label, extension in zip(self.output_filename_labels, self.extensions):
+            if extension == '.ome.tif' and not self.pipeline_layout:
+                extension = get_output_extension(self.output_compression.get_output_compression())
             label.setText(os.path.normpath(os.path.join(output_path, "<input basename>" + self.output_suffix + self.output_user_suffix.text() + extension)))
 
     def get_basename(self, input_filename):
@@ -1274,14 +1900,92 @@ class OutputSettings(QWidget):
         else:
             return self.output_folder.text()
 
+    def get_output_compression(self):
+        return self.output_compression.get_output_compression()
+
+
+class OutputCompressionSettings(QWidget):
+    """
+    A QWidget to choose format, compression (and tiling) of output images.
+    """
+    changed = pyqtSignal()
+
+    def __init__(self, parent=None, allow_zarr=True):
+        """
+        Parameters
+        ----------
+        allow_zarr: bool
+            allow OME-Zarr output format. If False, the format is not shown (always OME-TIFF).
+        """
+        super().__init__(parent)
+
+        self.format = QComboBox()
+        self.format.addItems(list(output_formats.keys()))
+        self.format.setCurrentText('OME-TIFF')
+        self.format.setToolTip('Format of output images. OME-Zarr images are saved as folders, chunked along time axis.\nOnly used by registration, z-projection, segmentation and image cropping modules (other modules save OME-TIFF images).')
+        self.format.currentTextChanged.connect(self.format_changed)
+        self.compression = QComboBox()
+        self.compression.addItems(list(output_compressions.keys()))
+        self.compression.setCurrentText('zlib')
+        self.compression.setToolTip('Compression of output images (lossless). zstd is usually faster than zlib, LZW with predictor works well for segmentation masks (OME-TIFF only).')
+        self.tiled = QCheckBox('Tiled')
+        self.tiled.setToolTip('Save output images as '+str(output_tile_shape[0])+'x'+str(output_tile_shape[1])+' tiles.')
+        self.tiled.setChecked(False)
+        self.levels = QSpinBox()
+        self.levels.setMinimum(1)
+        self.levels.setMaximum(8)
+        self.levels.setValue(1)
+        self.levels.setPrefix('Levels: ')
+        self.levels.setToolTip('Number of multiscale levels (OME-Zarr only). Each level is downsampled by a factor 2 in X and Y.')
+
+        layout = QHBoxLayout()
+        if allow_zarr:
+            layout.addWidget(self.format, stretch=1)
+        else:
+            self.format.setVisible(False)
+        layout.addWidget(self.compression, stretch=1)
+        layout.addWidget(self.tiled)
+        layout.addWidget(self.levels)
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.setLayout(layout)
+        self.format_changed()
+
+    def format_changed(self):
+        zarr_format = self.format.currentText() == 'OME-Zarr'
+        for i in range(self.compression.count()):
+            self.compression.model().item(i).setEnabled(not zarr_format or self.compression.itemText(i) in output_zarr_compressors)
+        if zarr_format and self.compression.currentText() not in output_zarr_compressors:
+            self.compression.setCurrentText('zstd')
+        self.levels.setVisible(zarr_format)
+        self.changed.emit()
+
+    def get_output_compression(self):
+        """
+        Return output compression settings (see get_tifffile_kwargs()).
+        """
+        return {'format': self.format.currentText(), 'compression': self.compression.currentText(), 'tiled': self.tiled.isChecked(), 'levels': self.levels.value()}
+
+    def set_output_compression(self, output_compression):
+        self.format.setCurrentText(output_compression.get('format', 'OME-TIFF'))
+        self.compression.setCurrentText(output_compression['compression'])
+        self.tiled.setChecked(output_compression['tiled'])
+        self.levels.setValue(output_compression.get('levels', 1))
+
 
 class ZProjectionSettings(QWidget):
     """
     A QWidget to enter Z-projection settings.
+
+    Parameters
+    ----------
+    show_focus_channel: bool
+        show the channel used to estimate the Z section with best focus (otherwise, best focus is estimated for each channel).
+    show_focus_tracking: bool
+        show best focus tracking settings (otherwise, best focus is searched over all z sections).
     """
     changed = pyqtSignal()
 
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, show_focus_channel=False, show_focus_tracking=False):
         super().__init__(parent)
 
         # only bestZ
@@ -1321,9 +2025,47 @@ class ZProjectionSettings(QWidget):
         self.projection_type.addItem("mean")
         self.projection_type.addItem("median")
         self.projection_type.addItem("std")
+        self.projection_type.addItem("percentile")
+        self.projection_type.addItem("trimmed_mean")
         self.projection_type.setCurrentText("mean")
         self.projection_type.setDisabled(self.projection_mode_bestZ.isChecked())
         self.projection_mode_bestZ.toggled.connect(self.projection_type.setDisabled)
+        # Percentile (percentile) or percentage trimmed at each end (trimmed_mean)
+        self.projection_type_parameter = QSpinBox()
+        self.projection_type_parameter.setMinimum(0)
+        self.projection_type_parameter.setMaximum(100)
+        self.projection_type_parameter.setValue(25)
+        self.projection_type_parameter.setSuffix(" %")
+        self.projection_type_parameter.setToolTip('percentile: percentile to project.\ntrimmed_mean: percentage of lowest and highest values removed before averaging.')
+        self.projection_type_parameter.setDisabled(self.projection_mode_bestZ.isChecked())
+        self.projection_mode_bestZ.toggled.connect(self.projection_type_parameter.setDisabled)
+        self.projection_type.currentTextChanged.connect(self.projection_type_changed)
+        # Number of threads
+        self.nthreads = QSpinBox()
+        self.nthreads.setMinimum(1)
+        self.nthreads.setMaximum(os.cpu_count())
+        self.nthreads.setValue(1)
+        self.nthreads.setToolTip('Number of threads used to project time frames concurrently (per process).')
+        # Channel used to estimate best focus
+        self.focus_channel = QSpinBox()
+        self.focus_channel.setMinimum(-1)
+        self.focus_channel.setMaximum(99)
+        self.focus_channel.setSpecialValueText("Each channel")
+        self.focus_channel.setValue(-1)
+        self.focus_channel.setToolTip('Position of the channel used to estimate the Z section with best focus, applied to all channels (e.g. bright-field channel, for co-focal channels).\n"Each channel": estimate the Z section with best focus independently for each channel.')
+        self.focus_channel.setEnabled(self.projection_mode_bestZ.isChecked() or self.projection_mode_around_bestZ.isChecked())
+        self.projection_mode_bestZ.toggled.connect(lambda: self.focus_channel.setEnabled(self.projection_mode_bestZ.isChecked() or self.projection_mode_around_bestZ.isChecked()))
+        self.projection_mode_around_bestZ.toggled.connect(lambda: self.focus_channel.setEnabled(self.projection_mode_bestZ.isChecked() or self.projection_mode_around_bestZ.isChecked()))
+        # Best focus tracking
+        self.focus_tracking = QSpinBox()
+        self.focus_tracking.setMinimum(0)
+        self.focus_tracking.setMaximum(99)
+        self.focus_tracking.setSpecialValueText("Off")
+        self.focus_tracking.setValue(0)
+        self.focus_tracking.setToolTip(f'Track the Z section with best focus over time: only search for best focus within this range around the Z section with best focus in the previous time frame.\nBest focus is searched over all Z sections for the first time frame, every {focus_tracking_interval} time frames and when best focus is at the border of the range.\n"Off": search for best focus over all Z sections for every time frame.')
+        self.focus_tracking.setEnabled(self.projection_mode_bestZ.isChecked() or self.projection_mode_around_bestZ.isChecked())
+        self.projection_mode_bestZ.toggled.connect(lambda: self.focus_tracking.setEnabled(self.projection_mode_bestZ.isChecked() or self.projection_mode_around_bestZ.isChecked()))
+        self.projection_mode_around_bestZ.toggled.connect(lambda: self.focus_tracking.setEnabled(self.projection_mode_bestZ.isChecked() or self.projection_mode_around_bestZ.isChecked()))
 
         self.projection_mode_around_bestZ.toggled.connect(self.changed)
         self.projection_mode_around_bestZ_zrange.valueChanged.connect(self.changed)
@@ -1332,6 +2074,9 @@ class ZProjectionSettings(QWidget):
         self.projection_mode_fixed_zmax.valueChanged.connect(self.changed)
         self.projection_mode_all.toggled.connect(self.changed)
         self.projection_type.currentTextChanged.connect(self.changed)
+        self.projection_type_parameter.valueChanged.connect(self.changed)
+        self.focus_channel.valueChanged.connect(self.changed)
+        self.focus_tracking.valueChanged.connect(self.changed)
 
         layout = QFormLayout()
         # Z-Projection range
@@ -1365,6 +2110,14 @@ class ZProjectionSettings(QWidget):
         widget.setLayout(layout2)
         layout.addRow("Projection range:", widget)
         layout.addRow("Projection type:", self.projection_type)
+        layout.addRow("Percentile:", self.projection_type_parameter)
+        self.projection_type_parameter_label = layout.labelForField(self.projection_type_parameter)
+        self.projection_type_changed(self.projection_type.currentText())
+        if show_focus_channel:
+            layout.addRow("Best focus channel:", self.focus_channel)
+        if show_focus_tracking:
+            layout.addRow("Best focus tracking range:", self.focus_tracking)
+        layout.addRow("Number of threads:", self.nthreads)
 
         layout.setContentsMargins(0, 0, 0, 0)
         self.setLayout(layout)
@@ -1375,9 +2128,27 @@ class ZProjectionSettings(QWidget):
     def projection_mode_fixed_zmax_changed(self, value):
         self.projection_mode_fixed_zmin.setMaximum(value)
 
+    def projection_type_changed(self, projection_type):
+        self.projection_type_parameter.setVisible(projection_type in ['percentile', 'trimmed_mean'])
+        self.projection_type_parameter_label.setVisible(projection_type in ['percentile', 'trimmed_mean'])
+        if projection_type == 'trimmed_mean':
+            self.projection_type_parameter_label.setText("Trimmed at each end:")
+            self.projection_type_parameter.setMaximum(49)
+        else:
+            self.projection_type_parameter_label.setText("Percentile:")
+            self.projection_type_parameter.setMaximum(100)
+
     def get_projection_type(self):
+        if self.projection_type.currentText() in ['percentile', 'trimmed_mean']:
+            return self.projection_type.currentText() + ':' + str(self.projection_type_parameter.value())
         return self.projection_type.currentText()
 
+    def set_projection_type(self, projection_type):
+        projection_type, parameter = split_projection_type(projection_type)
+        self.projection_type.setCurrentText(projection_type)
+        if parameter is not None:
+            self.projection_type_parameter.setValue(int(parameter))
+
     def get_projection_zrange(self):
         if self.projection_mode_bestZ.isChecked():
             projection_zrange = 0
@@ -1389,6 +2160,19 @@ class ZProjectionSettings(QWidget):
             projection_zrange = None
         return projection_zrange
 
+    def get_nthreads(self):
+        return self.nthreads.value()
+
+    def get_focus_channel(self):
+        if self.focus_channel.value() < 0:
+            return None
+        return self.focus_channel.value()
+
+    def get_focus_tracking(self):
+        if self.focus_tracking.value() == 0:
+            return None
+        return self.focus_tracking.value()
+
 
 class Page(QWidget):
     def __init__(self, parent=None, widget=None, add_stretch=True):
@@ -1418,6 +2202,10 @@ class Image:
     ----------
     path : str
         path to the image
+    field_of_view : int
+        field of view selected with a field of view path (see field_of_view_path()), None otherwise.
+        When set, the image is restricted to this field of view (F axis with size 1)
+        and only the corresponding frames are read.
     basename : str
         image name with extension
     name : str
@@ -1428,7 +2216,7 @@ class Image:
         dictionary with dimesions names and values
         # eg. {'F': 1, 'T': 1, 'C': 3, 'Z': 11, 'Y': 2048, 'X': 2048}
     image : ndarray
-        numpy ndarray with the image
+        numpy ndarray with the image (numpy memmap or dask array if read with imread(lazy=True))
     shape : list
         list with image shapes
     dtype: np.dtype
@@ -1438,15 +2226,25 @@ class Image:
     physical_pixel_sizes : tuple
         tuple with physical pixel sizes in x, y and z direction (in micrometer). (None,None,None) if not available.
     ome_metadata : ome_types.model.ome.OME
-        ome metadata. None if not available.
+        ome metadata. None if not available. Parsed on first access if attributes were read from the metadata cache.
+    vlabapp_annotations : list of str
+        VLabApp metadata (content of ome metadata comment annotations with namespace "VLabApp").
+    decode_threads : int
+        number of threads used to decode image data (compressed tiff pages, nd2 frames and zarr chunks).
+        None: use module default `decode_threads`.
 
     Methods
     -------
     __init__()
         Set the 'path' and populate attributes sizes and shape.
-    imread()
+        Attributes are read from the metadata cache if available and up to date (see metadata_cache_folder).
+    imread(lazy, F, T, C, Z)
         Read the image from the already setted 'path'.
         Attribute image is populated here.
+        If lazy is True, image is a memory-mapped or chunk-backed 6D array and data are read from disk only when accessed.
+        F, T, C, Z (int or slice) restrict the reading to the selected planes.
+    read_planes(F, T, C, Z)
+        Iterate over the (selected) YX planes, reading one plane at a time.
     save()
         Empty
     get_TYXarray()
@@ -1454,17 +2252,20 @@ class Image:
         When used the other dimensions F,C,Z MUST be empty (with size = 1)
     z_projection(projection_type, zrange,focus_method)
         Return the z-projection of the image using the selected projection type over the range of z values defined by zrange.
-        Possible projection types: max, min, std, avg (or mean), median.
+        Possible projection types: max, min, std, avg (or mean), median, percentile:<p>, trimmed_mean:<p>.
         If zrange is None, use all Z values. If zrange is an integer, use z values in [z_best-zrange,z_best+zrange],
         where z_best is the Z corresponding to best focus. If zrange is a tuple of lenght 2 (zmin,zmax), use z values in [zmin,zmax].
         Possible focus_methods: tenengrad_var, laplacian_var, std.
+    z_projection_frames(projection_type, zrange, focus_method)
+        Same as z_projection(), but iterate over projected time frames, projecting one time frame at a time.
     crop(axis, start, end)
         crop axis ('F', 'T', 'C', 'Z', 'Y' or 'X') to start:end in-place.
     """
 
-    def __init__(self, im_path):
-        self.path = im_path
-        self.basename = os.path.basename(self.path)
+    def __init__(self, im_path, decode_threads=None):
+        self.path, self.field_of_view = split_field_of_view_path(im_path)
+        self.decode_threads = decode_threads
+        self.basename = os.path.basename(im_path)
         self.name, self.extension = splitext(self.basename)
         self.sizes = None
         self.image = None
@@ -1473,13 +2274,56 @@ class Image:
         self._axes = 'FTCZYX'
         self.channel_names = None
         self.physical_pixel_sizes = (None, None, None)
-        self.ome_metadata = None
+        self.vlabapp_annotations = []
+        self._ome_metadata = None
+        self._use_prefetched = True
+        # indices in the file of the F, T, C and Z planes of attribute image (see imread() and crop())
+        self._file_indices = None
+        self._file_shape = None
+        self._focus_cache = None
+        # input image, transformation matrix and crop window of a virtual registered image (see read_attr())
+        self._virtual = None
         self.read_attr()
 
+    @property
+    def ome_metadata(self):
+        # OME-XML can be large (it contains the VLabApp metadata of all previous processing steps),
+        # it is only parsed when needed.
+        if self._ome_metadata is None and self.extension in ['.ome.tif', '.ome.tiff']:
+            self._ome_metadata = BioImage(self.path).ome_metadata
+        elif self._ome_metadata is None and self.extension in zarrtypes:
+            # OME-XML saved by OmeZarrStreamWriter (not part of the OME-Zarr specification)
+            ome_xml_path = os.path.join(self.path, 'OME', 'METADATA.ome.xml')
+            if os.path.isfile(ome_xml_path):
+                self._ome_metadata = from_xml(ome_xml_path)
+        elif self._ome_metadata is None and self.extension in virtualtypes:
+            # VLabApp metadata saved in the descriptor (see write_virtual_registered_image())
+            self._ome_metadata = OME(structured_annotations=[CommentAnnotation(value=x, namespace="VLabApp") for x in self.vlabapp_annotations])
+        return self._ome_metadata
+
+    @ome_metadata.setter
+    def ome_metadata(self, value):
+        self._ome_metadata = value
+
     def read_attr(self):
+        if self.extension in virtualtypes:
+            self._read_virtual_attr()
+            return
+
+        metadata = read_metadata_cache(self.path)
+        if metadata is not None:
+            self.sizes = {a: metadata['sizes'][a] for a in self._axes}
+            self.shape = tuple(self.sizes[a] for a in self._axes)
+            self.dtype = np.dtype(metadata['dtype'])
+            self.channel_names = metadata['channel_names']
+            self.physical_pixel_sizes = tuple(metadata['physical_pixel_sizes'])
+            self.vlabapp_annotations = metadata['vlabapp_annotations']
+            self._select_field_of_view()
+            return
+
         if self.extension == '.nd2':
             reader = nd2.ND2File(self.path)
-            axes_order = str(''.join(list(reader.sizes.keys()))).upper()  # eg. reader.sizes = {'T': 10, 'C': 2, 'Y': 2048, 'X': 2048}
+            axes_order = str(''.join(list(reader.sizes.keys()))).upper().replace('P', 'F')  # eg. reader.sizes = {'P': 4, 'T': 10, 'C': 2, 'Y': 2048, 'X': 2048}, P = positions (fields of view)
             shape = reader.shape
             self.dtype = reader.dtype
             self.channel_names = [x.channel.name for x in reader.metadata.channels]
@@ -1493,15 +2337,22 @@ class Image:
             self.channel_names = reader.channel_names
             self.physical_pixel_sizes = (reader.physical_pixel_sizes.X, reader.physical_pixel_sizes.Y, reader.physical_pixel_sizes.Z)
             self.ome_metadata = reader.ome_metadata
+            self.vlabapp_annotations = [x.value for x in self.ome_metadata.structured_annotations if isinstance(x, CommentAnnotation) and x.namespace == "VLabApp"]
         elif self.extension in ['.tif', '.tiff']:
             reader = tifffile.TiffFile(self.path)
             axes_order = str(reader.series[0].axes).upper()
             shape = reader.series[0].shape
             self.dtype = reader.series[0].dtype
             reader.close()
+        elif self.extension in zarrtypes:
+            array, axes_order, self.channel_names, self.physical_pixel_sizes = self._open_zarr()
+            shape = array.shape
+            self.dtype = np.dtype(array.dtype)
+            if self.ome_metadata is not None:
+                self.vlabapp_annotations = [x.value for x in self.ome_metadata.structured_annotations if isinstance(x, CommentAnnotation) and x.namespace == "VLabApp"]
         else:
-            logging.getLogger(__name__).error('Image format not supported. Please upload a tiff, ome-tiff or nd2 image file.')
-            raise TypeError('Image format not supported. Please upload a tiff, ome-tiff or nd2 image file.')
+            logging.getLogger(__name__).error('Image format not supported. Please upload a tiff, ome-tiff, ome-zarr or nd2 image file.')
+            raise TypeError('Image format not supported. Please upload a tiff, ome-tiff, ome-zarr or nd2 image file.')
 
         self.shape = []
         self.sizes = {}
@@ -1514,52 +2365,322 @@ class Image:
                 self.sizes[a] = 1
         self.shape = tuple(self.shape)
 
-    def imread(self):
-        def set_6Dimage(image, axes):
-            """
-            Return a 6D ndarray of the input image
-            """
-            dimensions = {k: v for v, k in enumerate(self._axes)}
-            # Dictionary with image axes order
-            axes_order = {}
-            for i, char in enumerate(axes):
-                axes_order[char] = i
-            # Mapping for the desired order of dimensions
-            mapping = [axes_order.get(d, None) for d in self._axes]
-            mapping = [i for i in mapping if i is not None]
-            # Rearrange the image array based on the desired order
-            image = np.transpose(image, axes=mapping)
-            # Determine the missing dimensions and reshape the array filling the missing dimensions
-            missing_dims = []
-            for c in self._axes:
-                if c not in axes:
-                    missing_dims.append(c)
-            for dim in missing_dims:
-                position = dimensions[dim]
-                image = np.expand_dims(image, axis=position)
-            return image
-
-        # axis default order: FTCZYX for 6D - F = FieldofView, T = time, C = channels
+        write_metadata_cache(self.path, {'sizes': self.sizes,
+                                         'dtype': np.dtype(self.dtype).str,
+                                         'channel_names': [str(x) for x in self.channel_names] if self.channel_names is not None else None,
+                                         'physical_pixel_sizes': [float(x) if x is not None else None for x in self.physical_pixel_sizes],
+                                         'vlabapp_annotations': self.vlabapp_annotations})
+        self._select_field_of_view()
+
+    def _read_virtual_attr(self):
+        """
+        Read the descriptor of a virtual registered image (see write_virtual_registered_image())
+        and set attributes from the input image, with sizes of the registered (and cropped) image.
+        """
+        descriptor = read_virtual_registered_image(self.path)
+        image = Image(descriptor['image'], decode_threads=self.decode_threads)
+        tmat = descriptor['transformation_matrix']
+        if image.sizes['T'] != tmat.shape[0]:
+            logging.getLogger(__name__).error('Image %s and transformation matrix of virtual registered image %s do not have the same number of time frames', descriptor['image'], self.path)
+            raise TypeError(f"Image {descriptor['image']} and transformation matrix of virtual registered image {self.path} do not have the same number of time frames")
+        t_start, t_end, y_range, x_range = registration_crop_window(tmat, image.sizes['Y'], image.sizes['X'], descriptor['skip_crop'])
+        self._virtual = {'image': image, 'transformation_matrix': tmat, 't_start': t_start, 't_end': t_end, 'y_range': y_range, 'x_range': x_range}
+        self.sizes = dict(image.sizes)
+        self.sizes['T'] = t_end - t_start
+        self.sizes['Y'] = len(y_range)
+        self.sizes['X'] = len(x_range)
+        self.shape = tuple(self.sizes[a] for a in self._axes)
+        self.dtype = image.dtype
+        self.channel_names = list(image.channel_names) if image.channel_names is not None else None
+        self.physical_pixel_sizes = image.physical_pixel_sizes
+        self.vlabapp_annotations = descriptor['metadata']
+        self._select_field_of_view()
+
+    def _select_field_of_view(self):
+        """
+        Restrict sizes and shape to the selected field of view (if any).
+        """
+        if self.field_of_view is None:
+            return
+        self._file_sizes_F = self.sizes['F']
+        if self.field_of_view >= self.sizes['F']:
+            logging.getLogger(__name__).error('Field of view %s out of range for image %s with %s fields of view', self.field_of_view, self.path, self.sizes['F'])
+            raise ValueError(f"Field of view {self.field_of_view} out of range for image {self.path} with {self.sizes['F']} fields of view")
+        self.sizes['F'] = 1
+        self.shape = tuple(self.sizes[a] for a in self._axes)
+
+    def imread(self, lazy=False, F=None, T=None, C=None, Z=None):
+        """
+        Read the image and populate attribute image with a 6D array (FTCZYX).
+
+        Parameters
+        ----------
+        lazy: bool
+            If False, load the whole image in memory (numpy ndarray).
+            If True, return a memory-mapped (numpy memmap) or chunk-backed (dask array) 6D array,
+            with data read from disk only when accessed. Use np.asarray() on a subset of the array
+            (e.g. `np.asarray(image.image[0, t, c, :, :, :])`) to load it in memory.
+        F, T, C, Z: int, slice or None
+            read only the selected indices along the corresponding axis (None: all indices).
+            An integer selects a single index and the axis is kept (with size 1).
+            Only the selected tiff pages, zarr chunks or nd2 frames are decoded.
+            Attributes sizes, shape and channel_names are updated to match the selection.
+
+        If the image was read ahead with prefetch_image(), the prefetched data (in memory) are used.
+        If staging is enabled (see stage_image()), image data are read from a local copy of the image.
+
+        Returns
+        -------
+        ndarray
+            the 6D image.
+        """
+        selection = {'F': F, 'T': T, 'C': C, 'Z': Z}
+        file_shape = None
+        prefetched = None
+        if self._use_prefetched and len(_prefetched_images) > 0:
+            prefetched = pop_prefetched_image(self.path if self.field_of_view is None else field_of_view_path(self.path, self.field_of_view))
+        if prefetched is not None:
+            # image read ahead by prefetch_image()
+            file_shape = prefetched.shape
+            slices = self._selection_slices(prefetched.shape, selection)
+            image = prefetched[slices]
+            if self.channel_names is not None:
+                self.channel_names = self.channel_names[slices[self._axes.index('C')]]
+        elif lazy or any(x is not None for x in selection.values()) or self.field_of_view is not None or self.extension in virtualtypes:
+            # open as memory-mapped or chunk-backed array and only load the selected planes
+            image = self._open_lazy_6D(memmap=lazy)
+            file_shape = image.shape
+            slices = self._selection_slices(image.shape, selection)
+            image = image[slices]
+            if not lazy:
+                image = self._compute(image)
+            if self.channel_names is not None:
+                self.channel_names = self.channel_names[slices[self._axes.index('C')]]
+        elif self.extension == '.nd2':
+            # axis default order: FTCZYX for 6D - F = FieldofView, T = time, C = channels
+            reader = nd2.ND2File(self._data_path())
+            axes_order = str(''.join(list(reader.sizes.keys()))).upper().replace('P', 'F')  # eg. reader.sizes = {'P': 4, 'T': 10, 'C': 2, 'Y': 2048, 'X': 2048}, P = positions (fields of view)
+            if self._get_decode_threads() is not None and self._get_decode_threads() > 1:
+                # read frames in parallel (one chunk per frame)
+                image = self._set_6Dimage(self._compute(reader.to_dask()), axes_order)
+            else:
+                image = self._set_6Dimage(reader.asarray(), axes_order)  # nd2.imread(self.path)
+            reader.close()
+        elif self.extension in ['.tif', '.tiff', '.ome.tif', '.ome.tiff']:
+            # OME-TIFF images are also read with tifffile (same as _open_lazy()), to decode pages with a thread pool
+            reader = tifffile.TiffFile(self._data_path())
+            axes_order = str(reader.series[0].axes).upper()
+            image = self._set_6Dimage(reader.asarray(maxworkers=self._get_decode_threads()), axes_order)
+            reader.close()
+        elif self.extension in zarrtypes:
+            array, axes_order, _, _ = self._open_zarr()
+            if self._get_decode_threads() is not None:
+                image = self._set_6Dimage(self._compute(da.from_zarr(array)), axes_order)
+            else:
+                image = self._set_6Dimage(array[...], axes_order)
+        else:
+            logging.getLogger(__name__).error('Image format not supported. Please upload a tiff, ome-tiff, ome-zarr or nd2 image file.')
+            raise TypeError('Image format not supported. Please upload a tiff, ome-tiff, ome-zarr or nd2 image file.')
+
+        if file_shape is None:
+            # whole image
+            file_shape = image.shape
+            slices = self._selection_slices(image.shape, {})
+        self.image = image
+        self.shape = self.image.shape
+        for i, a in enumerate(self._axes):
+            self.sizes[a] = self.shape[i]
+        # indices (along F, T, C and Z axes) of the image in the file, used to cache the sharpness of z sections
+        self._file_indices = {a: np.arange(n)[s] for a, n, s in zip(self._axes[:4], file_shape[:4], slices[:4])}
+        self._file_shape = file_shape[:4]
+        if self.field_of_view is not None:
+            self._file_indices['F'] += self.field_of_view
+            self._file_shape = (self._file_sizes_F,) + self._file_shape[1:]
+        return self.image
+
+    def read_planes(self, F=None, T=None, C=None, Z=None):
+        """
+        Iterate over the YX planes of the image, reading and decoding one plane at a time.
+        Attribute image is not populated.
+
+        Parameters
+        ----------
+        F, T, C, Z: int, slice or None
+            iterate only over the selected indices along the corresponding axis (None: all indices).
+
+        Yields
+        ------
+        tuple of int
+            indices (f, t, c, z) of the plane in the image.
+        ndarray
+            2D array (YX) with the plane.
+        """
+        image = self._open_lazy_6D(memmap=True)
+        slices = self._selection_slices(image.shape, {'F': F, 'T': T, 'C': C, 'Z': Z})
+        indices = [range(n)[s] for n, s in zip(image.shape[:4], slices[:4])]
+        for f in indices[0]:
+            for t in indices[1]:
+                for c in indices[2]:
+                    for z in indices[3]:
+                        yield (f, t, c, z), np.array(image[f, t, c, z, :, :])
+
+    def _open_lazy(self, memmap=True):
+        """
+        Open the image as a memory-mapped or chunk-backed array (without reading the data).
+
+        Parameters
+        ----------
+        memmap: bool
+            if True, use a numpy memmap for uncompressed tiff images (chunk-backed dask array otherwise).
+
+        Returns
+        -------
+        array
+            the image (numpy memmap or dask array), with axes as in the file.
+        str
+            axes order (e.g. 'TCZYX').
+        """
         if self.extension == '.nd2':
-            reader = nd2.ND2File(self.path)
-            axes_order = str(''.join(list(reader.sizes.keys()))).upper()  # eg. reader.sizes = {'T': 10, 'C': 2, 'Y': 2048, 'X': 2048}
-            image = reader.asarray()  # nd2.imread(self.path)
+            reader = nd2.ND2File(self._data_path())
+            axes_order = str(''.join(list(reader.sizes.keys()))).upper().replace('P', 'F')
+            # the dask array re-opens the file when computing chunks (one chunk per frame)
+            image = reader.to_dask()
             reader.close()
-        elif self.extension in ['.ome.tif', '.ome.tiff']:
-            reader = BioImage(self.path)
-            axes_order = reader.dims.order.upper()
-            image = reader.data
-        elif self.extension in ['.tif', '.tiff']:
-            reader = tifffile.TiffFile(self.path)
+        elif self.extension in ['.tif', '.tiff', '.ome.tif', '.ome.tiff']:
+            path = self._data_path()
+            reader = tifffile.TiffFile(path)
             axes_order = str(reader.series[0].axes).upper()
-            image = reader.asarray()
+            if memmap and reader.series[0].dataoffset is not None:
+                # uncompressed and contiguous image data
+                image = tifffile.memmap(path, series=0, mode='r')
+            else:
+                # one chunk per tiff page
+                image = da.from_zarr(zarr.open(reader.series[0].aszarr(), mode='r'))
             reader.close()
+        elif self.extension in zarrtypes:
+            # one chunk per zarr chunk (OmeZarrStreamWriter: one or more chunks per plane)
+            array, axes_order, _, _ = self._open_zarr()
+            image = da.from_zarr(array)
+        elif self.extension in virtualtypes:
+            # shifts and cropping are applied when reading (one chunk per plane)
+            array = RegisteredArray(self._virtual['image']._open_lazy_6D(memmap=memmap), self._virtual['transformation_matrix'],
+                                    self._virtual['t_start'], self._virtual['t_end'], self._virtual['y_range'], self._virtual['x_range'])
+            image = da.from_array(array, chunks=(1, 1, 1, 1, -1, -1))
+            axes_order = self._axes
         else:
-            logging.getLogger(__name__).error('Image format not supported. Please upload a tiff, ome-tiff or nd2 image file.')
-            raise TypeError('Image format not supported. Please upload a tiff, ome-tiff or nd2 image file.')
+            logging.getLogger(__name__).error('Image format not supported. Please upload a tiff, ome-tiff, ome-zarr or nd2 image file.')
+            raise TypeError('Image format not supported. Please upload a tiff, ome-tiff, ome-zarr or nd2 image file.')
+        return image, axes_order
 
-        self.image = set_6Dimage(image, axes_order)
-        return self.image
+    def _get_decode_threads(self):
+        return self.decode_threads if self.decode_threads is not None else decode_threads
+
+    def _compute(self, image):
+        """
+        Load a memory-mapped or chunk-backed array in memory, decoding chunks in parallel (see decode_threads).
+        """
+        if isinstance(image, da.Array):
+            return image.compute(scheduler='threads', num_workers=self._get_decode_threads())
+        return np.asarray(image)
+
+    def _data_path(self):
+        """
+        Return the path used to read image data: a local copy of the image if staging is enabled (see stage_image()).
+        """
+        return stage_image(self.path)
+
+    def _open_lazy_6D(self, memmap=True):
+        """
+        Same as _open_lazy() but return a 6D array (FTCZYX), restricted to the selected field of view (if any).
+        """
+        image = self._set_6Dimage(*self._open_lazy(memmap=memmap))
+        if self.field_of_view is not None:
+            # only the frames of the selected field of view will be read
+            image = image[self.field_of_view:self.field_of_view+1]
+        return image
+
+    def _open_zarr(self):
+        """
+        Open the full resolution level of an OME-Zarr image (NGFF version 0.4 or 0.5) without reading the data.
+
+        Returns
+        -------
+        zarr.Array
+            the image, with axes as in the file.
+        str
+            axes order (e.g. 'TCZYX').
+        list of str or None
+            channel names (omero metadata).
+        tuple
+            physical pixel sizes in x, y and z direction ((None,None,None) if not available).
+        """
+        group = zarr.open_group(self.path, mode='r')
+        attrs = group.attrs.asdict()
+        # NGFF >= 0.5: metadata are stored in 'ome' attribute
+        attrs = attrs.get('ome', attrs)
+        if 'multiscales' not in attrs:
+            logging.getLogger(__name__).error('Invalid OME-Zarr image %s (multiscales metadata not found).', self.path)
+            raise TypeError(f"Invalid OME-Zarr image {self.path} (multiscales metadata not found).")
+        multiscale = attrs['multiscales'][0]
+        axes_order = ''.join(a['name'] if isinstance(a, dict) else a for a in multiscale['axes']).upper()
+        dataset = multiscale['datasets'][0]
+        array = group[dataset['path']]
+        scale = None
+        for transformation in dataset.get('coordinateTransformations', []):
+            if transformation['type'] == 'scale':
+                scale = transformation['scale']
+        physical_pixel_sizes = tuple(float(scale[axes_order.index(a)]) if scale is not None and a in axes_order else None for a in 'XYZ')
+        channel_names = [c.get('label') for c in attrs.get('omero', {}).get('channels', [])]
+        if len(channel_names) == 0:
+            channel_names = None
+        return array, axes_order, channel_names, physical_pixel_sizes
+
+    def _set_6Dimage(self, image, axes):
+        """
+        Return a 6D ndarray of the input image
+        """
+        dimensions = {k: v for v, k in enumerate(self._axes)}
+        # Dictionary with image axes order
+        axes_order = {}
+        for i, char in enumerate(axes):
+            axes_order[char] = i
+        # Mapping for the desired order of dimensions
+        mapping = [axes_order.get(d, None) for d in self._axes]
+        mapping = [i for i in mapping if i is not None]
+        # Rearrange the image array based on the desired order
+        image = np.transpose(image, axes=mapping)
+        # Determine the missing dimensions and reshape the array filling the missing dimensions
+        missing_dims = []
+        for c in self._axes:
+            if c not in axes:
+                missing_dims.append(c)
+        for dim in missing_dims:
+            position = dimensions[dim]
+            image = np.expand_dims(image, axis=position)
+        return image
+
+    def _selection_slices(self, shape, selection):
+        """
+        Convert a selection (dictionary with axis as key and int, slice or None as value)
+        to a tuple of slices for a 6D array with shape `shape`.
+        """
+        slices = []
+        for a, n in zip(self._axes, shape):
+            s = selection.get(a, None)
+            if s is None:
+                slices.append(slice(None))
+            elif isinstance(s, slice):
+                slices.append(s)
+            elif isinstance(s, (int, np.integer)):
+                if s < -n or s >= n:
+                    logging.getLogger(__name__).error('Index %s out of range for axis %s with size %s', s, a, n)
+                    raise ValueError(f"Index {s} out of range for axis {a} with size {n}")
+                s = int(s) % n
+                slices.append(slice(s, s+1))
+            else:
+                logging.getLogger(__name__).error('Invalid selection for axis %s: %s', a, s)
+                raise TypeError(f"Invalid selection for axis {a}: {s}")
+        return tuple(slices)
 
     def get_TYXarray(self):
         if self.sizes['F'] > 1 or self.sizes['C'] > 1 or self.sizes['Z'] > 1:
@@ -1567,14 +2688,16 @@ class Image:
             raise TypeError('Image format not supported. Please load an image with only TYX dimensions')
         return self.image[0, :, 0, 0, :, :]
 
-    def z_projection(self, projection_type, zrange, focus_method="tenengrad_var", z_shift=0):
+    def z_projection(self, projection_type, zrange, focus_method="tenengrad_var", z_shift=0, nthreads=1, focus_channel=None, focus_tracking=None):
         """
         Return the z-projection of the image using the selected projection type over the range of z values defined by zrange.
 
         Parameters
         ----------
         projection_type: str
-            the projection type (max, min, std, avg, mean or median)
+            the projection type (max, min, std, avg, mean, median, percentile:<p> or trimmed_mean:<p>)
+            percentile:<p>: p-th percentile (0<=p<=100), with linear interpolation (same as numpy.percentile()).
+            trimmed_mean:<p>: mean after removing the p% lowest and p% highest values (0<=p<50), e.g. for robust background estimation.
         zrange: int or (int,int) or None
             the range of z sections to use for projection.
             If zrange is None, use all z sections.
@@ -1591,17 +2714,90 @@ class Image:
             If `z_shift` is list of integers, it must contain one entry per time frames in the image (axis T).
             If `z_shift` is a single integer, the same shift will be used for all time frames.
             Not relevant when projecting all z sections.
+        nthreads: int
+            number of threads used to project batches of time frames concurrently.
+            Results and log messages do not depend on the number of threads.
+        focus_channel: int or None
+            position of the channel (C axis) used to estimate the Z corresponding to best focus,
+            which is then used for all channels (e.g. for co-focal channels, or when only one channel will be used).
+            If None, estimate the Z corresponding to best focus independently for each channel.
+            Only relevant when zrange is an integer.
+        focus_tracking: int or None
+            If None, search for the Z corresponding to best focus over all z sections.
+            If focus_tracking is an integer, track the Z corresponding to best focus over time (for each channel)
+            and only evaluate the sharpness of the z sections in the interval [z_prev-focus_tracking,z_prev+focus_tracking],
+            where z_prev is the Z corresponding to best focus in the previous time frame.
+            All z sections are evaluated for the first time frame, every `focus_tracking_interval` time frames,
+            and when best focus is found at the border of the interval.
+            Only relevant when zrange is an integer.
 
         Returns
         -------
         ndarray
             a 6D array with original image size, except for Z axis which has size 1.
         """
+        z_shift = self._z_projection_setup(projection_type, zrange, focus_method, z_shift, focus_channel, focus_tracking)
+        if z_shift is None:
+            return None
+        projected_image = np.zeros((self.sizes['F'], self.sizes['T'], self.sizes['C'], 1, self.sizes['Y'], self.sizes['X']), dtype=self.image.dtype)
+        # process batches of time frames (all channels), loaded in memory at once (image can be a memory-mapped or chunk-backed array, see imread(lazy=True))
+        batch_size = max(1, 256*1024**2 // (self.sizes['C'] * self.sizes['Z'] * self.sizes['Y'] * self.sizes['X'] * np.dtype(self.image.dtype).itemsize))
+        if nthreads > 1:
+            # at least one batch per thread, with same total memory usage
+            batch_size = max(1, min(batch_size // nthreads, -(-self.sizes['T'] // nthreads)))
+        for f, t0, t1, projected_frames in self._z_projection_batches(batch_size, projection_type, zrange, focus_method, z_shift, nthreads, focus_channel, focus_tracking):
+            projected_image[f, t0:t1, :, 0, :, :] = projected_frames
+        return projected_image
+
+    def z_projection_frames(self, projection_type, zrange, focus_method="tenengrad_var", z_shift=0, nthreads=1, focus_channel=None, focus_tracking=None):
+        """
+        Same as z_projection(), but iterate over time frames and project one time frame (all channels) at a time.
+        Only the z-stacks of one time frame per thread are loaded in memory, e.g. to project an image
+        read with imread(lazy=True) with memory usage independent of the number of time frames.
+
+        Parameters
+        ----------
+        projection_type, zrange, focus_method, z_shift, nthreads, focus_channel, focus_tracking:
+            see z_projection().
+
+        Yields
+        ------
+        tuple of int
+            indices (f, t) of the time frame.
+        ndarray
+            the projected time frame, with shape (C, Y, X).
+        """
+        z_shift = self._z_projection_setup(projection_type, zrange, focus_method, z_shift, focus_channel, focus_tracking)
+        if z_shift is None:
+            return
+        for f, t0, t1, projected_frames in self._z_projection_batches(1, projection_type, zrange, focus_method, z_shift, nthreads, focus_channel, focus_tracking):
+            yield (f, t0), projected_frames[0]
+
+    def _z_projection_setup(self, projection_type, zrange, focus_method, z_shift, focus_channel, focus_tracking):
+        """
+        Check z-projection parameters and log them (see z_projection()).
+
+        Returns
+        -------
+        list of int
+            z shift per time frame. None if projection type is not valid.
+        """
         if focus_method not in ['tenengrad_var', 'laplacian_var', 'std']:
             raise TypeError(f"Invalid focus_method {focus_method}")
+        try:
+            split_projection_type(projection_type)
+        except ValueError:
+            logging.getLogger(__name__).error('Projection type not recognized')
+            return None
 
         if np.ndim(z_shift) == 0:
             z_shift = [z_shift] * self.sizes['T']
+        if focus_channel is not None and not (isinstance(focus_channel, (int, np.integer)) and 0 <= focus_channel < self.sizes['C']):
+            logging.getLogger(__name__).error('Z-Projection: invalid focus channel %s for image with %s channels', focus_channel, self.sizes['C'])
+            raise TypeError(f"Invalid focus channel {focus_channel}")
+        if focus_tracking is not None and not (isinstance(focus_tracking, (int, np.integer)) and focus_tracking >= 1):
+            logging.getLogger(__name__).error('Z-Projection: invalid focus tracking range %s', focus_tracking)
+            raise TypeError(f"Invalid focus tracking range {focus_tracking}")
 
         if zrange is None:
             logging.getLogger(__name__).info('Z-Projection: projection type=%s, zrange=%s (All Z sections)', projection_type, zrange)
@@ -1612,74 +2808,387 @@ class Image:
         elif isinstance(zrange, tuple) and len(zrange) == 2 and zrange[0] <= zrange[1]:
             logging.getLogger(__name__).info('Z-Projection: projection type=%s, zrange=%s (Fixed range from %s to %s), z shift=%s', projection_type, zrange, zrange[0], zrange[1], z_shift)
         else:
-            logging.getLogger(__name__).info('Z-Projection: invalid zrange')
-        projected_image = np.zeros((self.sizes['F'], self.sizes['T'], self.sizes['C'], 1, self.sizes['Y'], self.sizes['X']), dtype=self.image.dtype)
-        sharpness = np.zeros(self.sizes['Z'])
-        for f in range(self.sizes['F']):
-            for t in range(self.sizes['T']):
-                for c in range(self.sizes['C']):
-                    z_values = None
-                    if zrange is None:
-                        # use all Z
-                        z_values = list(range(self.sizes['Z']))
-                        logging.getLogger(__name__).info('Z-Projection (F: %s, T: %s, C: %s): %s over z in %s (all)', f, t, c, projection_type, z_values)
-                    elif isinstance(zrange, int):
-                        # use zrange around Z with best focus
-                        # estimate sharpness
-                        if focus_method == 'tenengrad_var':
-                            for z in range(self.sizes['Z']):
-                                sharpness[z] = cv2.magnitude(cv2.Sobel(self.image[f, t, c, z, :, :].astype("float64"), cv2.CV_64F, 0, 1, ksize=3),
-                                                             cv2.Sobel(self.image[f, t, c, z, :, :].astype("float64"), cv2.CV_64F, 1, 0, ksize=3)).var()
-                        elif focus_method == 'laplacian_var':
-                            for z in range(self.sizes['Z']):
-                                sharpness[z] = cv2.Laplacian(self.image[f, t, c, z, :, :].astype("float64"), cv2.CV_64F, ksize=11).var()
-                        elif focus_method == 'std':
-                            sharpness = self.image[f, t, c, :, :, :].std(axis=(1, 2))
-
-                        # estimate z_best
-                        if focus_method == 'std':
-                            # choose z_best as z with maximum sharpness
-                            z_best = sharpness.argmax()
-                        elif focus_method in ['tenengrad_var', 'laplacian_var']:
-                            # smooth sharpness with running mean and choose z_best as z with maximum smoothed sharpness
-                            smooth_window = 1
-                            sharpness_smoothed = sharpness / max(sharpness)
-                            # smooth with running mean:
-                            sharpness_smoothed = np.hstack((np.full(smooth_window, sharpness_smoothed[0]),
-                                                            sharpness_smoothed,
-                                                            np.full(smooth_window, sharpness_smoothed[-1])))
-                            sharpness_smoothed = np.convolve(sharpness_smoothed,
-                                                             np.ones(2*smooth_window+1)/(2*smooth_window+1),
-                                                             mode='valid')
-                            z_best = sharpness_smoothed.argmax()
-
-                        # if z_best is too close to min or maz 'Z' => shift best_z so as to keep (2*zrange+1) z values (z_values).
-                        z_best_tmp = min(max(z_best+z_shift[t], zrange), self.sizes['Z']-zrange-1)
-                        z_values = [z for z in range(z_best_tmp-zrange, z_best_tmp+zrange+1) if z < self.sizes['Z'] and z >= 0]
-
-                        logging.getLogger(__name__).info('Z-Projection (F: %s, T: %s, C: %s): %s over z in %s (Best z=%s, z shift=%s)', f, t, c, projection_type, z_values, z_best, z_shift[t])
-                    elif isinstance(zrange, tuple) and len(zrange) == 2 and zrange[0] <= zrange[1]:
-                        # use fixed range
-                        z_values = [z for z in range(zrange[0]+z_shift[t], zrange[1]+z_shift[t]+1) if z < self.sizes['Z'] and z >= 0]
-                        logging.getLogger(__name__).info('Z-Projection (F: %s, T: %s, C: %s): %s over z in %s (fixed range, z shift=%s)', f, t, c, projection_type, z_values, z_shift[t])
-
-                    if len(z_values) == 1:
-                        projected_image[f, t, c, 0, :, :] = self.image[f, t, c, z_values[0], :, :].copy()
-                    elif projection_type == 'max':
-                        projected_image[f, t, c, 0, :, :] = np.max(self.image[f, t, c, z_values, :, :], axis=0)
-                    elif projection_type == 'min':
-                        projected_image[f, t, c, 0, :, :] = np.min(self.image[f, t, c, z_values, :, :], axis=0)
-                    elif projection_type == 'std':
-                        projected_image[f, t, c, 0, :, :] = np.std(self.image[f, t, c, z_values, :, :], axis=0, ddof=1)
-                    elif projection_type in ['avg', 'mean']:
-                        projected_image[f, t, c, 0, :, :] = np.mean(self.image[f, t, c, z_values, :, :], axis=0)
-                    elif projection_type == 'median':
-                        projected_image[f, t, c, 0, :, :] = np.median(self.image[f, t, c, z_values, :, :], axis=0)
+            logging.getLogger(__name__).error('Z-Projection: invalid zrange %s', zrange)
+            raise TypeError(f"Invalid zrange {zrange}")
+        if isinstance(zrange, int) and focus_channel is not None:
+            logging.getLogger(__name__).info('Z-Projection: best focus estimated on channel %s (used for all channels)', focus_channel)
+        if isinstance(zrange, int) and focus_tracking is not None:
+            logging.getLogger(__name__).info('Z-Projection: best focus tracking over time, range %s around previous best focus (all z sections every %s time frames)', focus_tracking, focus_tracking_interval)
+        return z_shift
+
+    def _z_projection_batches(self, batch_size, projection_type, zrange, focus_method, z_shift, nthreads, focus_channel, focus_tracking):
+        """
+        Project batches of `batch_size` time frames (all channels) and iterate over projected batches in order (see z_projection()).
+        With nthreads > 1, up to nthreads batches are projected concurrently.
+        Log messages are emitted in batch order (independently of the number of threads).
+
+        Yields
+        ------
+        int, int, int
+            field of view f and time frames t0 to t1-1 of the batch.
+        ndarray
+            projected time frames with shape (t1-t0, C, Y, X).
+        """
+        batches = [(f, t0, min(t0 + batch_size, self.sizes['T'])) for f in range(self.sizes['F']) for t0 in range(0, self.sizes['T'], batch_size)]
+        if isinstance(zrange, int) and self._file_indices is not None and focus_cache_folder is not None and not os.path.isdir(self.path):
+            # sharpness of z sections already estimated (e.g. by another module), with shape (F, T, C, Z) in the file
+            self._focus_cache = read_focus_cache(self.path, focus_method, self._file_shape)
+            if self._focus_cache is None:
+                self._focus_cache = np.full(self._file_shape, np.nan)
+            focus_cache_size = np.count_nonzero(~np.isnan(self._focus_cache))
+        try:
+            yield from self._z_projection_batches_run(batches, projection_type, zrange, focus_method, z_shift, nthreads, focus_channel, focus_tracking)
+        finally:
+            if self._focus_cache is not None:
+                if np.count_nonzero(~np.isnan(self._focus_cache)) > focus_cache_size:
+                    write_focus_cache(self.path, focus_method, self._focus_cache)
+                self._focus_cache = None
+
+    def _z_projection_batches_run(self, batches, projection_type, zrange, focus_method, z_shift, nthreads, focus_channel, focus_tracking):
+        """
+        Same as _z_projection_batches() for a list of batches (f, t0, t1).
+        With focus tracking, best focus is estimated sequentially (in batch order) before projecting each batch.
+        """
+        # best focus tracking state for each (f, c): Z with best focus in previous time frame and number of time frames since last search over all z sections
+        focus_tracking_state = {}
+        if nthreads > 1:
+            # OpenCV filters and numpy reductions release the GIL
+            with concurrent.futures.ThreadPoolExecutor(max_workers=nthreads) as executor:
+                # submit at most nthreads batches ahead, results are collected in batch order
+                pending = collections.deque()
+                for i, batch in enumerate(batches):
+                    z_best = None
+                    if isinstance(zrange, int) and focus_tracking is not None:
+                        z_best = self._track_focus(*batch, focus_method, focus_channel, focus_tracking, focus_tracking_state)
+                    pending.append((batch, executor.submit(self._z_projection_batch, *batch, projection_type, zrange, focus_method, z_shift, focus_channel, z_best)))
+                    while len(pending) >= nthreads or (i == len(batches) - 1 and len(pending) > 0):
+                        batch, future = pending.popleft()
+                        projected_frames, messages = future.result()
+                        for message in messages:
+                            logging.getLogger(__name__).info(*message)
+                        yield batch + (projected_frames,)
+        else:
+            for batch in batches:
+                z_best = None
+                if isinstance(zrange, int) and focus_tracking is not None:
+                    z_best = self._track_focus(*batch, focus_method, focus_channel, focus_tracking, focus_tracking_state)
+                projected_frames, messages = self._z_projection_batch(*batch, projection_type, zrange, focus_method, z_shift, focus_channel, z_best)
+                for message in messages:
+                    logging.getLogger(__name__).info(*message)
+                yield batch + (projected_frames,)
+
+    def _z_projection_batch(self, f, t0, t1, projection_type, zrange, focus_method, z_shift, focus_channel, z_best=None):
+        """
+        Project time frames t0 to t1-1 (all channels) of field of view f (see z_projection()).
+        If z_best is not None, it is used as the Z with best focus for each (t, c) (e.g. from _track_focus())
+        instead of estimating it.
+
+        Returns
+        -------
+        ndarray
+            projected time frames with shape (t1-t0, C, Y, X).
+        list of tuple
+            log messages (format and arguments), one per projected z-stack.
+        """
+        # z-stacks of all (t, c) in the batch, with shape (T*C, Z, Y, X)
+        zstacks = np.asarray(self.image[f, t0:t1]).reshape(-1, self.sizes['Z'], self.sizes['Y'], self.sizes['X'])
+        frames_t = np.repeat(np.arange(t0, t1), self.sizes['C'])
+        frames_c = np.tile(np.arange(self.sizes['C']), t1 - t0)
+        frames_z_shift = np.asarray(z_shift)[frames_t]
+        # z values for each (t, c), with shape (T*C, number of z values)
+        if zrange is None:
+            # use all Z
+            z_values = np.tile(np.arange(self.sizes['Z']), (zstacks.shape[0], 1))
+        elif isinstance(zrange, int):
+            # use zrange around Z with best focus
+            if z_best is None and focus_channel is None:
+                z_best = self._best_focus(self._batch_sharpness(zstacks, f, t0, t1, None, focus_method), focus_method)
+            elif z_best is None:
+                # best focus of the focus channel, used for all channels
+                focus_zstacks = zstacks.reshape(t1 - t0, self.sizes['C'], self.sizes['Z'], self.sizes['Y'], self.sizes['X'])[:, focus_channel]
+                z_best = np.repeat(self._best_focus(self._batch_sharpness(focus_zstacks, f, t0, t1, focus_channel, focus_method), focus_method), self.sizes['C'])
+            # if z_best is too close to min or maz 'Z' => shift best_z so as to keep (2*zrange+1) z values (z_values).
+            z_best_tmp = np.minimum(np.maximum(z_best + frames_z_shift, zrange), self.sizes['Z']-zrange-1)
+            z_values = z_best_tmp[:, np.newaxis] + np.arange(-zrange, zrange+1)
+        else:
+            # use fixed range
+            z_values = frames_z_shift[:, np.newaxis] + np.arange(zrange[0], zrange[1]+1)
+        # only keep valid z values (same number of z values for all (t, c) except with fixed range and different z shifts)
+        z_values = [z[(z >= 0) & (z < self.sizes['Z'])] for z in z_values]
+
+        messages = []
+        for i, (t, c) in enumerate(zip(frames_t, frames_c)):
+            if zrange is None:
+                messages.append(('Z-Projection (F: %s, T: %s, C: %s): %s over z in %s (all)', f, t, c, projection_type, z_values[i].tolist()))
+            elif isinstance(zrange, int):
+                messages.append(('Z-Projection (F: %s, T: %s, C: %s): %s over z in %s (Best z=%s, z shift=%s)', f, t, c, projection_type, z_values[i].tolist(), z_best[i], z_shift[t]))
+            else:
+                messages.append(('Z-Projection (F: %s, T: %s, C: %s): %s over z in %s (fixed range, z shift=%s)', f, t, c, projection_type, z_values[i].tolist(), z_shift[t]))
+
+        projected_frames = self._project(zstacks, z_values, projection_type)
+        return projected_frames.reshape(t1 - t0, self.sizes['C'], self.sizes['Y'], self.sizes['X']), messages
+
+    def _batch_sharpness(self, zstacks, f, t0, t1, c, focus_method):
+        """
+        Return the sharpness of the z sections of time frames t0 to t1-1 of field of view f,
+        for channel c (all channels if c is None), using cached values if available (see z_projection()).
+
+        Returns
+        -------
+        ndarray
+            sharpness with shape ((t1-t0)*C, Z) (C=1 if c is not None).
+        """
+        if self._focus_cache is None:
+            return self._focus_sharpness(zstacks, focus_method)
+        channels = self._file_indices['C'] if c is None else self._file_indices['C'][c:c+1]
+        index = (self._file_indices['F'][f],) + np.ix_(self._file_indices['T'][t0:t1], channels, self._file_indices['Z'])
+        sharpness = self._focus_cache[index]
+        if np.any(np.isnan(sharpness)):
+            sharpness = self._focus_sharpness(zstacks, focus_method).reshape(sharpness.shape)
+            # batches do not overlap (no conflict between threads)
+            self._focus_cache[index] = sharpness
+        return sharpness.reshape(-1, sharpness.shape[-1])
+
+    def _track_focus(self, f, t0, t1, focus_method, focus_channel, focus_tracking, state):
+        """
+        Estimate the Z with best focus for time frames t0 to t1-1 of field of view f by tracking it over time (see z_projection()).
+        Only the z sections evaluated are read (e.g. with imread(lazy=True)).
+
+        Parameters
+        ----------
+        f, t0, t1: int
+            field of view and time frames.
+        focus_method, focus_channel, focus_tracking:
+            see z_projection().
+        state: dict
+            tracking state for each (f, c), i.e. (Z with best focus in previous time frame, number of time frames since last search over all z sections),
+            updated in place. Time frames must be processed in order.
+
+        Returns
+        -------
+        ndarray
+            Z with best focus for each (t, c), with shape ((t1-t0)*C,).
+        """
+        channels = range(self.sizes['C']) if focus_channel is None else [focus_channel]
+        # sharpness is smoothed along Z (see _best_focus()): evaluate one more z section on each side of the range
+        # so that smoothed sharpness within the range is the same as when evaluating all z sections
+        margin = 0 if focus_method == 'std' else 1
+        z_best = np.zeros((t1 - t0, len(channels)), dtype=int)
+        for i, t in enumerate(range(t0, t1)):
+            for j, c in enumerate(channels):
+                z_prev, n = state.get((f, c), (None, 0))
+                z = None
+                if z_prev is not None and n < focus_tracking_interval:
+                    zmin = max(0, z_prev - focus_tracking - margin)
+                    zmax = min(self.sizes['Z'], z_prev + focus_tracking + margin + 1)
+                    z = zmin + self._best_focus(self._planes_sharpness(f, t, c, zmin, zmax, focus_method)[np.newaxis], focus_method)[0]
+                    if (z <= z_prev - focus_tracking and z_prev - focus_tracking > 0) or (z >= z_prev + focus_tracking and z_prev + focus_tracking < self.sizes['Z'] - 1):
+                        # best focus at the border of the range: may be outside the range
+                        logging.getLogger(__name__).debug('Z-Projection (F: %s, T: %s, C: %s): best focus at the border of the tracking range %s-%s, searching all z sections', f, t, c, z_prev - focus_tracking, z_prev + focus_tracking)
+                        z = None
                     else:
-                        logging.getLogger(__name__).error('Projection type not recognized')
-                        return None
+                        n += 1
+                if z is None:
+                    z = self._best_focus(self._planes_sharpness(f, t, c, 0, self.sizes['Z'], focus_method)[np.newaxis], focus_method)[0]
+                    n = 1
+                state[(f, c)] = (z, n)
+                z_best[i, j] = z
+        if focus_channel is not None:
+            return np.repeat(z_best[:, 0], self.sizes['C'])
+        return z_best.reshape(-1)
+
+    def _planes_sharpness(self, f, t, c, zmin, zmax, focus_method):
+        """
+        Return the sharpness of z sections zmin to zmax-1 of time frame t and channel c of field of view f,
+        using cached values if available (see z_projection()).
 
-        return projected_image
+        Returns
+        -------
+        ndarray
+            sharpness with shape (zmax-zmin,).
+        """
+        if self._focus_cache is not None:
+            index = (self._file_indices['F'][f], self._file_indices['T'][t], self._file_indices['C'][c], self._file_indices['Z'][zmin:zmax])
+            sharpness = self._focus_cache[index]
+            if not np.any(np.isnan(sharpness)):
+                return sharpness
+        sharpness = self._focus_sharpness(np.asarray(self.image[f, t, c, zmin:zmax])[np.newaxis], focus_method)[0]
+        if self._focus_cache is not None:
+            self._focus_cache[index] = sharpness
+        return sharpness
+
+    def _focus_sharpness(self, zstacks, focus_method):
+        """
+        Estimate the sharpness of each z section (see z_projection()).
+
+        Parameters
+        ----------
+        zstacks: ndarray
+            z-stacks with shape (N, Z, Y, X).
+        focus_method: str
+            tenengrad_var, laplacian_var or std.
+
+        Returns
+        -------
+        ndarray
+            sharpness with shape (N, Z).
+        """
+        if focus_method == 'std':
+            return zstacks.std(axis=(2, 3))
+        planes = zstacks.reshape((-1,) + zstacks.shape[2:])
+        sharpness = np.zeros(planes.shape[0])
+        # opencv can only filter uint8, uint16, int16 and float32 planes to float32
+        convert = planes.dtype not in (np.uint8, np.uint16, np.int16, np.float32)
+        for i, plane in enumerate(planes):
+            if convert:
+                plane = plane.astype(np.float32)
+            # filter directly to float32 (no conversion of the input plane), variance is computed in double precision by cv2.meanStdDev()
+            if focus_method == 'tenengrad_var':
+                filtered = cv2.magnitude(cv2.Sobel(plane, cv2.CV_32F, 0, 1, ksize=3),
+                                         cv2.Sobel(plane, cv2.CV_32F, 1, 0, ksize=3))
+            elif focus_method == 'laplacian_var':
+                filtered = cv2.Laplacian(plane, cv2.CV_32F, ksize=11)
+            sharpness[i] = cv2.meanStdDev(filtered)[1][0, 0]**2
+        return sharpness.reshape(zstacks.shape[:2])
+
+    def _best_focus(self, sharpness, focus_method):
+        """
+        Estimate the z section with best focus from the sharpness of each z section (see z_projection()).
+
+        Parameters
+        ----------
+        sharpness: ndarray
+            sharpness with shape (N, Z) (see _focus_sharpness()).
+        focus_method: str
+            tenengrad_var, laplacian_var or std.
+
+        Returns
+        -------
+        ndarray
+            indices of the z sections with best focus, with shape (N,).
+        """
+        if focus_method == 'std':
+            # choose z_best as z with maximum sharpness
+            return sharpness.argmax(axis=1)
+        # smooth sharpness with running mean and choose z_best as z with maximum smoothed sharpness
+        smooth_window = 1
+        sharpness_smoothed = sharpness / sharpness.max(axis=1, keepdims=True)
+        # smooth with running mean:
+        sharpness_smoothed = np.hstack((np.repeat(sharpness_smoothed[:, :1], smooth_window, axis=1),
+                                        sharpness_smoothed,
+                                        np.repeat(sharpness_smoothed[:, -1:], smooth_window, axis=1)))
+        kernel = np.ones(2*smooth_window+1)/(2*smooth_window+1)
+        sharpness_smoothed = np.apply_along_axis(np.convolve, 1, sharpness_smoothed, kernel, mode='valid')
+        return sharpness_smoothed.argmax(axis=1)
+
+    def _project(self, zstacks, z_values, projection_type):
+        """
+        Project z-stacks over selected z values (see z_projection()).
+
+        Parameters
+        ----------
+        zstacks: ndarray
+            z-stacks with shape (N, Z, Y, X).
+        z_values: list of ndarray
+            z values to use for each z-stack.
+        projection_type: str
+            max, min, std, avg, mean, median, percentile:<p> or trimmed_mean:<p>.
+
+        Returns
+        -------
+        ndarray
+            projected z-stacks with shape (N, Y, X) (same dtype as zstacks).
+        """
+        projection_type, parameter = split_projection_type(projection_type)
+        projected = np.zeros((zstacks.shape[0],) + zstacks.shape[2:], dtype=zstacks.dtype)
+        # z-stacks with the same number of z values are projected at once
+        lengths = np.array([len(z) for z in z_values])
+        for length in np.unique(lengths):
+            idx = np.flatnonzero(lengths == length)
+            z_idx = np.array([z_values[i] for i in idx])
+            if length > 1 and projection_type in ['median', 'percentile', 'trimmed_mean']:
+                # order statistics: partial sort of small blocks (no copy of the selected z sections)
+                for i, z in zip(idx, z_idx):
+                    self._project_order_statistic(zstacks[i], z, projection_type, parameter, projected[i])
+                continue
+            if idx.size == zstacks.shape[0] and np.all(z_idx == z_idx[0]):
+                # same z values for all z-stacks
+                selected = zstacks[:, z_idx[0]]
+            else:
+                selected = zstacks[idx[:, np.newaxis], z_idx]
+            if length == 1:
+                projected[idx] = selected[:, 0]
+            elif projection_type == 'max':
+                projected[idx] = np.max(selected, axis=1)
+            elif projection_type == 'min':
+                projected[idx] = np.min(selected, axis=1)
+            elif projection_type == 'std':
+                projected[idx] = np.std(selected, axis=1, ddof=1)
+            elif projection_type in ['avg', 'mean']:
+                projected[idx] = np.mean(selected, axis=1)
+        return projected
+
+    def _project_order_statistic(self, zstack, z_values, projection_type, parameter, projected):
+        """
+        Project a z-stack over selected z values using an order statistic (see z_projection()).
+        Blocks of rows are copied to a reused buffer with z as last (contiguous) axis and partially sorted with np.partition(),
+        which is much faster than sorting all z values (or np.median()) for each pixel.
+
+        Parameters
+        ----------
+        zstack: ndarray
+            z-stack with shape (Z, Y, X).
+        z_values: ndarray
+            z values to use (at least 2).
+        projection_type: str
+            median, percentile or trimmed_mean.
+        parameter: float or None
+            percentile (percentile) or percentage trimmed at each end (trimmed_mean).
+        projected: ndarray
+            output array with shape (Y, X), filled in-place.
+        """
+        n = len(z_values)
+        # partition with a single kth (much faster than with a list of kth): the value just below kth is the maximum of the lower part
+        if projection_type == 'median':
+            kth = n // 2
+        elif projection_type == 'percentile':
+            # same as numpy.percentile() with linear interpolation
+            position = parameter / 100 * (n - 1)
+            kth = int(np.ceil(position))
+            weight = position - np.floor(position)
+        elif projection_type == 'trimmed_mean':
+            # same number of values removed at each end as scipy.stats.trim_mean()
+            ntrim = int(parameter / 100 * n)
+            kth = n - ntrim - 1
+        # contiguous z values: no copy of the z-stack
+        if np.all(np.diff(z_values) == 1):
+            z_values = slice(z_values[0], z_values[-1] + 1)
+        # blocks of rows of about 2MB
+        block_size = max(1, 2*1024**2 // (zstack.shape[2] * n * zstack.itemsize))
+        buffer = np.empty((block_size, zstack.shape[2], n), dtype=zstack.dtype)
+        for y0 in range(0, zstack.shape[1], block_size):
+            y1 = min(y0 + block_size, zstack.shape[1])
+            block = buffer[:y1-y0]
+            np.copyto(block, np.moveaxis(zstack[z_values, y0:y1], 0, -1))
+            block.partition(kth, axis=-1)
+            if projection_type == 'median' and n % 2 == 1:
+                projected[y0:y1] = block[..., kth]
+            elif projection_type == 'median':
+                projected[y0:y1] = (block[..., :kth].max(axis=-1).astype(np.float64) + block[..., kth]) / 2
+            elif projection_type == 'percentile' and weight == 0:
+                projected[y0:y1] = block[..., kth]
+            elif projection_type == 'percentile':
+                lower = block[..., :kth].max(axis=-1).astype(np.float64)
+                upper = block[..., kth].astype(np.float64)
+                # same interpolation formula as numpy.percentile()
+                if weight >= 0.5:
+                    projected[y0:y1] = upper - (upper - lower) * (1 - weight)
+                else:
+                    projected[y0:y1] = lower + (upper - lower) * weight
+            elif projection_type == 'trimmed_mean':
+                if ntrim > 0:
+                    block[..., :kth+1].partition(ntrim, axis=-1)
+                projected[y0:y1] = block[..., ntrim:n-ntrim].mean(axis=-1, dtype=np.float64)
 
     def crop(self, axis, start, end):
         """
@@ -1704,10 +3213,564 @@ class Image:
         self.shape = self.image.shape
         for i, a in enumerate(self._axes):
             self.sizes[a] = self.shape[i]
+        if self._file_indices is not None and axis in self._file_indices:
+            self._file_indices[axis] = self._file_indices[axis][start:end]
+        elif axis in ('Y', 'X'):
+            # planes no longer correspond to the planes in the file (do not cache their sharpness)
+            self._file_indices = None
         if axis == 'C':
             self.channel_names = self.channel_names[start:end]
 
 
+class OmeTiffStreamWriter:
+    """
+    Write an OME-TIFF image plane by plane, e.g. as frames are computed, without holding the whole image in memory.
+    The OME-XML metadata are written when closing the writer, so that information available only at the end
+    (e.g. log messages added as CommentAnnotation to `ome_metadata`) can be saved.
+
+    Planes must be written in order (i.e. C-order of the non YX axes in `dimension_order`).
+
+    Example
+    -------
+    >>> writer = OmeTiffStreamWriter(path, (T, Y, X), 'uint16', dimension_order='TYX')
+    >>> for t in range(T):
+    ...     writer.write(mask_t)
+    >>> writer.ome_metadata.structured_annotations.append(CommentAnnotation(value=..., namespace="VLabApp"))
+    >>> writer.close()
+
+    When used as a context manager, the writer is closed at the end of the block,
+    or aborted (file removed) if an exception is raised.
+
+    Attributes
+    ----------
+    path : str
+        output path.
+    shape : tuple of int
+        shape of the whole image.
+    dtype : np.dtype
+        image data type.
+    dimension_order : str
+        dimension order of the whole image (e.g. 'TCZYX', 'TCYX' or 'TYX'). Must end with 'YX'.
+    ome_metadata : ome_types.model.ome.OME
+        OME metadata, written to the file when closing the writer.
+    """
+
+    def __init__(self, path, shape, dtype, dimension_order='TCZYX', channel_names=None, physical_pixel_sizes=None, output_compression=None):
+        """
+        Parameters
+        ----------
+        path: str
+            output path.
+        shape: tuple of int
+            shape of the whole image.
+        dtype: np.dtype or str
+            image data type.
+        dimension_order: str
+            dimension order (e.g. 'TCZYX', 'TCYX' or 'TYX'). Must end with 'YX'.
+        channel_names: list of str or None
+            channel names.
+        physical_pixel_sizes: bioio.PhysicalPixelSizes or None
+            physical pixel sizes.
+        output_compression: dict or None
+            output compression settings (see get_tifffile_kwargs()).
+        """
+        if len(shape) != len(dimension_order) or not dimension_order.endswith('YX'):
+            logging.getLogger(__name__).error('Invalid shape %s or dimension order %s', shape, dimension_order)
+            raise ValueError(f"Invalid shape {shape} or dimension order {dimension_order}")
+        self.path = path
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.dimension_order = dimension_order
+        self.ome_metadata = OmeTiffWriter.build_ome(data_shapes=[self.shape],
+                                                    data_types=[self.dtype],
+                                                    dimension_order=[dimension_order],
+                                                    channel_names=[channel_names] if channel_names is not None else None,
+                                                    physical_pixel_sizes=[physical_pixel_sizes] if physical_pixel_sizes is not None else None)
+        self._tifffile_kwargs = get_tifffile_kwargs(output_compression)
+        self._nplanes = int(np.prod(self.shape[:-2]))
+        self._planes_written = 0
+        # same criterion as bioio OmeTiffWriter (uncompressed size close to 4GB)
+        bigtiff = np.prod(self.shape) * self.dtype.itemsize > 2**32 - 2**25
+        self._tif = tifffile.TiffWriter(path, bigtiff=bigtiff)
+
+    def write(self, data):
+        """
+        Write the next plane(s).
+
+        Parameters
+        ----------
+        data: ndarray
+            a 2D plane (YX) or a block of consecutive planes (e.g. a time frame CZYX), with shape ending with YX.
+        """
+        data = np.asarray(data)
+        if data.shape[-2:] != self.shape[-2:]:
+            logging.getLogger(__name__).error('Invalid plane shape %s (expected %s)', data.shape[-2:], self.shape[-2:])
+            raise ValueError(f"Invalid plane shape {data.shape[-2:]} (expected {self.shape[-2:]})")
+        planes = data.reshape((-1,) + self.shape[-2:])
+        if self._planes_written + planes.shape[0] > self._nplanes:
+            logging.getLogger(__name__).error('Too many planes written to %s', self.path)
+            raise ValueError(f"Too many planes written to {self.path}")
+        for plane in planes:
+            # a placeholder description is written in the first page and replaced by the OME-XML when closing
+            self._tif.write(plane.astype(self.dtype, copy=False),
+                            description=b'OME-XML' if self._planes_written == 0 else None,
+                            photometric='minisblack',
+                            metadata=None,
+                            **self._tifffile_kwargs)
+            self._planes_written += 1
+
+    def close(self):
+        """
+        Write OME-XML metadata and close the file.
+        """
+        if self._tif is None:
+            return
+        try:
+            if self._planes_written != self._nplanes:
+                logging.getLogger(__name__).error('Incomplete image %s (%s planes written, %s expected)', self.path, self._planes_written, self._nplanes)
+                raise ValueError(f"Incomplete image {self.path} ({self._planes_written} planes written, {self._nplanes} expected)")
+            self._tif.overwrite_description(to_xml(self.ome_metadata).encode())
+        finally:
+            self._tif.close()
+            self._tif = None
+
+    def abort(self):
+        """
+        Close and remove the (incomplete) file.
+        """
+        if self._tif is not None:
+            self._tif.close()
+            self._tif = None
+            if os.path.isfile(self.path):
+                os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class OmeZarrStreamWriter:
+    """
+    Write an OME-Zarr image (NGFF version 0.4) plane by plane, with the same interface as OmeTiffStreamWriter.
+
+    The image is chunked along all non YX axes (one chunk per plane, or per tile if tiled), so that
+    disjoint time frames can be written independently (see write_frame()), e.g. by multiple workers.
+    Optional multiscale levels are downsampled by a factor 2 in X and Y (nearest neighbour, to keep
+    segmentation mask labels) when writing each plane.
+
+    NGFF metadata (axes, physical pixel sizes, channel names) are written when creating the image.
+    OME-XML metadata (`ome_metadata`, including VLabApp CommentAnnotation) are written to
+    `path`/OME/METADATA.ome.xml when closing the writer.
+
+    Attributes
+    ----------
+    path : str
+        output path (directory).
+    shape : tuple of int
+        shape of the whole image.
+    dtype : np.dtype
+        image data type.
+    dimension_order : str
+        dimension order of the whole image (e.g. 'TCZYX', 'TCYX' or 'TYX'). Must end with 'YX'.
+    ome_metadata : ome_types.model.ome.OME
+        OME metadata, written when closing the writer.
+    """
+
+    def __init__(self, path, shape, dtype, dimension_order='TCZYX', channel_names=None, physical_pixel_sizes=None, output_compression=None):
+        """
+        Parameters
+        ----------
+        path: str
+            output path (directory, existing image is overwritten).
+        shape: tuple of int
+            shape of the whole image.
+        dtype: np.dtype or str
+            image data type.
+        dimension_order: str
+            dimension order (e.g. 'TCZYX', 'TCYX' or 'TYX'). Must end with 'YX'.
+        channel_names: list of str or None
+            channel names.
+        physical_pixel_sizes: bioio.PhysicalPixelSizes or None
+            physical pixel sizes.
+        output_compression: dict or None
+            output compression settings (see get_tifffile_kwargs()).
+        """
+        # NGFF 0.4 axes must be ordered as T, C, Z, Y, X
+        if len(shape) != len(dimension_order) or not dimension_order.endswith('YX') or ''.join(a for a in 'TCZYX' if a in dimension_order) != dimension_order:
+            logging.getLogger(__name__).error('Invalid shape %s or dimension order %s', shape, dimension_order)
+            raise ValueError(f"Invalid shape {shape} or dimension order {dimension_order}")
+        if output_compression is None:
+            output_compression = {'compression': 'zlib', 'tiled': False}
+        if output_compression['compression'] not in output_zarr_compressors:
+            logging.getLogger(__name__).error('Invalid output compression %s for OME-Zarr image', output_compression['compression'])
+            raise ValueError(f"Invalid output compression {output_compression['compression']} for OME-Zarr image")
+        self.path = path
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.dimension_order = dimension_order
+        self.ome_metadata = OmeTiffWriter.build_ome(data_shapes=[self.shape],
+                                                    data_types=[self.dtype],
+                                                    dimension_order=[dimension_order],
+                                                    channel_names=[channel_names] if channel_names is not None else None,
+                                                    physical_pixel_sizes=[physical_pixel_sizes] if physical_pixel_sizes is not None else None)
+        nlevels = output_compression.get('levels', 1)
+        self._written = np.zeros(self.shape[:-2], dtype=bool)
+        self._next_plane = 0
+
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        self._group = zarr.open_group(path, mode='w', zarr_format=2)
+        self._levels = []
+        datasets = []
+        for level in range(nlevels):
+            factor = 2**level
+            level_shape = self.shape[:-2] + (-(-self.shape[-2]//factor), -(-self.shape[-1]//factor))
+            if output_compression['tiled']:
+                chunks = (1,)*len(self.shape[:-2]) + (min(output_tile_shape[0], level_shape[-2]), min(output_tile_shape[1], level_shape[-1]))
+            else:
+                chunks = (1,)*len(self.shape[:-2]) + level_shape[-2:]
+            self._levels.append(self._group.create_array(str(level), shape=level_shape, chunks=chunks, dtype=self.dtype,
+                                                         compressors=output_zarr_compressors[output_compression['compression']],
+                                                         chunk_key_encoding={'name': 'v2', 'separator': '/'},
+                                                         fill_value=0))
+            scale = []
+            for a in dimension_order:
+                if a == 'X':
+                    scale.append((physical_pixel_sizes.X if physical_pixel_sizes is not None and physical_pixel_sizes.X is not None else 1.0)*factor)
+                elif a == 'Y':
+                    scale.append((physical_pixel_sizes.Y if physical_pixel_sizes is not None and physical_pixel_sizes.Y is not None else 1.0)*factor)
+                elif a == 'Z':
+                    scale.append(physical_pixel_sizes.Z if physical_pixel_sizes is not None and physical_pixel_sizes.Z is not None else 1.0)
+                else:
+                    scale.append(1.0)
+            datasets.append({'path': str(level), 'coordinateTransformations': [{'type': 'scale', 'scale': scale}]})
+        axes = []
+        for a in dimension_order:
+            if a == 'T':
+                axes.append({'name': 't', 'type': 'time'})
+            elif a == 'C':
+                axes.append({'name': 'c', 'type': 'channel'})
+            else:
+                axes.append({'name': a.lower(), 'type': 'space', 'unit': 'micrometer'})
+        self._group.attrs['multiscales'] = [{'version': '0.4',
+                                             'name': splitext(os.path.basename(os.path.normpath(path)))[0],
+                                             'axes': axes,
+                                             'datasets': datasets}]
+        if channel_names is not None:
+            self._group.attrs['omero'] = {'channels': [{'label': str(x), 'active': True} for x in channel_names]}
+
+    def write(self, data):
+        """
+        Write the next plane(s).
+
+        Parameters
+        ----------
+        data: ndarray
+            a 2D plane (YX) or a block of consecutive planes (e.g. a time frame CZYX), with shape ending with YX.
+        """
+        data = np.asarray(data)
+        if data.shape[-2:] != self.shape[-2:]:
+            logging.getLogger(__name__).error('Invalid plane shape %s (expected %s)', data.shape[-2:], self.shape[-2:])
+            raise ValueError(f"Invalid plane shape {data.shape[-2:]} (expected {self.shape[-2:]})")
+        planes = data.reshape((-1,) + self.shape[-2:])
+        if self._next_plane + planes.shape[0] > self._written.size:
+            logging.getLogger(__name__).error('Too many planes written to %s', self.path)
+            raise ValueError(f"Too many planes written to {self.path}")
+        for plane in planes:
+            self._write_block(np.unravel_index(self._next_plane, self._written.shape), plane)
+            self._next_plane += 1
+
+    def write_frame(self, index, data):
+        """
+        Write one frame, i.e. the block at position `index` along the first axis (e.g. a time frame CZYX for a TCZYX image).
+        Frames can be written in any order.
+
+        Parameters
+        ----------
+        index: int
+            position along the first axis.
+        data: ndarray
+            the frame, with shape `shape`[1:].
+        """
+        data = np.asarray(data)
+        if data.shape != self.shape[1:]:
+            logging.getLogger(__name__).error('Invalid frame shape %s (expected %s)', data.shape, self.shape[1:])
+            raise ValueError(f"Invalid frame shape {data.shape} (expected {self.shape[1:]})")
+        self._write_block((index,), data)
+
+    def _write_block(self, index, data):
+        for level, array in enumerate(self._levels):
+            factor = 2**level
+            array[index] = data[..., ::factor, ::factor].astype(self.dtype, copy=False)
+        self._written[index] = True
+
+    def close(self):
+        """
+        Write OME-XML metadata.
+        """
+        if self._group is None:
+            return
+        try:
+            if not self._written.all():
+                logging.getLogger(__name__).error('Incomplete image %s (%s planes written, %s expected)', self.path, np.count_nonzero(self._written), self._written.size)
+                raise ValueError(f"Incomplete image {self.path} ({np.count_nonzero(self._written)} planes written, {self._written.size} expected)")
+            os.makedirs(os.path.join(self.path, 'OME'), exist_ok=True)
+            with open(os.path.join(self.path, 'OME', 'METADATA.ome.xml'), 'w', encoding='utf-8') as f:
+                f.write(to_xml(self.ome_metadata))
+        finally:
+            self._group = None
+
+    def abort(self):
+        """
+        Remove the (incomplete) image.
+        """
+        if self._group is not None:
+            self._group = None
+            if os.path.isdir(self.path):
+                shutil.rmtree(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def open_image_writer(path, shape, dtype, dimension_order='TCZYX', channel_names=None, physical_pixel_sizes=None, output_compression=None):
+    """
+    Return an OmeZarrStreamWriter if `path` is an OME-Zarr image (see `zarrtypes`), an OmeTiffStreamWriter otherwise.
+    See OmeTiffStreamWriter for a description of the parameters.
+    """
+    if splitext(os.path.normpath(path))[1] in zarrtypes:
+        return OmeZarrStreamWriter(path, shape, dtype, dimension_order=dimension_order, channel_names=channel_names, physical_pixel_sizes=physical_pixel_sizes, output_compression=output_compression)
+    return OmeTiffStreamWriter(path, shape, dtype, dimension_order=dimension_order, channel_names=channel_names, physical_pixel_sizes=physical_pixel_sizes, output_compression=output_compression)
+
+
+def shift_segments(start, end, shift, size):
+    """
+    Slices to copy a shifted (with periodic boundary conditions, as np.roll()) and cropped axis,
+    i.e. such that output[i] = input[(start+i+shift) % size] for 0 <= i < end-start.
+
+    Parameters
+    ----------
+    start, end: int
+        crop window (in output coordinates).
+    shift: int
+        shift (input coordinates = output coordinates + shift).
+    size: int
+        size of the axis.
+
+    Returns
+    -------
+    list of tuples
+        list of (output slice, input slice) tuples (at most 2, if the crop window wraps around).
+    """
+    segments = []
+    i = 0
+    while i < end - start:
+        src = (start + i + shift) % size
+        n = min(end - start - i, size - src)
+        segments.append((slice(i, i+n), slice(src, src+n)))
+        i += n
+    return segments
+
+
+def registration_crop_window(tmat, size_y, size_x, skip_crop):
+    """
+    Range of time frames and crop window of an image registered with a transformation matrix.
+
+    Parameters
+    ----------
+    tmat: ndarray
+        transformation matrix, with columns x, y, keep (and optionally x_raw, y_raw).
+    size_y, size_x: int
+        size of the image along Y and X axes.
+    skip_crop: bool
+        do not crop the registered image.
+
+    Returns
+    -------
+    t_start, t_end: int
+        range of time frames (time frames with keep = 1 and in between).
+    y_range, x_range: range
+        crop window along Y and X axes (can be empty if shifts are too large).
+    """
+    keep = [d for d in tmat if d[2] == 1]
+    t_start = int(np.nonzero(tmat[:, 2])[0].min())
+    t_end = int(np.nonzero(tmat[:, 2])[0].max()) + 1
+    if skip_crop:
+        y_start, y_end = 0, size_y
+        x_start, x_end = 0, size_x
+    else:
+        y_start = 0 - min(d[1] for d in keep)
+        y_end = size_y - max(d[1] for d in keep)
+        x_start = 0 - min(d[0] for d in keep)
+        x_end = size_x - max(d[0] for d in keep)
+    # crop window with python slicing semantics
+    return t_start, t_end, range(size_y)[y_start:y_end], range(size_x)[x_start:x_end]
+
+
+def write_virtual_registered_image(path, image_path, tmat, skip_crop, metadata=None):
+    """
+    Save a virtual registered image, i.e. a JSON descriptor referencing the input image and the transformation matrix.
+    When opened with Image, shifts and cropping are applied when reading planes (no registered copy is written).
+
+    Parameters
+    ----------
+    path: str
+        output path (with extension in `virtualtypes`).
+    image_path: str
+        path of the input image (can be a field of view path, see field_of_view_path()).
+    tmat: ndarray
+        transformation matrix, with columns x, y, keep (and optionally x_raw, y_raw).
+    skip_crop: bool
+        do not crop the registered image.
+    metadata: list of str or None
+        VLabApp metadata (same as comment annotations of a registered image).
+    """
+    image_path, field_of_view = split_field_of_view_path(image_path)
+    try:
+        # relative path, so that the input image and the virtual image can be moved together
+        image_path = os.path.relpath(os.path.abspath(image_path), os.path.dirname(os.path.abspath(path)))
+    except ValueError:
+        # e.g. different drives on Windows
+        image_path = os.path.abspath(image_path)
+    descriptor = {'format': 'VLabApp virtual registered image',
+                  'version': virtual_registered_image_version,
+                  'image': image_path,
+                  'field_of_view': field_of_view,
+                  'transformation_matrix': np.asarray(tmat)[:, 0:3].astype(int).tolist(),
+                  'skip_crop': bool(skip_crop),
+                  'metadata': list(metadata) if metadata is not None else []}
+    with open(path, 'w') as f:
+        json.dump(descriptor, f)
+
+
+def read_virtual_registered_image(path):
+    """
+    Read a virtual registered image descriptor (see write_virtual_registered_image()).
+
+    Parameters
+    ----------
+    path: str
+        path of the descriptor.
+
+    Returns
+    -------
+    dict
+        descriptor, with absolute image path (including field of view, see field_of_view_path())
+        and transformation matrix as ndarray.
+    """
+    with open(path) as f:
+        descriptor = json.load(f)
+    if descriptor.get('format') != 'VLabApp virtual registered image' or descriptor.get('version', 0) > virtual_registered_image_version:
+        logging.getLogger(__name__).error('Invalid or unsupported virtual registered image %s', path)
+        raise TypeError(f"Invalid or unsupported virtual registered image {path}")
+    image_path = descriptor['image']
+    if not os.path.isabs(image_path):
+        image_path = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(path)), image_path))
+    if descriptor.get('field_of_view') is not None:
+        image_path = field_of_view_path(image_path, descriptor['field_of_view'])
+    descriptor['image'] = image_path
+    descriptor['transformation_matrix'] = np.array(descriptor['transformation_matrix'], dtype=int).reshape(-1, 3)
+    return descriptor
+
+
+class RegisteredArray:
+    """
+    Read-only 6D (FTCZYX) array-like view of an image registered with a transformation matrix.
+    Shifts and cropping are applied when reading (only the planes and the part of each plane within
+    the crop window are read from the image). Used as backend of the dask array of virtual registered images.
+
+    Attributes
+    ----------
+    shape : tuple of int
+        shape of the registered image.
+    dtype : np.dtype
+        image data type.
+    ndim : int
+        number of dimensions (6).
+    """
+
+    def __init__(self, image, tmat, t_start, t_end, y_range, x_range):
+        """
+        Parameters
+        ----------
+        image: array
+            6D (FTCZYX) input image (numpy ndarray, memmap or dask array).
+        tmat: ndarray
+            transformation matrix, with columns x, y, keep.
+        t_start, t_end: int
+            range of time frames of the registered image (see registration_crop_window()).
+        y_range, x_range: range
+            crop window (see registration_crop_window()).
+        """
+        self._image = image
+        self._tmat = tmat
+        self._t_start = t_start
+        self._y_range = y_range
+        self._x_range = x_range
+        self.shape = (image.shape[0], t_end - t_start, image.shape[2], image.shape[3], len(y_range), len(x_range))
+        self.dtype = np.dtype(image.dtype)
+        self.ndim = 6
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) > self.ndim:
+            logging.getLogger(__name__).error('Too many indices for array with %s dimensions', self.ndim)
+            raise IndexError(f"Too many indices for array with {self.ndim} dimensions")
+        key = key + (slice(None),)*(self.ndim-len(key))
+        ranges = []
+        squeeze = []
+        for k, n in zip(key, self.shape):
+            if isinstance(k, (int, np.integer)):
+                i = range(n)[k]
+                ranges.append(range(i, i+1))
+                squeeze.append(0)
+            elif isinstance(k, slice):
+                ranges.append(range(n)[k])
+                squeeze.append(slice(None))
+            else:
+                logging.getLogger(__name__).error('Only integers and slices are valid indices')
+                raise IndexError('Only integers and slices are valid indices')
+        if any(r.step < 0 for r in ranges[4:]):
+            logging.getLogger(__name__).error('Negative steps are not supported along Y and X axes')
+            raise IndexError('Negative steps are not supported along Y and X axes')
+        out = np.empty(tuple(len(r) for r in ranges), dtype=self.dtype)
+        if out.size == 0:
+            return out[tuple(squeeze)]
+        # F, C and Z indices are the same in the input image
+        fcz = [slice(r.start, r.stop if r.stop >= 0 else None, r.step) for r in (ranges[0], ranges[2], ranges[3])]
+        # contiguous part of the crop window containing the selected Y and X indices
+        y_span = self._y_range[ranges[4].start:ranges[4][-1]+1]
+        x_span = self._x_range[ranges[5].start:ranges[5][-1]+1]
+        block = np.empty(out.shape[0:1] + out.shape[2:4] + (len(y_span), len(x_span)), dtype=self.dtype)
+        for i, t in enumerate(ranges[1]):
+            t = self._t_start + t
+            if self._tmat[t, 2] == 1:
+                x_shift, y_shift = self._tmat[t, 0], self._tmat[t, 1]
+            else:
+                x_shift, y_shift = 0, 0
+            for y_dst, y_src in shift_segments(y_span.start, y_span.stop, y_shift, self._image.shape[4]):
+                for x_dst, x_src in shift_segments(x_span.start, x_span.stop, x_shift, self._image.shape[5]):
+                    data = self._image[fcz[0], t, fcz[1], fcz[2], y_src, x_src]
+                    if isinstance(data, da.Array):
+                        # already computed in a dask worker thread
+                        data = data.compute(scheduler='synchronous')
+                    block[:, :, :, y_dst, x_dst] = data
+            out[:, i] = block[:, :, :, ::ranges[4].step, ::ranges[5].step]
+        return out[tuple(squeeze)]
+
+
 def load_cell_tracking_graph(graph_path, mask_dtype):
     graph = ig.Graph().Read_GraphMLz(graph_path)
     # Adjust attibute types
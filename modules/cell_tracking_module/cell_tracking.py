@@ -162,7 +162,7 @@ class CellTracking(QWidget):
             if res:
                 for ext in gf.imagetypes:
                     image_path = os.path.join(os.path.dirname(mask_path), res.group(1)) + ext
-                    if os.path.isfile(image_path):
+                    if gf.isfile(image_path):
                         self.input_image.setPlaceholderText(image_path)
                         self.input_image.setToolTip(image_path)
                         break
@@ -249,7 +249,7 @@ class CellTracking(QWidget):
         output_paths = [self.output_settings.get_path(path) for path in mask_paths]
 
         # check inputs
-        if image_path != '' and not os.path.isfile(image_path):
+        if image_path != '' and not gf.isfile(image_path):
             self.logger.error('Image: not a valid file')
             self.input_image.setFocus()
             return
@@ -257,7 +257,7 @@ class CellTracking(QWidget):
             self.logger.error('Segmentation mask missing')
             return
         for path in mask_paths:
-            if not os.path.isfile(path):
+            if not gf.isfile(path):
                 self.logger.error('Segmentation mask not found: %s', path)
                 return
         if self.output_settings.output_folder.text() == '' and not self.output_settings.use_input_folder.isChecked():
@@ -289,6 +289,7 @@ class CellTracking(QWidget):
         QApplication.setOverrideCursor(QCursor(Qt.BusyCursor))
         QApplication.processEvents()
 
+        output_compression = self.output_settings.get_output_compression()
         arguments = []
         for mask_path, output_path, output_basename in zip(mask_paths, output_paths, output_basenames):
             arguments.append((image_path, mask_path, output_path,
@@ -301,7 +302,8 @@ class CellTracking(QWidget):
                               self.nframes_defect.value(),
                               self.nframes_stable.value(),
                               self.stable_overlap_fraction.value()/100.0,
-                              self.display_results.isChecked()))
+                              self.display_results.isChecked(),
+                              output_compression))
         if not arguments:
             return
         nprocesses = min(len(arguments), self.nprocesses.value())
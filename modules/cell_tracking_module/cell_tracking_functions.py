@@ -1041,7 +1041,7 @@ class CellTrackingWidget(QWidget):
     """
 
     # TODO: pass the mask as an Image object, instead of using the quick&dirty hack to pass the additional parameters mask_physical_pixel_sizes and mask_channel_names.
-    def __init__(self, mask, cell_tracking_graph, viewer_graph, viewer_images, image_path, output_path, output_basename, min_area=300, max_delta_frame=5, min_overlap_fraction=0.2, max_delta_frame_interpolation=3, nframes_defect=2, nframes_stable=3, stable_overlap_fraction=0, mask_physical_pixel_sizes=(None, None, None), mask_channel_names=None, mask_metadata=None):
+    def __init__(self, mask, cell_tracking_graph, viewer_graph, viewer_images, image_path, output_path, output_basename, min_area=300, max_delta_frame=5, min_overlap_fraction=0.2, max_delta_frame_interpolation=3, nframes_defect=2, nframes_stable=3, stable_overlap_fraction=0, mask_physical_pixel_sizes=(None, None, None), mask_channel_names=None, mask_metadata=None, output_compression=None):
         super().__init__()
         self.logger = logging.getLogger(__name__)
         self.logger.debug("CellTrackingWidget.__init__")
@@ -1050,6 +1050,7 @@ class CellTrackingWidget(QWidget):
         self.mask_physical_pixel_sizes = mask_physical_pixel_sizes
         self.mask_channel_names = mask_channel_names
         self.mask_metadata = mask_metadata
+        self.output_compression = output_compression
         self.cell_tracking_graph = cell_tracking_graph
         self.viewer_graph = viewer_graph
         self.viewer_images = viewer_images
@@ -1510,7 +1511,7 @@ class CellTrackingWidget(QWidget):
         ome_metadata.structured_annotations.append(CommentAnnotation(value=buffered_handler.get_messages(), namespace="VLabApp"))
         for x in self.mask_metadata:
             ome_metadata.structured_annotations.append(CommentAnnotation(value=x, namespace="VLabApp"))
-        OmeTiffWriter.save(self.mask, output_file1, ome_xml=ome_metadata)
+        OmeTiffWriter.save(self.mask, output_file1, ome_xml=ome_metadata, tifffile_kwargs=gf.get_tifffile_kwargs(self.output_compression))
 
         output_file3 = os.path.join(self.output_path, self.output_basename+".graphmlz")
         self.logger.info("Saving cell tracking graph to %s", output_file3)
@@ -1557,7 +1558,7 @@ class CellTrackingWidget(QWidget):
         remove_all_log_handlers()
 
 
-def main(image_path, mask_path, output_path, output_basename, min_area=300, max_delta_frame=5, min_overlap_fraction=0.2, clean=False, max_delta_frame_interpolation=3, nframes_defect=2, nframes_stable=3, stable_overlap_fraction=0, display_results=True):
+def main(image_path, mask_path, output_path, output_basename, min_area=300, max_delta_frame=5, min_overlap_fraction=0.2, clean=False, max_delta_frame_interpolation=3, nframes_defect=2, nframes_stable=3, stable_overlap_fraction=0, display_results=True, output_compression=None):
     """
     Load mask from `mask_path`, evaluate cell tracking graph, relabel mask,
     save the resulting mask and cell tracking graph into `output_path` directory
@@ -1597,6 +1598,8 @@ def main(image_path, mask_path, output_path, output_basename, min_area=300, max_
         Only used with `clean`=True
     display_results: bool
         display image, mask and results in napari
+    output_compression: dict or None
+        output compression settings (see gf.get_tifffile_kwargs()).
     """
 
     # This is a temporary workaround to avoid having multiple conflicting
@@ -1700,7 +1703,7 @@ def main(image_path, mask_path, output_path, output_basename, min_area=300, max_
                 ome_metadata.structured_annotations.append(CommentAnnotation(value=buffered_handler.get_messages(), namespace="VLabApp"))
                 for x in mask_metadata:
                     ome_metadata.structured_annotations.append(CommentAnnotation(value=x, namespace="VLabApp"))
-                OmeTiffWriter.save(mask, output_file, ome_xml=ome_metadata)
+                OmeTiffWriter.save(mask, output_file, ome_xml=ome_metadata, tifffile_kwargs=gf.get_tifffile_kwargs(output_compression))
 
                 output_file = os.path.join(output_path, output_basename+".graphmlz")
                 logger.info("Saving cell tracking graph to %s", output_file)
@@ -1801,7 +1804,8 @@ def main(image_path, mask_path, output_path, output_basename, min_area=300, max_
                                                      stable_overlap_fraction=stable_overlap_fraction,
                                                      mask_physical_pixel_sizes=mask_image.physical_pixel_sizes,
                                                      mask_channel_names=mask_image.channel_names,
-                                                     mask_metadata=mask_metadata))
+                                                     mask_metadata=mask_metadata,
+                                                     output_compression=output_compression))
             viewer_images.window.add_dock_widget(scroll_area, area='right', name="Cell tracking")
 
         else:
@@ -1815,7 +1819,7 @@ def main(image_path, mask_path, output_path, output_basename, min_area=300, max_
             ome_metadata.structured_annotations.append(CommentAnnotation(value=buffered_handler.get_messages(), namespace="VLabApp"))
             for x in mask_metadata:
                 ome_metadata.structured_annotations.append(CommentAnnotation(value=x, namespace="VLabApp"))
-            OmeTiffWriter.save(mask, output_file, ome_xml=ome_metadata)
+            OmeTiffWriter.save(mask, output_file, ome_xml=ome_metadata, tifffile_kwargs=gf.get_tifffile_kwargs(output_compression))
 
             output_file = os.path.join(output_path, output_basename+".graphmlz")
             logger.info("Saving cell tracking graph to %s", output_file)
@@ -174,7 +174,7 @@ class EventsSelection(QWidget):
             self.logger.error('Segmentation mask and cell tracking graph missing')
             return
         for mask_path in mask_paths:
-            if not os.path.isfile(mask_path):
+            if not gf.isfile(mask_path):
                 self.logger.error('Segmentation mask not found: %s', mask_path)
                 return
         for graph_path in graph_paths:
@@ -210,6 +210,7 @@ class EventsSelection(QWidget):
         QApplication.setOverrideCursor(QCursor(Qt.BusyCursor))
         QApplication.processEvents()
 
+        output_compression = self.output_settings.get_output_compression()
         arguments = []
         for mask_path, graph_path, output_path, output_basename in zip(mask_paths, graph_paths, output_paths, output_basenames):
             arguments.append((mask_path,
@@ -222,7 +223,8 @@ class EventsSelection(QWidget):
                               self.filter_border_yn.isChecked(),
                               self.border_width.value(),
                               self.filter_nmissing_yn.isChecked(),
-                              self.nmissing.value()))
+                              self.nmissing.value(),
+                              output_compression))
 
         if not arguments:
             return
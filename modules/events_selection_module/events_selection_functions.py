@@ -147,7 +147,7 @@ def filter_graph(graph, events_type, nframes_before, nframes_after, filter_nmiss
     return subgraph
 
 
-def save(mask, graph, output_path, output_basename, metadata=None):
+def save(mask, graph, output_path, output_basename, metadata=None, output_compression=None):
     """
     Save cell tracking graph and mask as  `output_path`/`output_basename`.graphmlz and `output_path`/`output_basename`.ome.tif.
 
@@ -161,6 +161,8 @@ def save(mask, graph, output_path, output_basename, metadata=None):
         output directory
     output_basename: str
         output basename
+    output_compression: dict or None
+        output compression settings (see gf.get_tifffile_kwargs()).
     """
     logger = logging.getLogger(__name__)
     if not os.path.isdir(output_path):
@@ -180,7 +182,7 @@ def save(mask, graph, output_path, output_basename, metadata=None):
     ome_metadata.structured_annotations.append(CommentAnnotation(value=buffered_handler.get_messages(), namespace="VLabApp"))
     for x in metadata:
         ome_metadata.structured_annotations.append(CommentAnnotation(value=x, namespace="VLabApp"))
-    OmeTiffWriter.save(mask.image[0, :, 0, 0, :, :], output_file, ome_xml=ome_metadata)
+    OmeTiffWriter.save(mask.image[0, :, 0, 0, :, :], output_file, ome_xml=ome_metadata, tifffile_kwargs=gf.get_tifffile_kwargs(output_compression))
 
     output_file = os.path.join(output_path, output_basename+".graphmlz")
     logger.info("Saving cell tracking graph to %s", output_file)
@@ -196,7 +198,7 @@ def save(mask, graph, output_path, output_basename, metadata=None):
         f.write(buffered_handler.get_messages())
 
 
-def main(mask_path, graph_path, output_path, output_basename, events_type, nframes_before, nframes_after, filter_border, border_width, filter_nmissing, nmissing):
+def main(mask_path, graph_path, output_path, output_basename, events_type, nframes_before, nframes_after, filter_border, border_width, filter_nmissing, nmissing, output_compression=None):
     """
     Load mask (`mask_path`), cell tracking graph (`graph_path`).
     Save the selected mask and cell tracking graph into `output_path` directory.
@@ -225,6 +227,8 @@ def main(mask_path, graph_path, output_path, output_basename, events_type, nfram
         filter-out cell tracks with more than `nmissing` missing cells. Filtering is done after event selection, i.e. with one cell track per selected event.
     nmissing: int
         maximum number of missing cells per cell track.
+    output_compression: dict or None
+        output compression settings (see gf.get_tifffile_kwargs()).
     """
 
     try:
@@ -359,7 +363,7 @@ def main(mask_path, graph_path, output_path, output_basename, events_type, nfram
         ###########################
         # save
         ###########################
-        save(mask, graph, output_path, output_basename, metadata=mask_metadata+graph_metadata)
+        save(mask, graph, output_path, output_basename, metadata=mask_metadata+graph_metadata, output_compression=output_compression)
 
         # Remove all handlers for this module
         remove_all_log_handlers()
@@ -153,7 +153,7 @@ class MaskGraphConversion(QWidget):
             self.logger.error('Segmentation mask and cell tracking graph missing')
             return
         for mask_path in mask_paths:
-            if not os.path.isfile(mask_path):
+            if not gf.isfile(mask_path):
                 self.logger.error('Segmentation mask not found: %s', mask_path)
                 return
         for graph_path in graph_paths:
@@ -420,6 +420,8 @@ class ImageMaskConversion(QWidget):
             output_format = 'auto'
 
         image_paths = self.image_list.get_file_list()
+        # one job per field of view for multi-position images
+        image_paths = gf.expand_fields_of_view(image_paths)
         output_basenames = [self.output_settings.get_basename(image_path) for image_path in image_paths]
         output_paths = [self.output_settings.get_path(image_path) for image_path in image_paths]
 
@@ -428,7 +430,7 @@ class ImageMaskConversion(QWidget):
             self.logger.error('Image or mask missing')
             return
         for image_path in image_paths:
-            if not os.path.isfile(image_path):
+            if not gf.isfile(image_path):
                 self.logger.error('Image or mask not found: %s', image_path)
                 return
         if self.output_settings.output_folder.text() == '' and not self.output_settings.use_input_folder.isChecked():
@@ -472,7 +474,8 @@ class ImageMaskConversion(QWidget):
                               colors,
                               self.autocontrast.isChecked(),
                               self.output_quality.value(),
-                              self.output_fps.value()))
+                              self.output_fps.value(),
+                              self.zprojection_settings.get_nthreads()))
         if not arguments:
             return
         nprocesses = min(len(arguments), self.nprocesses.value())
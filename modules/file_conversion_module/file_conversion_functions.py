@@ -409,7 +409,7 @@ def convert_mask_and_graph(mask_path, graph_path, output_path, output_basename,
             raise ValueError(error_message.strip())
 
 
-def convert_image_mask_to_lossy_preview(image_path, output_path, output_basename, output_format, projection_type, projection_zrange, input_is_mask, colors, autocontrast, quality, fps):
+def convert_image_mask_to_lossy_preview(image_path, output_path, output_basename, output_format, projection_type, projection_zrange, input_is_mask, colors, autocontrast, quality, fps, projection_nthreads=1):
     """
     Load image or mask (`image_path`).
     Save as mp4 movie or jpg image into `output_path` directory.
@@ -445,6 +445,8 @@ def convert_image_mask_to_lossy_preview(image_path, output_path, output_basename
         output quality. Lowest quality is 0, highest is 10.
     fps: int
         output number of frames per seconds.
+    projection_nthreads: int
+        number of threads used for z-projection (see gf.Image.z_projection()).
     """
 
     ###########################
@@ -510,7 +512,7 @@ def convert_image_mask_to_lossy_preview(image_path, output_path, output_basename
     # Project Z axis if needed and select channel
     if image.sizes['Z'] > 1:
         logger.info('Preparing image: performing Z-projection')
-        image_processed = image.z_projection(projection_type, projection_zrange)
+        image_processed = image.z_projection(projection_type, projection_zrange, nthreads=projection_nthreads)
     else:
         image_processed = image.image
 
@@ -340,7 +340,7 @@ class GraphFiltering(QWidget):
             if res:
                 for ext in gf.imagetypes:
                     image_path = os.path.join(os.path.dirname(mask_path), res.group(1)) + ext
-                    if os.path.isfile(image_path):
+                    if gf.isfile(image_path):
                         self.input_image.setPlaceholderText(image_path)
                         self.input_image.setToolTip(image_path)
                         break
@@ -461,7 +461,7 @@ class GraphFiltering(QWidget):
             filters.append(('filter_topology', topology_ids))
 
         # check input
-        if image_path != '' and not os.path.isfile(image_path):
+        if image_path != '' and not gf.isfile(image_path):
             self.logger.error('Image: not a valid file')
             self.input_image.setFocus()
             return
@@ -469,7 +469,7 @@ class GraphFiltering(QWidget):
             self.logger.error('Segmentation mask and cell tracking graph missing')
             return
         for mask_path in mask_paths:
-            if not os.path.isfile(mask_path):
+            if not gf.isfile(mask_path):
                 self.logger.error('Segmentation mask not found: %s', mask_path)
                 return
         for graph_path in graph_paths:
@@ -505,9 +505,10 @@ class GraphFiltering(QWidget):
         QApplication.setOverrideCursor(QCursor(Qt.BusyCursor))
         QApplication.processEvents()
 
+        output_compression = self.output_settings.get_output_compression()
         arguments = []
         for mask_path, graph_path, output_path, output_basename in zip(mask_paths, graph_paths, output_paths, output_basenames):
-            arguments.append((image_path, mask_path, graph_path, output_path, output_basename, filters, self.display_results.isChecked(), graph_topologies))
+            arguments.append((image_path, mask_path, graph_path, output_path, output_basename, filters, self.display_results.isChecked(), graph_topologies, output_compression))
         if not arguments:
             return
         nprocesses = min(len(arguments), self.nprocesses.value())
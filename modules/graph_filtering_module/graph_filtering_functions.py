@@ -612,7 +612,7 @@ class CellTracksFiltering:
         self.logger.debug("Done")
         return g2
 
-    def save(self, output_path, output_basename, relabel_mask_ids=True):
+    def save(self, output_path, output_basename, relabel_mask_ids=True, output_compression=None):
         """
         Save filtered cell tracking graph and mask as  `output_path`/`output_basename`.graphmlz and `output_path`/`output_basename`.ome.tif.
 
@@ -624,6 +624,8 @@ class CellTracksFiltering:
             output basename
         relabel_mask_ids: bool
             relabel mask ids to consecutive integer starting from 1 (keeping 0 for background).
+        output_compression: dict or None
+            output compression settings (see gf.get_tifffile_kwargs()).
         """
         if not os.path.isdir(output_path):
             self.logger.debug("creating: %s", output_path)
@@ -641,7 +643,7 @@ class CellTracksFiltering:
         ome_metadata.structured_annotations.append(CommentAnnotation(value=buffered_handler.get_messages(), namespace="VLabApp"))
         for x in self.metadata:
             ome_metadata.structured_annotations.append(CommentAnnotation(value=x, namespace="VLabApp"))
-        OmeTiffWriter.save(selected_mask, output_file, ome_xml=ome_metadata)
+        OmeTiffWriter.save(selected_mask, output_file, ome_xml=ome_metadata, tifffile_kwargs=gf.get_tifffile_kwargs(output_compression))
 
         output_file = os.path.join(output_path, output_basename+".graphmlz")
         self.logger.info("Saving cell tracking graph to %s", output_file)
@@ -664,7 +666,7 @@ class GraphFilteringWidget(QWidget):
     """
 
     # TODO: pass the mask as an Image object, instead of using the quick&dirty hack to pass the additional parameters mask_physical_pixel_sizes and mask_channel_names.
-    def __init__(self, mask, graph, viewer_images, image_path, output_path, output_basename, graph_topologies=None, mask_physical_pixel_sizes=(None, None, None), mask_channel_names=None, metadata=None):
+    def __init__(self, mask, graph, viewer_images, image_path, output_path, output_basename, graph_topologies=None, mask_physical_pixel_sizes=(None, None, None), mask_channel_names=None, metadata=None, output_compression=None):
         super().__init__()
         self.logger = logging.getLogger(__name__)
         self.mask = mask.get_TYXarray()
@@ -673,6 +675,7 @@ class GraphFilteringWidget(QWidget):
         self.image_path = image_path
         self.output_path = output_path
         self.output_basename = output_basename
+        self.output_compression = output_compression
 
         # True if filter settings have been changed but filtering has not been applied:
         self.mask_need_filtering = False
@@ -1020,7 +1023,7 @@ class GraphFilteringWidget(QWidget):
         if self.mask_need_filtering:
             self.filter(closing)
 
-        self.cell_tracks_filtering.save(self.output_path, self.output_basename, relabel_mask_ids)
+        self.cell_tracks_filtering.save(self.output_path, self.output_basename, relabel_mask_ids, self.output_compression)
 
         if not closing:
             self.mask_modified = False
@@ -1058,7 +1061,7 @@ class GraphFilteringWidget(QWidget):
         remove_all_log_handlers()
 
 
-def main(image_path, mask_path, graph_path, output_path, output_basename, filters, display_results=True, graph_topologies=None):
+def main(image_path, mask_path, graph_path, output_path, output_basename, filters, display_results=True, graph_topologies=None, output_compression=None):
     """
     Load mask (`mask_path`), cell tracking graph (`graph_path`).
     Save the selected mask and cell tracking graph into `output_path` directory.
@@ -1091,6 +1094,8 @@ def main(image_path, mask_path, graph_path, output_path, output_basename, filter
         display image, mask and results in napari.
     graph_topologies: list of igraph.Graph
         list of graph topologies. If None, create from graph. (only used when display_results == True)
+    output_compression: dict or None
+        output compression settings (see gf.get_tifffile_kwargs()).
     """
 
     # This is a temporary workaround to avoid having multiple conflicting
@@ -1207,7 +1212,7 @@ def main(image_path, mask_path, graph_path, output_path, output_basename, filter
                 ome_metadata.structured_annotations.append(CommentAnnotation(value=buffered_handler.get_messages(), namespace="VLabApp"))
                 for x in metadata:
                     ome_metadata.structured_annotations.append(CommentAnnotation(value=x, namespace="VLabApp"))
-                OmeTiffWriter.save(mask.image[0, :, 0, 0, :, :], output_file, ome_xml=ome_metadata)
+                OmeTiffWriter.save(mask.image[0, :, 0, 0, :, :], output_file, ome_xml=ome_metadata, tifffile_kwargs=gf.get_tifffile_kwargs(output_compression))
 
                 output_file = os.path.join(output_path, output_basename+".graphmlz")
                 logger.info("Saving cell tracking graph to %s", output_file)
@@ -1249,7 +1254,7 @@ def main(image_path, mask_path, graph_path, output_path, output_basename, filter
             # add GraphFilteringWidget to napari
             scroll_area = QScrollArea()
             scroll_area.setWidgetResizable(True)
-            graph_filtering_widget = GraphFilteringWidget(mask, graph, viewer_images, image_path, output_path, output_basename, graph_topologies=graph_topologies, mask_physical_pixel_sizes=mask.physical_pixel_sizes, mask_channel_names=mask.channel_names, metadata=mask_metadata+graph_metadata)
+            graph_filtering_widget = GraphFilteringWidget(mask, graph, viewer_images, image_path, output_path, output_basename, graph_topologies=graph_topologies, mask_physical_pixel_sizes=mask.physical_pixel_sizes, mask_channel_names=mask.channel_names, metadata=mask_metadata+graph_metadata, output_compression=output_compression)
             scroll_area.setWidget(graph_filtering_widget)
             viewer_images.window.add_dock_widget(scroll_area, area='right', name="Cell tracking")
             if len(filters) > 0:
@@ -1311,7 +1316,7 @@ def main(image_path, mask_path, graph_path, output_path, output_basename, filter
                     else:
                         logger.error("ignoring unknown filter %s.", filter_name)
 
-            cell_tracks_filtering.save(output_path, output_basename, relabel_mask_ids=True)
+            cell_tracks_filtering.save(output_path, output_basename, relabel_mask_ids=True, output_compression=output_compression)
             # Remove all handlers for this module
             remove_all_log_handlers()
 
@@ -87,7 +87,7 @@ class GroundTruthGenerator(QWidget):
         self.input_image_fluo2.setToolTip('')
         self.input_image_mask.setPlaceholderText('')
         self.input_image_mask.setToolTip('')
-        if os.path.isfile(image_BF_path):
+        if gf.isfile(image_BF_path):
             image_fluo_paths = [path for path in os.listdir(os.path.dirname(image_BF_path)) if any(path.endswith(imagetype) for imagetype in gf.imagetypes) and os.path.basename(path) != os.path.basename(image_BF_path) and os.path.basename(path).split('_')[0] == os.path.basename(image_BF_path).split('_')[0] and len(os.path.basename(path).split('_')) == 2 and os.path.basename(path).split('_')[1].startswith(fluo_suffix)]
             if len(image_fluo_paths) == 1:
                 image_fluo1_path = os.path.join(os.path.dirname(image_BF_path), image_fluo_paths[0])
@@ -118,7 +118,7 @@ class GroundTruthGenerator(QWidget):
         self.input_image_fluo2.setToolTip('')
         self.input_image_mask.setPlaceholderText('')
         self.input_image_mask.setToolTip('')
-        if os.path.isfile(image_fluo1_path):
+        if gf.isfile(image_fluo1_path):
             image_BF_paths = [path for path in os.listdir(os.path.dirname(image_fluo1_path)) if any(path.endswith(imagetype) for imagetype in gf.imagetypes) and os.path.basename(path) != os.path.basename(image_fluo1_path) and os.path.basename(path).split('_')[0] == os.path.basename(image_fluo1_path).split('_')[0] and len(os.path.basename(path).split('_')) == 2 and os.path.basename(path).split('_')[1].startswith(brightfield_suffix)]
             if len(image_BF_paths) == 1:
                 image_BF_path = os.path.join(os.path.dirname(image_fluo1_path), image_BF_paths[0])
@@ -147,7 +147,7 @@ class GroundTruthGenerator(QWidget):
         self.input_image_fluo2.setToolTip('')
         self.input_image_mask.setPlaceholderText('')
         self.input_image_mask.setToolTip('')
-        if os.path.isfile(image_fluo2_path):
+        if gf.isfile(image_fluo2_path):
             image_BF_paths = [path for path in os.listdir(os.path.dirname(image_fluo2_path)) if any(path.endswith(imagetype) for imagetype in gf.imagetypes) and os.path.basename(path) != os.path.basename(image_fluo2_path) and os.path.basename(path).split('_')[0] == os.path.basename(image_fluo2_path).split('_')[0] and len(os.path.basename(path).split('_')) == 2 and os.path.basename(path).split('_')[1].startswith(brightfield_suffix)]
             if len(image_BF_paths) == 1:
                 image_BF_path = os.path.join(os.path.dirname(image_fluo2_path), image_BF_paths[0])
@@ -176,7 +176,7 @@ class GroundTruthGenerator(QWidget):
         self.input_image_fluo2.setToolTip('')
         self.input_image_mask.setPlaceholderText('')
         self.input_image_mask.setToolTip('')
-        if os.path.isfile(image_mask_path):
+        if gf.isfile(image_mask_path):
             image_BF_paths = [path for path in os.listdir(os.path.dirname(image_mask_path)) if any(path.endswith(imagetype) for imagetype in gf.imagetypes) and os.path.basename(path) != os.path.basename(image_mask_path) and os.path.basename(path).split('_')[0] == os.path.basename(image_mask_path).split('_')[0] and len(os.path.basename(path).split('_')) == 2 and os.path.basename(path).split('_')[1].startswith(brightfield_suffix)]
             if len(image_BF_paths) == 1:
                 image_BF_path = os.path.join(os.path.dirname(image_mask_path), image_BF_paths[0])
@@ -217,19 +217,19 @@ class GroundTruthGenerator(QWidget):
             self.logger.error('Fluorescent image with cell marker 1 and segmentation mask missing. At least one of them must be specified.')
             self.input_image_fluo1.setFocus()
             return
-        if image_BF_path != '' and not os.path.isfile(image_BF_path):
+        if image_BF_path != '' and not gf.isfile(image_BF_path):
             self.logger.error('Image not found: %s', image_BF_path)
             self.input_image_BF.setFocus()
             return
-        if image_fluo1_path != '' and not os.path.isfile(image_fluo1_path):
+        if image_fluo1_path != '' and not gf.isfile(image_fluo1_path):
             self.logger.error('Image not found: %s', image_fluo1_path)
             self.input_image_fluo1.setFocus()
             return
-        if image_fluo2_path != '' and not os.path.isfile(image_fluo2_path):
+        if image_fluo2_path != '' and not gf.isfile(image_fluo2_path):
             self.logger.error('Image not found: %s', image_fluo2_path)
             self.input_image_fluo2.setFocus()
             return
-        if image_mask_path != '' and not os.path.isfile(image_mask_path):
+        if image_mask_path != '' and not gf.isfile(image_mask_path):
             self.logger.error('Image not found: %s', image_mask_path)
             self.input_image_mask.setFocus()
             return
@@ -256,7 +256,7 @@ class GroundTruthGenerator(QWidget):
 
         self.logger.info("Ground truth generation (%s, %s, %s, %s)", image_BF_path, image_fluo1_path, image_fluo2_path, image_mask_path)
         try:
-            f.main(image_BF_path, image_fluo1_path, image_fluo2_path, image_mask_path, output_path, output_basename)
+            f.main(image_BF_path, image_fluo1_path, image_fluo2_path, image_mask_path, output_path, output_basename, self.output_settings.get_output_compression())
         except Exception as e:
             QMessageBox.critical(self, 'Error', str(e))
             self.logger.exception("Ground truth generation failed.")
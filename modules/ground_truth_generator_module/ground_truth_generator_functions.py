@@ -125,7 +125,7 @@ class GroundTruthWidget(QWidget):
     A widget to use inside napari
     """
 
-    def __init__(self, image_BF, image_fluo1, image_fluo2, image_mask, viewer, output_path, output_basename):
+    def __init__(self, image_BF, image_fluo1, image_fluo2, image_mask, viewer, output_path, output_basename, output_compression=None):
         super().__init__()
         self.logger = logging.getLogger(__name__)
 
@@ -140,6 +140,7 @@ class GroundTruthWidget(QWidget):
         self.viewer = viewer
         self.output_path = output_path
         self.output_basename = output_basename
+        self.output_compression = output_compression
 
         if 'Mask' in self.viewer.layers:
             # To detect image modifications
@@ -324,6 +325,8 @@ class GroundTruthWidget(QWidget):
         else:
             self.logger.error('Invalid projection_zrange: %s', str(projection_zrange))
             raise TypeError(f"Invalid projection_zrange: {projection_zrange}")
+        # e.g. percentile:25 -> percentile25, trimmed_mean:10 -> trimmedmean10 (valid file name, no '_' separator)
+        output_suffix_projection_type = output_suffix_projection_type.replace(':', '').replace('_', '')
         return output_suffix_reference + output_suffix_range + output_suffix_projection_type
 
     def export(self):
@@ -363,7 +366,7 @@ class GroundTruthWidget(QWidget):
                 m = self.zshift_max.value()
                 weights = np.array([0.5**np.abs(k) for k in range(-m, m+1)])
                 z_shift = np.random.choice(np.arange(-m, m+1), size=self.image_BF.sizes['T'], p=weights / weights.sum())
-            image_BF = self.image_BF.z_projection(projection_type, projection_zrange, z_shift=z_shift)
+            image_BF = self.image_BF.z_projection(projection_type, projection_zrange, z_shift=z_shift, nthreads=self.zprojection_settings.get_nthreads())
         else:
             image_BF = self.image_BF.image
 
@@ -416,7 +419,7 @@ class GroundTruthWidget(QWidget):
             ome_metadata.structured_annotations.append(CommentAnnotation(value=x, namespace="VLabApp"))
         for x in self.image_mask_metadata:
             ome_metadata.structured_annotations.append(CommentAnnotation(value=x, namespace="VLabApp"))
-        OmeTiffWriter.save(self.mask, output_file, ome_xml=ome_metadata)
+        OmeTiffWriter.save(self.mask, output_file, ome_xml=ome_metadata, tifffile_kwargs=gf.get_tifffile_kwargs(self.output_compression))
 
         # log file
         logfile = os.path.join(self.output_path, self.output_basename+'.log')
@@ -531,7 +534,7 @@ class GroundTruthWidget(QWidget):
         self.logger.debug("Done")
 
 
-def main(image_BF_path, image_fluo1_path, image_fluo2_path, image_mask_path, output_path, output_basename):
+def main(image_BF_path, image_fluo1_path, image_fluo2_path, image_mask_path, output_path, output_basename, output_compression=None):
     """
     Generate ground truth masks
 
@@ -549,6 +552,8 @@ def main(image_BF_path, image_fluo1_path, image_fluo2_path, image_mask_path, out
         output directory
     output_basename: str
         output basename. Output file will be saved as `output_path`/`output_basename`.ome.tif
+    output_compression: dict or None
+        output compression settings (see gf.get_tifffile_kwargs()).
 
     Saves
     ---------------------
@@ -716,7 +721,7 @@ def main(image_BF_path, image_fluo1_path, image_fluo2_path, image_mask_path, out
         # Add CellTrackingWidget to napari
         scroll_area = QScrollArea()
         scroll_area.setWidgetResizable(True)
-        scroll_area.setWidget(GroundTruthWidget(image_BF, image_fluo1, image_fluo2, image_mask, viewer, output_path, output_basename))
+        scroll_area.setWidget(GroundTruthWidget(image_BF, image_fluo1, image_fluo2, image_mask, viewer, output_path, output_basename, output_compression))
         viewer.window.add_dock_widget(scroll_area, area='right', name="Ground truth")
 
     except Exception:
@@ -48,7 +48,7 @@ class ImageCropping(QWidget):
         groupbox.setLayout(layout2)
         layout.addWidget(groupbox)
 
-        self.output_settings = gf.OutputSettings(extensions=['.ome.tif'], output_suffix=self.output_suffix)
+        self.output_settings = gf.OutputSettings(extensions=['.ome.tif'], output_suffix=self.output_suffix, allow_zarr=True)
         groupbox = QGroupBox('Output')
         layout2 = QVBoxLayout()
         layout2.addWidget(self.output_settings)
@@ -321,6 +321,8 @@ class ImageCropping(QWidget):
 
     def submit(self):
         image_paths = self.image_list.get_file_list()
+        # one job per field of view for multi-position images
+        image_paths = gf.expand_fields_of_view(image_paths)
         output_basenames = [self.output_settings.get_basename(image_path) for image_path in image_paths]
         output_paths = [self.output_settings.get_path(image_path) for image_path in image_paths]
 
@@ -329,7 +331,7 @@ class ImageCropping(QWidget):
             self.logger.error('Image or mask missing')
             return
         for image_path in image_paths:
-            if not os.path.isfile(image_path):
+            if not gf.isfile(image_path):
                 self.logger.error('Image or mask not found: %s', image_path)
                 return
         if self.output_settings.output_folder.text() == '' and not self.output_settings.use_input_folder.isChecked():
@@ -376,6 +378,7 @@ class ImageCropping(QWidget):
         QApplication.setOverrideCursor(QCursor(Qt.BusyCursor))
         QApplication.processEvents()
 
+        output_compression = self.output_settings.get_output_compression()
         arguments = []
         for image_path, output_path, output_basename in zip(image_paths, output_paths, output_basenames):
             arguments.append((image_path,
@@ -386,7 +389,8 @@ class ImageCropping(QWidget):
                               Z_range,
                               Y_range,
                               X_range,
-                              self.display_results.isChecked()))
+                              self.display_results.isChecked(),
+                              output_compression))
         if not arguments:
             return
         nprocesses = min(len(arguments), self.nprocesses.value())
@@ -6,7 +6,6 @@ import numpy as np
 import napari
 import re
 from general import general_functions as gf
-from bioio.writers import OmeTiffWriter
 from bioio import PhysicalPixelSizes
 from ome_types.model import CommentAnnotation
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QFormLayout, QGroupBox, QLabel, QSpinBox, QPushButton, QScrollArea, QMessageBox, QFileDialog
@@ -27,7 +26,7 @@ class ImageCroppingWidget(QWidget):
     A widget to use inside napari
     """
 
-    def __init__(self, image, crop_T, crop_C, crop_Z, crop_Y, crop_X, T_range, C_range, Z_range, Y_range, X_range, viewer, output_path, output_basename):
+    def __init__(self, image, crop_T, crop_C, crop_Z, crop_Y, crop_X, T_range, C_range, Z_range, Y_range, X_range, viewer, output_path, output_basename, output_compression=None):
         super().__init__()
         self.logger = logging.getLogger(__name__)
 
@@ -39,6 +38,7 @@ class ImageCroppingWidget(QWidget):
         self.viewer = viewer
         self.output_path = output_path
         self.output_basename = output_basename
+        self.output_compression = output_compression
 
         # load input metadata
         self.image_metadata = []
@@ -509,7 +509,7 @@ class ImageCroppingWidget(QWidget):
         else:
             X_range = (0, self.image.sizes['X']-1)
 
-        output_name = os.path.join(self.output_path, self.output_basename+".ome.tif")
+        output_name = os.path.join(self.output_path, self.output_basename+gf.get_output_extension(self.output_compression))
         log_messages += f"{asctime} (VLabApp - image cropping module) [INFO] Saving cropped image to {output_name}\n"
         self.logger.debug("Saving cropped image to %s", output_name)
         cropped_image = self.image.image[:,
@@ -518,15 +518,16 @@ class ImageCroppingWidget(QWidget):
                                          Z_range[0]:(Z_range[1]+1),
                                          Y_range[0]:(Y_range[1]+1),
                                          X_range[0]:(X_range[1]+1)]
-        ome_metadata = OmeTiffWriter.build_ome(data_shapes=[cropped_image[0, :, :, :, :, :].shape],
-                                               data_types=[cropped_image[0, :, :, :, :, :].dtype],
-                                               dimension_order=["TCZYX"],
-                                               channel_names=[self.image.channel_names[C_range[0]:(C_range[1]+1)]],
-                                               physical_pixel_sizes=[PhysicalPixelSizes(X=self.image.physical_pixel_sizes[0], Y=self.image.physical_pixel_sizes[1], Z=self.image.physical_pixel_sizes[2])])
-        ome_metadata.structured_annotations.append(CommentAnnotation(value=log_messages, namespace="VLabApp"))
-        for x in self.image_metadata:
-            ome_metadata.structured_annotations.append(CommentAnnotation(value=x, namespace="VLabApp"))
-        OmeTiffWriter.save(cropped_image[0, :, :, :, :, :], output_name, ome_xml=ome_metadata)
+        with gf.open_image_writer(output_name, cropped_image[0, :, :, :, :, :].shape, cropped_image.dtype,
+                                    dimension_order="TCZYX",
+                                    channel_names=self.image.channel_names[C_range[0]:(C_range[1]+1)],
+                                    physical_pixel_sizes=PhysicalPixelSizes(X=self.image.physical_pixel_sizes[0], Y=self.image.physical_pixel_sizes[1], Z=self.image.physical_pixel_sizes[2]),
+                                    output_compression=self.output_compression) as writer:
+            for t in range(cropped_image.shape[1]):
+                writer.write(cropped_image[0, t, :, :, :, :])
+            writer.ome_metadata.structured_annotations.append(CommentAnnotation(value=log_messages, namespace="VLabApp"))
+            for x in self.image_metadata:
+                writer.ome_metadata.structured_annotations.append(CommentAnnotation(value=x, namespace="VLabApp"))
         # create logfile
         logfile = os.path.join(self.output_path, self.output_basename+".log")
         with open(logfile, 'w') as f:
@@ -558,7 +559,7 @@ class ImageCroppingWidget(QWidget):
         remove_all_log_handlers()
 
 
-def main(image_path, output_path, output_basename, T_range, C_range, Z_range, Y_range, X_range, display_results=False):
+def main(image_path, output_path, output_basename, T_range, C_range, Z_range, Y_range, X_range, display_results=False, output_compression=None):
     """
     Load image or mask (`image_path`), crop and
     save into `output_path` directory using filename `output_basename`.ome.tif.
@@ -570,7 +571,7 @@ def main(image_path, output_path, output_basename, T_range, C_range, Z_range, Y_
     output_path: str
         output directory.
     output_basename: str
-        output basename. Output file will be saved as `output_path`/`output_basename`.ome.tif.
+        output basename. Output file will be saved as `output_path`/`output_basename`.ome.tif (or .ome.zarr, see `output_compression`).
     T_range: (int, int) or None
         cropping range (Tmin, Tmax) for T axis (keep Tmin<=T<=Tmax) or None (do not crop T axis).
     C_range: (int, int) or None
@@ -583,6 +584,8 @@ def main(image_path, output_path, output_basename, T_range, C_range, Z_range, Y_
         cropping range (Xmin, Xmax) for X axis (keep Xmin<=X<=Xmax) or None (do not crop X axis).
     display_results: bool, default False
         display image or mask in napari to perform interactive cropping.
+    output_compression: dict or None
+        output compression settings (see gf.get_tifffile_kwargs()).
     """
 
     try:
@@ -620,11 +623,10 @@ def main(image_path, output_path, output_basename, T_range, C_range, Z_range, Y_
 
         logger.info('Input image/mask path: %s', image_path)
 
-        # Load image
+        # Load image metadata (image data are loaded once the cropping range is known)
         logger.debug("loading %s", image_path)
         try:
             image = gf.Image(image_path)
-            image.imread()
         except Exception:
             logging.getLogger(__name__).exception('Error loading image %s', image_path)
             # Remove all handlers for this module
@@ -711,13 +713,30 @@ def main(image_path, output_path, output_basename, T_range, C_range, Z_range, Y_
             X_range = (0, image.sizes['X']-1)
 
         # crop image
-        cropped_image = image.image
-        cropped_image = cropped_image[:,
-                                      T_range[0]:(T_range[1]+1),
-                                      C_range[0]:(C_range[1]+1),
-                                      Z_range[0]:(Z_range[1]+1),
-                                      Y_range[0]:(Y_range[1]+1),
-                                      X_range[0]:(X_range[1]+1)]
+        try:
+            if display_results:
+                # the whole image is needed for interactive cropping
+                image.imread()
+                cropped_image = image.image
+                cropped_image = cropped_image[:,
+                                              T_range[0]:(T_range[1]+1),
+                                              C_range[0]:(C_range[1]+1),
+                                              Z_range[0]:(Z_range[1]+1),
+                                              Y_range[0]:(Y_range[1]+1),
+                                              X_range[0]:(X_range[1]+1)]
+            else:
+                # only read T, C and Z planes within cropping range
+                image.imread(T=slice(T_range[0], T_range[1]+1),
+                             C=slice(C_range[0], C_range[1]+1),
+                             Z=slice(Z_range[0], Z_range[1]+1))
+                cropped_image = image.image[:, :, :, :,
+                                            Y_range[0]:(Y_range[1]+1),
+                                            X_range[0]:(X_range[1]+1)]
+        except Exception:
+            logging.getLogger(__name__).exception('Error loading image %s', image_path)
+            # Remove all handlers for this module
+            remove_all_log_handlers()
+            raise
 
         if display_results:
             # TODO: find a better solution to open a modal napari window.
@@ -747,7 +766,8 @@ def main(image_path, output_path, output_basename, T_range, C_range, Z_range, Y_
                                                       X_range,
                                                       viewer,
                                                       output_path,
-                                                      output_basename))
+                                                      output_basename,
+                                                      output_compression))
             viewer.window.add_dock_widget(scroll_area, area='right', name="Image cropping")
 
         else:
@@ -762,17 +782,18 @@ def main(image_path, output_path, output_basename, T_range, C_range, Z_range, Y_
                 logger.info("Cropping Y axis: from %s to %s", Y_range[0], Y_range[1])
             if crop_X:
                 logger.info("Cropping X axis: from %s to %s", X_range[0], X_range[1])
-            output_name = os.path.join(output_path, output_basename+".ome.tif")
+            output_name = os.path.join(output_path, output_basename+gf.get_output_extension(output_compression))
             logger.info("Saving cropped image to %s", output_name)
-            ome_metadata = OmeTiffWriter.build_ome(data_shapes=[cropped_image[0, :, :, :, :, :].shape],
-                                                   data_types=[cropped_image[0, :, :, :, :, :].dtype],
-                                                   dimension_order=["TCZYX"],
-                                                   channel_names=[image.channel_names[C_range[0]:(C_range[1]+1)]],
-                                                   physical_pixel_sizes=[PhysicalPixelSizes(X=image.physical_pixel_sizes[0], Y=image.physical_pixel_sizes[1], Z=image.physical_pixel_sizes[2])])
-            ome_metadata.structured_annotations.append(CommentAnnotation(value=buffered_handler.get_messages(), namespace="VLabApp"))
-            for x in image_metadata:
-                ome_metadata.structured_annotations.append(CommentAnnotation(value=x, namespace="VLabApp"))
-            OmeTiffWriter.save(cropped_image[0, :, :, :, :, :], output_name, ome_xml=ome_metadata)
+            with gf.open_image_writer(output_name, cropped_image[0, :, :, :, :, :].shape, cropped_image.dtype,
+                                        dimension_order="TCZYX",
+                                        channel_names=image.channel_names,
+                                        physical_pixel_sizes=PhysicalPixelSizes(X=image.physical_pixel_sizes[0], Y=image.physical_pixel_sizes[1], Z=image.physical_pixel_sizes[2]),
+                                        output_compression=output_compression) as writer:
+                for t in range(cropped_image.shape[1]):
+                    writer.write(cropped_image[0, t, :, :, :, :])
+                writer.ome_metadata.structured_annotations.append(CommentAnnotation(value=buffered_handler.get_messages(), namespace="VLabApp"))
+                for x in image_metadata:
+                    writer.ome_metadata.structured_annotations.append(CommentAnnotation(value=x, namespace="VLabApp"))
             # create logfile
             logfile = os.path.join(output_path, output_basename+".log")
             with open(logfile, 'w') as f:
@@ -26,8 +26,9 @@ from general import general_functions as gf
 from version import __version__ as vlabapp_version
 
 
-def process_initializer():
+def process_initializer(decode_threads=None):
     logging.basicConfig(level=logging.INFO, format="%(asctime)s (%(name)s) [%(levelname)s] %(message)s", handlers=[logging.StreamHandler(sys.stdout)], force=True)
+    gf.decode_threads = decode_threads
 
 
 class Pipeline(QWidget):
@@ -370,6 +371,7 @@ class Pipeline(QWidget):
         use_gpu = settings['use_gpu']
         nprocesses = settings['nprocesses']
         coarse_grain = settings['coarse_grain']
+        output_compression = settings.get('output_compression', None)
 
         input_image_paths = None
         input_mask_paths = None
@@ -377,7 +379,8 @@ class Pipeline(QWidget):
         input_matrix_paths = None
         input_count = 0
         if settings['input_type'] == 'image':
-            input_image_paths = settings['image_list']
+            # one job per field of view for multi-position images
+            input_image_paths = gf.expand_fields_of_view(settings['image_list'])
             input_count = len(input_image_paths)
             if settings['use_input_folder']:
                 output_paths = [os.path.dirname(path) for path in input_image_paths]
@@ -385,7 +388,7 @@ class Pipeline(QWidget):
                 output_paths = [settings['output_folder'] for path in input_image_paths]
             # check input
             for path in input_image_paths:
-                if not os.path.isfile(path):
+                if not gf.isfile(path):
                     self.logger.error('File not found: %s (module "Settings")', path)
                     return
         elif settings['input_type'] == 'mask':
@@ -397,7 +400,7 @@ class Pipeline(QWidget):
                 output_paths = [settings['output_folder'] for path in input_mask_paths]
             # check input
             for path in input_mask_paths:
-                if not os.path.isfile(path):
+                if not gf.isfile(path):
                     self.logger.error('File not found: %s (module "Settings")', path)
                     return
         elif settings['input_type'] == 'mask_graph':
@@ -411,12 +414,12 @@ class Pipeline(QWidget):
                 output_paths = [settings['output_folder'] for path in input_mask_paths]
             # check input exists
             for path in input_mask_paths:
-                if not os.path.isfile(path):
+                if not gf.isfile(path):
                     self.logger.error('File not found: %s (module "Settings")', path)
                     return
             # check input
             for path in input_graph_paths:
-                if not os.path.isfile(path):
+                if not gf.isfile(path):
                     self.logger.error('File not found: %s (module "Settings")', path)
                     return
         elif settings['input_type'] == 'image_matrix':
@@ -430,12 +433,12 @@ class Pipeline(QWidget):
                 output_paths = [settings['output_folder'] for path in input_image_paths]
             # check input exists
             for path in input_image_paths:
-                if not os.path.isfile(path):
+                if not gf.isfile(path):
                     self.logger.error('File not found: %s (module "Settings")', path)
                     return
             # check input
             for path in input_matrix_paths:
-                if not os.path.isfile(path):
+                if not gf.isfile(path):
                     self.logger.error('File not found: %s (module "Settings")', path)
                     return
         elif settings['input_type'] == 'mask_matrix':
@@ -449,12 +452,12 @@ class Pipeline(QWidget):
                 output_paths = [settings['output_folder'] for path in input_mask_paths]
             # check input exists
             for path in input_mask_paths:
-                if not os.path.isfile(path):
+                if not gf.isfile(path):
                     self.logger.error('File not found: %s (module "Settings")', path)
                     return
             # check input
             for path in input_matrix_paths:
-                if not os.path.isfile(path):
+                if not gf.isfile(path):
                     self.logger.error('File not found: %s (module "Settings")', path)
                     return
 
@@ -555,6 +558,8 @@ class Pipeline(QWidget):
                     output_basename = gf.splitext(os.path.basename(image_path))[0] + output_suffix + user_suffix
                     channel_position = settings['channel_position']
                     projection_type = settings['projection_type']
+                    # nested parallelism (threads) only when jobs are not run in parallel
+                    projection_nthreads = 1 if nprocesses > 1 and coarse_grain else settings.get('projection_nthreads', 1)
                     if settings['projection_mode_bestZ']:
                         projection_zrange = 0
                     elif settings['projection_mode_around_bestZ']:
@@ -569,6 +574,7 @@ class Pipeline(QWidget):
                         timepoint_range = None
                     skip_crop_decision = settings['skip_cropping_yn']
                     registration_method = settings['registration_method']
+                    registration_nthreads = 1 if nprocesses > 1 and coarse_grain else settings.get('registration_nthreads', 1)
                     coalign_image_paths = []
                     coalign_output_basenames = []
                     if settings['coalignment_yn']:
@@ -576,10 +582,16 @@ class Pipeline(QWidget):
                         for im in os.listdir(os.path.dirname(image_path)):
                             if im.startswith(unique_identifier+'_') and output_suffix not in im and any(im.endswith(imagetype) for imagetype in gf.imagetypes):
                                 coalign_image_path = os.path.join(os.path.dirname(image_path), im)
-                                if os.path.normpath(coalign_image_path) != os.path.normpath(image_path):
+                                if os.path.normpath(coalign_image_path) != os.path.normpath(gf.split_field_of_view_path(image_path)[0]):
+                                    field_of_view = gf.split_field_of_view_path(image_path)[1]
+                                    if field_of_view is not None:
+                                        # co-align the same field of view
+                                        coalign_image_path = gf.field_of_view_path(coalign_image_path, field_of_view)
                                     coalign_output_basename = gf.splitext(os.path.basename(coalign_image_path))[0] + output_suffix + user_suffix
                                     coalign_image_paths.append(coalign_image_path)
                                     coalign_output_basenames.append(coalign_output_basename)
+                    # with coarse grain parallelization, co-alignment is done in independent jobs (see below)
+                    coalign_jobs = nprocesses > 1 and coarse_grain
                     jobs.append({'function': registration_functions.registration_main,
                                  'arguments': (image_path,
                                                output_path,
@@ -590,20 +602,44 @@ class Pipeline(QWidget):
                                                timepoint_range,
                                                skip_crop_decision,
                                                registration_method,
-                                               coalign_image_paths,
-                                               coalign_output_basenames),
+                                               None if coalign_jobs else coalign_image_paths,
+                                               None if coalign_jobs else coalign_output_basenames,
+                                               output_compression,
+                                               projection_nthreads,
+                                               registration_nthreads,
+                                               settings.get('registration_pyramid_levels', 0),
+                                               settings.get('registration_reuse_features', False),
+                                               settings.get('registration_profile_fallback', True),
+                                               settings.get('virtual_output_yn', False)),
                                  'depends': [last_job_with_same_input_idx] if last_job_with_same_input_idx is not None else [],
                                  'module_label': module_label,
                                  'module_idx': module_idx,
                                  'input_idx': input_idx,
                                  'use_gpu': False,
-                                 'output_files': [os.path.join(output_path, output_basename)] + [os.path.join(output_path, x) for x in coalign_output_basenames]})
+                                 'output_files': [os.path.join(output_path, output_basename)] + ([] if coalign_jobs else [os.path.join(output_path, x) for x in coalign_output_basenames])})
+                    registration_job_idx = len(jobs) - 1
+                    if coalign_jobs:
+                        for coalign_image_path, coalign_output_basename in zip(coalign_image_paths, coalign_output_basenames):
+                            jobs.append({'function': registration_functions.alignment_main,
+                                         'arguments': (coalign_image_path,
+                                                       os.path.join(output_path, output_basename+'.csv'),
+                                                       output_path,
+                                                       coalign_output_basename,
+                                                       skip_crop_decision,
+                                                       output_compression,
+                                                       settings.get('virtual_output_yn', False)),
+                                         'depends': [registration_job_idx],
+                                         'module_label': module_label,
+                                         'module_idx': module_idx,
+                                         'input_idx': input_idx,
+                                         'use_gpu': False,
+                                         'output_files': [os.path.join(output_path, coalign_output_basename)]})
                     # to be used by next module
-                    next_image_path = os.path.join(output_path, output_basename+'.ome.tif')
+                    next_image_path = os.path.join(output_path, output_basename+(gf.virtualtypes[0] if settings.get('virtual_output_yn', False) else gf.get_output_extension(output_compression)))
                     next_mask_path = None
                     next_graph_path = None
                     next_matrix_path = os.path.join(output_path, output_basename+'.csv')
-                    last_job_with_same_input_idx = len(jobs) - 1
+                    last_job_with_same_input_idx = registration_job_idx
                 if module_name == 'registration_alignment_image':
                     image_path = next_image_path
                     matrix_path = next_matrix_path
@@ -616,7 +652,9 @@ class Pipeline(QWidget):
                                                matrix_path,
                                                output_path,
                                                output_basename,
-                                               skip_crop_decision),
+                                               skip_crop_decision,
+                                               output_compression,
+                                               settings.get('virtual_output_yn', False)),
                                  'depends': [last_job_with_same_input_idx] if last_job_with_same_input_idx is not None else [],
                                  'module_label': module_label,
                                  'module_idx': module_idx,
@@ -624,7 +662,7 @@ class Pipeline(QWidget):
                                  'use_gpu': False,
                                  'output_files': [os.path.join(output_path, output_basename)]})
                     # to be used by next module
-                    next_image_path = os.path.join(output_path, output_basename+'.ome.tif')
+                    next_image_path = os.path.join(output_path, output_basename+(gf.virtualtypes[0] if settings.get('virtual_output_yn', False) else gf.get_output_extension(output_compression)))
                     next_mask_path = None
                     next_graph_path = None
                     next_matrix_path = None
@@ -641,7 +679,9 @@ class Pipeline(QWidget):
                                                matrix_path,
                                                output_path,
                                                output_basename,
-                                               skip_crop_decision),
+                                               skip_crop_decision,
+                                               output_compression,
+                                               settings.get('virtual_output_yn', False)),
                                  'depends': [last_job_with_same_input_idx] if last_job_with_same_input_idx is not None else [],
                                  'module_label': module_label,
                                  'module_idx': module_idx,
@@ -650,7 +690,7 @@ class Pipeline(QWidget):
                                  'output_files': [os.path.join(output_path, output_basename)]})
                     # to be used by next module
                     next_image_path = None
-                    next_mask_path = os.path.join(output_path, output_basename+'.ome.tif')
+                    next_mask_path = os.path.join(output_path, output_basename+(gf.virtualtypes[0] if settings.get('virtual_output_yn', False) else gf.get_output_extension(output_compression)))
                     next_graph_path = None
                     next_matrix_path = None
                     last_job_with_same_input_idx = len(jobs) - 1
@@ -658,6 +698,8 @@ class Pipeline(QWidget):
                     image_path = next_image_path
                     output_suffix = gf.output_suffixes['zprojection']
                     projection_type = settings['projection_type']
+                    # nested parallelism (threads) only when jobs are not run in parallel
+                    projection_nthreads = 1 if nprocesses > 1 and coarse_grain else settings.get('projection_nthreads', 1)
                     if settings['projection_mode_bestZ']:
                         projection_zrange = 0
                     elif settings['projection_mode_around_bestZ']:
@@ -666,13 +708,23 @@ class Pipeline(QWidget):
                         projection_zrange = (settings['projection_mode_fixed_zmin'], settings['projection_mode_fixed_zmax'])
                     elif settings['projection_mode_all']:
                         projection_zrange = None
+                    # -1: best focus estimated independently for each channel
+                    projection_focus_channel = settings.get('projection_focus_channel', -1)
+                    if projection_focus_channel < 0:
+                        projection_focus_channel = None
+                    # 0: best focus searched over all z sections (no tracking)
+                    projection_focus_tracking = settings.get('projection_focus_tracking', 0) or None
                     output_basename = gf.splitext(os.path.basename(image_path))[0] + output_suffix + module_widget.get_projection_suffix(image_path, projection_zrange, projection_type)
                     jobs.append({'function': zprojection_functions.main,
                                  'arguments': (image_path,
                                                output_path,
                                                output_basename,
                                                projection_type,
-                                               projection_zrange),
+                                               projection_zrange,
+                                               output_compression,
+                                               projection_nthreads,
+                                               projection_focus_channel,
+                                               projection_focus_tracking),
                                  'depends': [last_job_with_same_input_idx] if last_job_with_same_input_idx is not None else [],
                                  'module_label': module_label,
                                  'module_idx': module_idx,
@@ -680,7 +732,7 @@ class Pipeline(QWidget):
                                  'use_gpu': False,
                                  'output_files': [os.path.join(output_path, output_basename)]})
                     # to be used by next module
-                    next_image_path = os.path.join(output_path, output_basename+'.ome.tif')
+                    next_image_path = os.path.join(output_path, output_basename+gf.get_output_extension(output_compression))
                     next_mask_path = None
                     next_graph_path = None
                     next_matrix_path = None
@@ -699,6 +751,8 @@ class Pipeline(QWidget):
                     output_basename = gf.splitext(os.path.basename(image_path))[0] + output_suffix + user_suffix
                     channel_position = settings['channel_position']
                     projection_type = settings['projection_type']
+                    # nested parallelism (threads) only when jobs are not run in parallel
+                    projection_nthreads = 1 if nprocesses > 1 and coarse_grain else settings.get('projection_nthreads', 1)
                     if settings['projection_mode_bestZ']:
                         projection_zrange = 0
                     elif settings['projection_mode_around_bestZ']:
@@ -739,7 +793,9 @@ class Pipeline(QWidget):
                                                nprocesses_segmentation,
                                                display_results,
                                                use_gpu,
-                                               run_parallel),
+                                               run_parallel,
+                                               output_compression,
+                                               projection_nthreads),
                                  'depends': [last_job_with_same_input_idx] if last_job_with_same_input_idx is not None else [],
                                  'module_label': module_label,
                                  'module_idx': module_idx,
@@ -748,7 +804,7 @@ class Pipeline(QWidget):
                                  'output_files': [os.path.join(output_path, output_basename)]})
                     # to be used by next module
                     next_image_path = None
-                    next_mask_path = os.path.join(output_path, output_basename+'.ome.tif')
+                    next_mask_path = os.path.join(output_path, output_basename+gf.get_output_extension(output_compression))
                     next_graph_path = None
                     next_matrix_path = None
                     last_job_with_same_input_idx = len(jobs) - 1
@@ -787,7 +843,8 @@ class Pipeline(QWidget):
                                                nframes_defect,
                                                nframes_stable,
                                                stable_overlap_fraction,
-                                               display_results),
+                                               display_results,
+                                               output_compression),
                                  'depends': [last_job_with_same_input_idx] if last_job_with_same_input_idx is not None else [],
                                  'module_label': module_label,
                                  'module_idx': module_idx,
@@ -845,7 +902,8 @@ class Pipeline(QWidget):
                                                output_basename,
                                                filters,
                                                display_results,
-                                               graph_topologies),
+                                               graph_topologies,
+                                               output_compression),
                                  'depends': [last_job_with_same_input_idx] if last_job_with_same_input_idx is not None else [],
                                  'module_label': module_label,
                                  'module_idx': module_idx,
@@ -882,7 +940,8 @@ class Pipeline(QWidget):
                                                filter_border,
                                                border_width,
                                                filter_nmissing,
-                                               nmissing),
+                                               nmissing,
+                                               output_compression),
                                  'depends': [last_job_with_same_input_idx] if last_job_with_same_input_idx is not None else [],
                                  'module_label': module_label,
                                  'module_idx': module_idx,
@@ -925,10 +984,25 @@ class Pipeline(QWidget):
 
         # start jobs multi-process
         max_gpu_job_count = 1
+        # number of threads used to decode input images, such that processes x threads does not exceed nprocesses
+        decode_threads = 1 if nprocesses > 1 and coarse_grain else nprocesses
         if nprocesses > 1 and coarse_grain:
-            with concurrent.futures.ProcessPoolExecutor(max_workers=nprocesses, initializer=process_initializer) as executor:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=nprocesses, initializer=process_initializer, initargs=(decode_threads,)) as executor:
                 jobs_to_submit = list(range(len(jobs)))
                 jobs_submitted = []
+                # jobs sharing the same status table cell (registration and co-alignment jobs)
+                cell_jobs = {}
+                for n, job in enumerate(jobs):
+                    cell_jobs.setdefault((job['input_idx'], job['module_idx']), []).append(n)
+
+                def cell_status(n, status):
+                    # status of the cell of job n, given the status of job n and of the other jobs sharing the cell
+                    statuses = [jobs[m].get('status') for m in cell_jobs[(jobs[n]['input_idx'], jobs[n]['module_idx'])] if m != n]
+                    if 'Failed' in statuses:
+                        return 'Failed'
+                    if status == 'Success' and any(x != 'Success' for x in statuses):
+                        return 'Running'
+                    return status
                 while len(jobs_to_submit) + len(jobs_submitted) > 0:
                     QApplication.processEvents()
                     time.sleep(0.01)
@@ -944,9 +1018,10 @@ class Pipeline(QWidget):
                                 cancel_job = True
                         if cancel_job:
                             jobs[n]['status'] = 'Cancelled'
-                            status_dialog.table.item(jobs[n]['input_idx'], jobs[n]['module_idx']-1).setText('Cancelled')
-                            status_dialog.table.item(jobs[n]['input_idx'], jobs[n]['module_idx']-1).setBackground(QBrush(QColor('#ffc8c8')))
-                            status_dialog.table.item(jobs[n]['input_idx'], jobs[n]['module_idx']-1).setForeground(QBrush(QColor('#000000')))
+                            if cell_status(n, 'Cancelled') == 'Cancelled':
+                                status_dialog.table.item(jobs[n]['input_idx'], jobs[n]['module_idx']-1).setText('Cancelled')
+                                status_dialog.table.item(jobs[n]['input_idx'], jobs[n]['module_idx']-1).setBackground(QBrush(QColor('#ffc8c8')))
+                                status_dialog.table.item(jobs[n]['input_idx'], jobs[n]['module_idx']-1).setForeground(QBrush(QColor('#000000')))
                             jobs_to_submit.remove(n)
                             break
                         if jobs[n]['use_gpu']:
@@ -957,9 +1032,10 @@ class Pipeline(QWidget):
                             if gpu_job_count > max_gpu_job_count - 1:
                                 submit_job = False
                         if submit_job:
-                            status_dialog.table.item(jobs[n]['input_idx'], jobs[n]['module_idx']-1).setText('Waiting')
-                            status_dialog.table.item(jobs[n]['input_idx'], jobs[n]['module_idx']-1).setBackground(QBrush(QColor('#c8c8ff')))
-                            status_dialog.table.item(jobs[n]['input_idx'], jobs[n]['module_idx']-1).setForeground(QBrush(QColor('#000000')))
+                            if cell_status(n, 'Waiting') == 'Waiting':
+                                status_dialog.table.item(jobs[n]['input_idx'], jobs[n]['module_idx']-1).setText('Waiting')
+                                status_dialog.table.item(jobs[n]['input_idx'], jobs[n]['module_idx']-1).setBackground(QBrush(QColor('#c8c8ff')))
+                                status_dialog.table.item(jobs[n]['input_idx'], jobs[n]['module_idx']-1).setForeground(QBrush(QColor('#000000')))
                             jobs[n]['future'] = executor.submit(jobs[n]['function'], *jobs[n]['arguments'])
                             jobs_to_submit.remove(n)
                             jobs_submitted.append(n)
@@ -968,14 +1044,17 @@ class Pipeline(QWidget):
                     time.sleep(0.01)
                     for n in jobs_submitted.copy():
                         if jobs[n]['future'].running():
+                            if cell_status(n, 'Running') != 'Running':
+                                continue
                             status_dialog.table.item(jobs[n]['input_idx'], jobs[n]['module_idx']-1).setText('Running')
                             status_dialog.table.item(jobs[n]['input_idx'], jobs[n]['module_idx']-1).setBackground(QBrush(QColor('#0000ff')))
                             status_dialog.table.item(jobs[n]['input_idx'], jobs[n]['module_idx']-1).setForeground(QBrush(QColor('#ffffff')))
                         elif jobs[n]['future'].cancelled():
                             jobs[n]['status'] = 'Cancelled'
-                            status_dialog.table.item(jobs[n]['input_idx'], jobs[n]['module_idx']-1).setText('Cancelled')
-                            status_dialog.table.item(jobs[n]['input_idx'], jobs[n]['module_idx']-1).setBackground(QBrush(QColor('#ffc8c8')))
-                            status_dialog.table.item(jobs[n]['input_idx'], jobs[n]['module_idx']-1).setForeground(QBrush(QColor('#000000')))
+                            if cell_status(n, 'Cancelled') == 'Cancelled':
+                                status_dialog.table.item(jobs[n]['input_idx'], jobs[n]['module_idx']-1).setText('Cancelled')
+                                status_dialog.table.item(jobs[n]['input_idx'], jobs[n]['module_idx']-1).setBackground(QBrush(QColor('#ffc8c8')))
+                                status_dialog.table.item(jobs[n]['input_idx'], jobs[n]['module_idx']-1).setForeground(QBrush(QColor('#000000')))
                             jobs_submitted.remove(n)
                             break
                         elif jobs[n]['future'].done():
@@ -984,9 +1063,10 @@ class Pipeline(QWidget):
                                 jobs[n]['future'].result()
                                 jobs[n]['status'] = 'Success'
                                 jobs[n]['error_message'] = ''
-                                status_dialog.table.item(jobs[n]['input_idx'], jobs[n]['module_idx']-1).setText('Success')
-                                status_dialog.table.item(jobs[n]['input_idx'], jobs[n]['module_idx']-1).setBackground(QBrush(QColor('#00ff00')))
-                                status_dialog.table.item(jobs[n]['input_idx'], jobs[n]['module_idx']-1).setForeground(QBrush(QColor('#000000')))
+                                if cell_status(n, 'Success') == 'Success':
+                                    status_dialog.table.item(jobs[n]['input_idx'], jobs[n]['module_idx']-1).setText('Success')
+                                    status_dialog.table.item(jobs[n]['input_idx'], jobs[n]['module_idx']-1).setBackground(QBrush(QColor('#00ff00')))
+                                    status_dialog.table.item(jobs[n]['input_idx'], jobs[n]['module_idx']-1).setForeground(QBrush(QColor('#000000')))
                             except Exception as e:
                                 jobs[n]['status'] = 'Failed'
                                 jobs[n]['error_message'] = str(e)
@@ -997,7 +1077,15 @@ class Pipeline(QWidget):
                             break
 
         else:
-            for job in jobs:
+            default_decode_threads = gf.decode_threads
+            gf.decode_threads = decode_threads
+            for n, job in enumerate(jobs):
+                # read the input of the next job with existing input (i.e. not depending on the current job) in background
+                for next_job in jobs[n+1:]:
+                    if all(jobs[m].get('status') == 'Success' for m in next_job['depends']):
+                        if isinstance(next_job['arguments'][0], str) and gf.isfile(next_job['arguments'][0]):
+                            gf.prefetch_image(next_job['arguments'][0])
+                        break
                 status_dialog.table.item(job['input_idx'], job['module_idx']-1).setText('Waiting')
                 status_dialog.table.item(job['input_idx'], job['module_idx']-1).setBackground(QBrush(QColor('#c8c8ff')))
                 status_dialog.table.item(job['input_idx'], job['module_idx']-1).setForeground(QBrush(QColor('#000000')))
@@ -1032,7 +1120,9 @@ class Pipeline(QWidget):
                         status_dialog.table.item(job['input_idx'], job['module_idx']-1).setToolTip(job['error_message'])
                         QApplication.processEvents()
                         time.sleep(0.01)
+            gf.decode_threads = default_decode_threads
 
+        gf.clear_prefetched_images()
         status_dialog.ok_button.show()
         status_dialog.abort_button.hide()
 
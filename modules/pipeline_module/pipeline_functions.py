@@ -351,6 +351,7 @@ class GeneralSettings(QWidget):
         self.output_filename_label = QLineEdit()
         self.output_filename_label.setFrame(False)
         self.output_filename_label.setEnabled(False)
+        self.output_compression = gf.OutputCompressionSettings()
 
         # Multi-processing
         self.use_gpu = QCheckBox("Use GPU")
@@ -429,6 +430,9 @@ class GeneralSettings(QWidget):
         layout2.addWidget(self.use_input_folder)
         layout2.addWidget(self.use_custom_folder)
         layout2.addWidget(self.output_folder)
+        layout3 = QFormLayout()
+        layout3.addRow("Format:", self.output_compression)
+        layout2.addLayout(layout3)
         groupbox.setLayout(layout2)
         layout.addWidget(groupbox)
 
@@ -461,6 +465,7 @@ class GeneralSettings(QWidget):
             'use_input_folder': self.use_input_folder.isChecked(),
             'use_custom_folder': self.use_custom_folder.isChecked(),
             'output_folder': self.output_folder.text(),
+            'output_compression': self.output_compression.get_output_compression(),
             'image_list': self.image_list.get_file_list() if self.input_type == 'image' else [],
             'mask_list': self.mask_list.get_file_list() if self.input_type == 'mask' else [],
             'mask_graph_table': self.mask_graph_table.get_file_table() if self.input_type == 'mask_graph' else [],
@@ -477,6 +482,8 @@ class GeneralSettings(QWidget):
         self.use_input_folder.setChecked(widgets_state['use_input_folder'])
         self.use_custom_folder.setChecked(widgets_state['use_custom_folder'])
         self.output_folder.setText(widgets_state['output_folder'])
+        if 'output_compression' in widgets_state:
+            self.output_compression.set_output_compression(widgets_state['output_compression'])
         self.image_list.set_file_list(widgets_state['image_list'])
         self.mask_list.set_file_list(widgets_state['mask_list'])
         self.mask_graph_table.set_file_table(widgets_state['mask_graph_table'])
@@ -36,7 +36,7 @@ class Perform(QWidget):
         self.channel_position.setMaximum(100)
         self.channel_position.setValue(0)
 
-        self.output_settings = gf.OutputSettings(extensions=['.csv', '.ome.tif'], output_suffix=self.output_suffix, pipeline_layout=self.pipeline_layout)
+        self.output_settings = gf.OutputSettings(extensions=['.csv', '.ome.tif'], output_suffix=self.output_suffix, pipeline_layout=self.pipeline_layout, allow_zarr=True)
 
         # Z-Projection
         self.zprojection_settings = gf.ZProjectionSettings()
@@ -45,13 +45,33 @@ class Perform(QWidget):
         self.registration_method = QComboBox()
         self.registration_method.addItem("stackreg")
         self.registration_method.addItem("phase correlation")
+        self.registration_method.addItem("phase correlation (pairwise)")
+        self.registration_method.addItem("projection profiles")
         self.registration_method.addItem("feature matching (ORB)")
         self.registration_method.addItem("feature matching (BRISK)")
         self.registration_method.addItem("feature matching (AKAZE)")
         self.registration_method.addItem("feature matching (SIFT)")
         self.registration_method.setCurrentText("feature matching (SIFT)")
+        self.registration_nthreads = QSpinBox()
+        self.registration_nthreads.setMinimum(1)
+        self.registration_nthreads.setMaximum(os.cpu_count())
+        self.registration_nthreads.setValue(1)
+        self.registration_nthreads.setToolTip('Number of threads used to evaluate the transformation matrix (per process).\nOnly used by "phase correlation (pairwise)" method, which registers pairs of consecutive time frames independently,\nby feature matching methods when detecting features once per time frame,\nby "projection profiles" method when falling back to phase correlation\nand by full resolution refinement when pyramid levels > 0.')
+        self.registration_reuse_features = QCheckBox("Detect features once per time frame")
+        self.registration_reuse_features.setToolTip('Feature matching methods only.\nDetect keypoints and evaluate descriptors once per time frame (in parallel, see "Number of threads")\nand match keypoints of consecutive time frames, instead of detecting keypoints again on the shifted previous time frame (faster).')
+        self.registration_profile_fallback = QCheckBox("Fall back to phase correlation when ambiguous")
+        self.registration_profile_fallback.setChecked(True)
+        self.registration_profile_fallback.setToolTip('"projection profiles" method only.\nRegister pairs of consecutive time frames using phase correlation\nwhen the cross-correlation peak of their projection profiles is ambiguous.')
+        self.registration_pyramid_levels = QSpinBox()
+        self.registration_pyramid_levels.setMinimum(0)
+        self.registration_pyramid_levels.setMaximum(3)
+        self.registration_pyramid_levels.setValue(0)
+        self.registration_pyramid_levels.setSpecialValueText("Off")
+        self.registration_pyramid_levels.setToolTip('Coarse-to-fine registration for large frames.\nEvaluate the transformation matrix on time frames downsampled by a factor 2^levels (2x, 4x or 8x),\nthen refine it at full resolution using phase correlation on a small window around the coarse estimate.')
         self.coalignment_yn = QCheckBox("Co-align files with the same unique identifier (part of the filename before the first \"_\")")
         self.skip_cropping_yn = QCheckBox("Do NOT crop aligned image")
+        self.virtual_output_yn = QCheckBox("Save virtual registered image")
+        self.virtual_output_yn.setToolTip('Instead of a registered copy of the image, save a small file (.vreg) referencing the input image and the transformation matrix.\nShifts and cropping are applied when the virtual registered image is read by other modules.\nThe input image must not be moved or deleted.')
         self.submit_button = QPushButton("Submit")
         self.submit_button.clicked.connect(self.submit)
         self.nprocesses = QSpinBox()
@@ -134,8 +154,13 @@ class Perform(QWidget):
         layout2.addRow(groupbox2)
 
         layout2.addRow("Registration method:", self.registration_method)
+        layout2.addRow("Number of threads:", self.registration_nthreads)
+        layout2.addRow("Pyramid levels:", self.registration_pyramid_levels)
+        layout2.addRow(self.registration_reuse_features)
+        layout2.addRow(self.registration_profile_fallback)
         layout2.addRow(self.coalignment_yn)
         layout2.addRow(self.skip_cropping_yn)
+        layout2.addRow(self.virtual_output_yn)
         groupbox.setLayout(layout2)
         layout.addWidget(groupbox)
 
@@ -167,14 +192,20 @@ class Perform(QWidget):
             'projection_mode_fixed_zmin': self.zprojection_settings.projection_mode_fixed_zmin.value(),
             'projection_mode_fixed_zmax': self.zprojection_settings.projection_mode_fixed_zmax.value(),
             'projection_mode_all': self.zprojection_settings.projection_mode_all.isChecked(),
-            'projection_type': self.zprojection_settings.projection_type.currentText(),
+            'projection_type': self.zprojection_settings.get_projection_type(),
+            'projection_nthreads': self.zprojection_settings.nthreads.value(),
             'time_mode_all': self.time_mode_all.isChecked(),
             'time_mode_fixed': self.time_mode_fixed.isChecked(),
             'time_mode_fixed_tmin': self.time_mode_fixed_tmin.value(),
             'time_mode_fixed_tmax': self.time_mode_fixed_tmax.value(),
             'registration_method': self.registration_method.currentText(),
+            'registration_nthreads': self.registration_nthreads.value(),
+            'registration_pyramid_levels': self.registration_pyramid_levels.value(),
+            'registration_reuse_features': self.registration_reuse_features.isChecked(),
+            'registration_profile_fallback': self.registration_profile_fallback.isChecked(),
             'coalignment_yn': self.coalignment_yn.isChecked(),
             'skip_cropping_yn': self.skip_cropping_yn.isChecked(),
+            'virtual_output_yn': self.virtual_output_yn.isChecked(),
             'nprocesses': self.nprocesses.value()}
         return widgets_state
 
@@ -192,18 +223,26 @@ class Perform(QWidget):
         self.zprojection_settings.projection_mode_fixed_zmin.setValue(widgets_state['projection_mode_fixed_zmin'])
         self.zprojection_settings.projection_mode_fixed_zmax.setValue(widgets_state['projection_mode_fixed_zmax'])
         self.zprojection_settings.projection_mode_all.setChecked(widgets_state['projection_mode_all'])
-        self.zprojection_settings.projection_type.setCurrentText(widgets_state['projection_type'])
+        self.zprojection_settings.set_projection_type(widgets_state['projection_type'])
+        self.zprojection_settings.nthreads.setValue(widgets_state.get('projection_nthreads', 1))
         self.time_mode_all.setChecked(widgets_state['time_mode_all'])
         self.time_mode_fixed.setChecked(widgets_state['time_mode_fixed'])
         self.time_mode_fixed_tmin.setValue(widgets_state['time_mode_fixed_tmin'])
         self.time_mode_fixed_tmax.setValue(widgets_state['time_mode_fixed_tmax'])
         self.registration_method.setCurrentText(widgets_state['registration_method'])
+        self.registration_nthreads.setValue(widgets_state.get('registration_nthreads', 1))
+        self.registration_pyramid_levels.setValue(widgets_state.get('registration_pyramid_levels', 0))
+        self.registration_reuse_features.setChecked(widgets_state.get('registration_reuse_features', False))
+        self.registration_profile_fallback.setChecked(widgets_state.get('registration_profile_fallback', True))
         self.coalignment_yn.setChecked(widgets_state['coalignment_yn'])
         self.skip_cropping_yn.setChecked(widgets_state['skip_cropping_yn'])
+        self.virtual_output_yn.setChecked(widgets_state.get('virtual_output_yn', False))
         self.nprocesses.setValue(widgets_state['nprocesses'])
 
     def submit(self):
         image_paths = self.image_list.get_file_list()
+        # one job per field of view for multi-position images
+        image_paths = gf.expand_fields_of_view(image_paths)
 
         channel_position = self.channel_position.value()
         projection_type = self.zprojection_settings.get_projection_type()
@@ -217,13 +256,14 @@ class Perform(QWidget):
         registration_method = self.registration_method.currentText()
         coalignment = self.coalignment_yn.isChecked()
         skip_crop_decision = self.skip_cropping_yn.isChecked()
+        output_compression = self.output_settings.get_output_compression()
 
         # check inputs
         if len(image_paths) == 0:
             self.logger.error('Image missing')
             return
         for path in image_paths:
-            if not os.path.isfile(path):
+            if not gf.isfile(path):
                 self.logger.error('Image not found\n%s', path)
                 return
 
@@ -239,7 +279,11 @@ class Perform(QWidget):
                 for im in os.listdir(os.path.dirname(image_path)):
                     if im.startswith(unique_identifier+'_') and self.output_suffix not in im and any(im.endswith(imagetype) for imagetype in gf.imagetypes):
                         coalign_image_path = os.path.join(os.path.dirname(image_path), im)
-                        if os.path.normpath(coalign_image_path) not in [os.path.normpath(p) for p in image_paths]:
+                        if os.path.normpath(coalign_image_path) not in [os.path.normpath(gf.split_field_of_view_path(p)[0]) for p in image_paths]:
+                            field_of_view = gf.split_field_of_view_path(image_path)[1]
+                            if field_of_view is not None:
+                                # co-align the same field of view
+                                coalign_image_path = gf.field_of_view_path(coalign_image_path, field_of_view)
                             coalign_output_basename = self.output_settings.get_basename(coalign_image_path)
                             coalign_image_paths.append(coalign_image_path)
                             coalign_output_basenames.append(coalign_output_basename)
@@ -287,7 +331,8 @@ class Perform(QWidget):
         arguments = []
         for image_path, output_path, output_basename, coalign_image_paths, coalign_output_basenames in zip(image_paths, output_paths, output_basenames, coalign_image_paths_list, coalign_output_basenames_list):
             # collect arguments
-            arguments.append((image_path, output_path, output_basename, channel_position, projection_type, projection_zrange, timepoint_range, skip_crop_decision, registration_method, coalign_image_paths, coalign_output_basenames))
+            # co-alignment is submitted as independent jobs (see below)
+            arguments.append((image_path, output_path, output_basename, channel_position, projection_type, projection_zrange, timepoint_range, skip_crop_decision, registration_method, None, None, output_compression, self.zprojection_settings.get_nthreads(), self.registration_nthreads.value(), self.registration_pyramid_levels.value(), self.registration_reuse_features.isChecked(), self.registration_profile_fallback.isChecked(), self.virtual_output_yn.isChecked()))
         if not arguments:
             return
         nprocesses = min(len(arguments), self.nprocesses.value())
@@ -302,16 +347,45 @@ class Perform(QWidget):
         time.sleep(0.01)
 
         with concurrent.futures.ProcessPoolExecutor(max_workers=nprocesses, initializer=process_initializer) as executor:
-            future_reg = {executor.submit(f.registration_main, *args): i for i, args in enumerate(arguments)}
+            # each process reads the input image of its next job (assuming similar job durations) while processing the current job
+            future_reg = {executor.submit(gf.run_prefetched, f.registration_main, args, arguments[i+nprocesses][0] if i+nprocesses < len(arguments) else None): i for i, args in enumerate(arguments)}
+            # co-alignment jobs (one per image to co-align), submitted when the corresponding registration is done
+            future_coalign = {}
+            coalign_errors = {}
+            pending = set(future_reg)
             QApplication.processEvents()
             time.sleep(0.01)
-            for future in concurrent.futures.as_completed(future_reg):
-                try:
-                    future.result()
-                    status_dialog.set_status(future_reg[future], 'Success')
-                except Exception as e:
-                    self.logger.exception("An exception occurred")
-                    status_dialog.set_status(future_reg[future], 'Failed', str(e))
+            while len(pending) > 0:
+                done, pending = concurrent.futures.wait(pending, timeout=0.1, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    if future in future_reg:
+                        i = future_reg[future]
+                        try:
+                            future.result()
+                        except Exception as e:
+                            self.logger.exception("An exception occurred")
+                            status_dialog.set_status(i, 'Failed', str(e))
+                            continue
+                        if coalign_image_paths_list[i]:
+                            tmat_path = os.path.join(output_paths[i], output_basenames[i]+'.csv')
+                            for coalign_image_path, coalign_output_basename in zip(coalign_image_paths_list[i], coalign_output_basenames_list[i]):
+                                future_coalign[executor.submit(f.alignment_main, coalign_image_path, tmat_path, output_paths[i], coalign_output_basename, skip_crop_decision, output_compression, self.virtual_output_yn.isChecked())] = i
+                            pending.update(x for x, j in future_coalign.items() if j == i)
+                            status_dialog.set_status(i, 'Co-aligning')
+                        else:
+                            status_dialog.set_status(i, 'Success')
+                    else:
+                        i = future_coalign.pop(future)
+                        try:
+                            future.result()
+                        except Exception as e:
+                            self.logger.exception("An exception occurred")
+                            coalign_errors.setdefault(i, str(e))
+                        if i not in future_coalign.values():
+                            if i in coalign_errors:
+                                status_dialog.set_status(i, 'Failed', coalign_errors[i])
+                            else:
+                                status_dialog.set_status(i, 'Success')
                 QApplication.processEvents()
                 time.sleep(0.01)
         # Restore cursor
@@ -349,9 +423,11 @@ class Align(QWidget):
 
         self.image_matrix_table = gf.ImageMatrixTableWidget2(filetypes=gf.imagetypes, filenames_filter='', filenames_exclude_filter=self.output_suffix)
 
-        self.output_settings = gf.OutputSettings(extensions=['.ome.tif'], output_suffix=self.output_suffix, pipeline_layout=self.pipeline_layout)
+        self.output_settings = gf.OutputSettings(extensions=['.ome.tif'], output_suffix=self.output_suffix, pipeline_layout=self.pipeline_layout, allow_zarr=True)
 
         self.skip_cropping_yn = QCheckBox("Do NOT crop aligned image")
+        self.virtual_output_yn = QCheckBox("Save virtual registered image")
+        self.virtual_output_yn.setToolTip('Instead of a registered copy of the image, save a small file (.vreg) referencing the input image and the transformation matrix.\nShifts and cropping are applied when the virtual registered image is read by other modules.\nThe input image must not be moved or deleted.')
         self.submit_button = QPushButton("Submit")
         self.submit_button.clicked.connect(self.submit)
 
@@ -382,6 +458,7 @@ class Align(QWidget):
         groupbox = QGroupBox("Options")
         layout2 = QVBoxLayout()
         layout2.addWidget(self.skip_cropping_yn)
+        layout2.addWidget(self.virtual_output_yn)
         groupbox.setLayout(layout2)
         layout.addWidget(groupbox)
         if not self.pipeline_layout:
@@ -404,6 +481,7 @@ class Align(QWidget):
             'output_folder': self.output_settings.output_folder.text(),
             'output_user_suffix': self.output_settings.output_user_suffix.text(),
             'skip_cropping_yn': self.skip_cropping_yn.isChecked(),
+            'virtual_output_yn': self.virtual_output_yn.isChecked(),
             'nprocesses': self.nprocesses.value()}
         return widgets_state
 
@@ -414,6 +492,7 @@ class Align(QWidget):
         self.output_settings.output_folder.setText(widgets_state['output_folder'])
         self.output_settings.output_user_suffix.setText(widgets_state['output_user_suffix'])
         self.skip_cropping_yn.setChecked(widgets_state['skip_cropping_yn'])
+        self.virtual_output_yn.setChecked(widgets_state.get('virtual_output_yn', False))
         self.nprocesses.setValue(widgets_state['nprocesses'])
 
     def submit(self):
@@ -421,13 +500,14 @@ class Align(QWidget):
         image_paths = [image_path for image_path, matrix_path in image_matrix_paths]
         matrix_paths = [matrix_path for image_path, matrix_path in image_matrix_paths]
         skip_crop_decision = self.skip_cropping_yn.isChecked()
+        output_compression = self.output_settings.get_output_compression()
 
         # check inputs
         if len(image_paths) == 0:
             self.logger.error('Image missing')
             return
         for path in image_paths:
-            if not os.path.isfile(path):
+            if not gf.isfile(path):
                 self.logger.error('Image not found\n%s', path)
                 return
         if len(matrix_paths) == 0:
@@ -466,7 +546,7 @@ class Align(QWidget):
 
         arguments = []
         for image_path, matrix_path, output_path, output_basename in zip(image_paths, matrix_paths, output_paths, output_basenames):
-            arguments.append((image_path, matrix_path, output_path, output_basename, skip_crop_decision))
+            arguments.append((image_path, matrix_path, output_path, output_basename, skip_crop_decision, output_compression, self.virtual_output_yn.isChecked()))
         if not arguments:
             return
         nprocesses = min(len(arguments), self.nprocesses.value())
@@ -550,7 +630,7 @@ class ManualEdit(QWidget):
         self.input_image.setToolTip('')
         self.input_matrix.setPlaceholderText('')
         self.input_matrix.setToolTip('')
-        if os.path.isfile(image_path):
+        if gf.isfile(image_path):
             # get path with matrix filetype (self.matricestype), containing gf.output_suffixes['registration'] and with same unique identifier
             matrix_paths = [path for path in os.listdir(os.path.dirname(image_path)) if any(path.endswith(matricestype) for matricestype in gf.matrixtypes) and gf.output_suffixes['registration'] in path and os.path.basename(path).split('_')[0] == gf.splitext(os.path.basename(image_path))[0].split('_')[0]]
             if len(matrix_paths) > 0:
@@ -570,7 +650,7 @@ class ManualEdit(QWidget):
             if res:
                 for ext in gf.imagetypes:
                     image_path = os.path.join(os.path.dirname(matrix_path), res.group(1)) + ext
-                    if os.path.isfile(image_path):
+                    if gf.isfile(image_path):
                         self.input_image.setPlaceholderText(image_path)
                         self.input_image.setToolTip(image_path)
                         break
@@ -587,7 +667,7 @@ class ManualEdit(QWidget):
             self.logger.error('Image missing')
             self.input_image.setFocus()
             return
-        if not os.path.isfile(image_path):
+        if not gf.isfile(image_path):
             self.logger.error('Image not found %s', image_path)
             self.input_image.setFocus()
             return
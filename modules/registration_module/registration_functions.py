@@ -1,4 +1,6 @@
 import logging
+import threading
+import concurrent.futures
 from platform import python_version, platform
 from general import general_functions as gf
 import numpy as np
@@ -6,7 +8,6 @@ import os
 from pystackreg import StackReg
 from pystackreg import __version__ as StackReg_version
 import cv2 as cv
-from bioio.writers import OmeTiffWriter
 from bioio import PhysicalPixelSizes
 from ome_types.model import CommentAnnotation
 from skimage.measure import ransac
@@ -481,6 +482,23 @@ def read_transformation_matrix(tmat_path):
     return tmat, tmat_metadata
 
 
+# Hanning windows used by phase correlation, per window size (width, height)
+_hanning_windows = {}
+
+
+def _hanning_window(width, height):
+    """
+    Return the Hanning window with size (`width`, `height`) used for phase correlation (cached, must not be modified).
+    """
+    window = _hanning_windows.get((width, height))
+    if window is None:
+        if len(_hanning_windows) >= 64:
+            _hanning_windows.clear()
+        window = cv.createHanningWindow((width, height), cv.CV_32F)
+        _hanning_windows[(width, height)] = window
+    return window
+
+
 def register_stack_phase_correlation(image, blur=5):
     """
     Register an image using phase correlation algorithm implemented in opencv
@@ -532,7 +550,7 @@ def register_stack_phase_correlation(image, blur=5):
         # register to previous image (shifted and cropped)
         shift, response = cv.phaseCorrelate(curr[ymin2:ymax2, xmin2:xmax2],
                                             prev[ymin1:ymax1, xmin1:xmax1],
-                                            cv.createHanningWindow((xmax1-xmin1, ymax1-ymin1), cv.CV_32F))
+                                            _hanning_window(xmax1-xmin1, ymax1-ymin1))
 
         shifts.append((lastshift[0]+shift[0], lastshift[1]+shift[1]))
 
@@ -542,7 +560,365 @@ def register_stack_phase_correlation(image, blur=5):
     return [(-x, -y) for x, y in shifts]
 
 
-def register_stack_feature_matching(image, feature_type="ORB", blur=0, seed=76249):
+def register_stack_phase_correlation_pairwise(image, blur=5, nthreads=1, refine=True):
+    """
+    Register an image using phase correlation algorithm implemented in opencv,
+    estimating the shift between each pair of consecutive time frames independently (in parallel).
+
+    Contrary to register_stack_phase_correlation(), each time frame is registered to the previous (raw) time frame
+    instead of the previous registered time frame, and shifts are cumulated afterwards.
+
+    Parameters
+    ----------
+    image: ndarray
+        a 3D (TYX) 16bit unsigned integer (uint16) numpy array.
+    blur: int
+        kernel size for gaussian blue
+    nthreads: int
+        number of threads used to register pairs of time frames concurrently.
+    refine: bool
+        refine the shift of each pair of time frames by registering the overlapping parts of the two time frames
+        (time frames cropped according to the estimated shift).
+
+    Returns
+    -------
+    list of tuples
+        list with one (x,y) tuple per time frame.
+        Each (x,y) tuple corresponds to the shift between images at the corresponding time frame and previous time frame.
+    """
+    # make sure blur is odd
+    if blur != 0:
+        blur = blur // 2 * 2 + 1
+
+    h = image.shape[1]
+    w = image.shape[2]
+
+    window = _hanning_window(w, h)
+
+    def preprocess(i):
+        # normalized, blurred and windowed time frame
+        if blur > 1:
+            frame = cv.GaussianBlur(cv.normalize(image[i], None, 0, 1, cv.NORM_MINMAX, dtype=cv.CV_32F), (blur, blur), 0)
+        else:
+            frame = cv.normalize(image[i], None, 0, 1, cv.NORM_MINMAX, dtype=cv.CV_32F)
+        return frame, cv.multiply(frame, window)
+
+    def register_pairs(start, end):
+        # shifts between time frames i-1 and i for start <= i < end (each time frame is preprocessed once)
+        pair_shifts = []
+        prev, prev_windowed = preprocess(start - 1)
+        for i in range(start, end):
+            logging.getLogger(__name__).debug("Evaluating transformation matrix (%s/%s)", i, image.shape[0]-1)
+            curr, curr_windowed = preprocess(i)
+            # time frames are already windowed (same result as passing the window to cv.phaseCorrelate(), which can modify its inputs in-place)
+            shift, response = cv.phaseCorrelate(curr_windowed, prev_windowed)
+            # no refinement needed if the overlap is the whole time frame (same result)
+            if refine and (round(shift[0]), round(shift[1])) != (0, 0):
+                pairshift = (round(shift[0]), round(shift[1]))
+                # crop window prev
+                xmin1 = max(pairshift[0], 0)
+                xmax1 = min(w+pairshift[0], w)
+                ymin1 = max(pairshift[1], 0)
+                ymax1 = min(h+pairshift[1], h)
+                # crop window curr
+                xmin2 = max(-pairshift[0], 0)
+                xmax2 = min(w-pairshift[0], w)
+                ymin2 = max(-pairshift[1], 0)
+                ymax2 = min(h-pairshift[1], h)
+                if xmax1 - xmin1 > 1 and ymax1 - ymin1 > 1:
+                    crop_window = _hanning_window(xmax1-xmin1, ymax1-ymin1)
+                    shift, response = cv.phaseCorrelate(cv.multiply(curr[ymin2:ymax2, xmin2:xmax2], crop_window),
+                                                        cv.multiply(prev[ymin1:ymax1, xmin1:xmax1], crop_window))
+                    shift = (pairshift[0]+shift[0], pairshift[1]+shift[1])
+            pair_shifts.append(shift)
+            prev, prev_windowed = curr, curr_windowed
+        return pair_shifts
+
+    # one chunk of consecutive time frames per thread
+    bounds = np.linspace(1, image.shape[0], min(nthreads, image.shape[0]-1)+1).round().astype(int) if image.shape[0] > 1 else []
+    chunks = [(start, end) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+    if nthreads > 1 and len(chunks) > 1:
+        # opencv functions release the GIL
+        with concurrent.futures.ThreadPoolExecutor(max_workers=nthreads) as executor:
+            pair_shifts = [shift for chunk_shifts in executor.map(lambda chunk: register_pairs(*chunk), chunks) for shift in chunk_shifts]
+    else:
+        pair_shifts = [shift for chunk in chunks for shift in register_pairs(*chunk)]
+
+    # cumulate shifts
+    shifts = np.zeros((image.shape[0], 2))
+    if len(pair_shifts) > 0:
+        shifts[1:] = np.cumsum(pair_shifts, axis=0)
+    return [(-x, -y) for x, y in shifts]
+
+
+def _profile_pair_shifts(profiles, blur=5, max_shift=None):
+    """
+    Estimate the shift between consecutive 1D projection profiles using cross-correlation (vectorized over time frames).
+
+    Parameters
+    ----------
+    profiles: ndarray
+        2D (T, N) array with one projection profile per time frame.
+    blur: int
+        kernel size for gaussian blur of the profiles.
+    max_shift: int or None
+        maximum absolute shift between consecutive profiles (default: N//2).
+
+    Returns
+    -------
+    shifts: ndarray
+        1D array with T-1 elements, shift of profile t relative to profile t-1 (profile t-1 shifted by `shifts[t-1]` matches profile t).
+    peaks: ndarray
+        1D array with T-1 elements, normalized cross-correlation at the peak.
+    peak_ratios: ndarray
+        1D array with T-1 elements, ratio between the second highest local maximum and the peak of the cross-correlation.
+    """
+    n = profiles.shape[1]
+    if max_shift is None:
+        max_shift = n // 2
+    max_shift = max(1, min(max_shift, n - 2))
+    profiles = profiles.astype(np.float32)
+    if blur > 1:
+        # blur along profiles only
+        profiles = cv.GaussianBlur(profiles, (blur // 2 * 2 + 1, 1), 0, borderType=cv.BORDER_REPLICATE)
+    # gradient, to remove offsets and slow intensity variations (e.g. uneven illumination)
+    profiles = np.diff(profiles, axis=1)
+    profiles -= profiles.mean(axis=1, keepdims=True)
+    profiles *= np.hanning(profiles.shape[1]).astype(np.float32)
+    norm = np.linalg.norm(profiles, axis=1, keepdims=True)
+    norm[norm == 0] = 1
+    profiles /= norm
+
+    # cross-correlation of consecutive profiles (zero-padded to avoid circular wrap around)
+    nfft = cv.getOptimalDFTSize(2 * profiles.shape[1])
+    spectra = np.fft.rfft(profiles, n=nfft, axis=1)
+    corr = np.fft.irfft(spectra[1:] * np.conj(spectra[:-1]), n=nfft, axis=1)
+    # lags -max_shift,...,max_shift
+    corr = np.concatenate((corr[:, nfft-max_shift:], corr[:, :max_shift+1]), axis=1)
+
+    idx = np.argmax(corr, axis=1)
+    rows = np.arange(corr.shape[0])
+    peaks = corr[rows, idx]
+    # sub-pixel peak position (parabola through the peak and its neighbours)
+    inner = (idx > 0) & (idx < corr.shape[1] - 1)
+    left = corr[rows, np.clip(idx - 1, 0, None)]
+    right = corr[rows, np.clip(idx + 1, None, corr.shape[1] - 1)]
+    denom = left - 2 * peaks + right
+    offset = np.zeros(corr.shape[0])
+    valid = inner & (denom < 0)
+    offset[valid] = 0.5 * (left[valid] - right[valid]) / denom[valid]
+    shifts = idx - max_shift + offset
+
+    # second highest local maximum (excluding the peak and its neighbours)
+    local_max = np.full(corr.shape, False)
+    local_max[:, 1:-1] = (corr[:, 1:-1] > corr[:, :-2]) & (corr[:, 1:-1] >= corr[:, 2:])
+    for d in (-1, 0, 1):
+        local_max[rows, np.clip(idx + d, 0, corr.shape[1] - 1)] = False
+    second = np.where(local_max, corr, -np.inf).max(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        peak_ratios = np.where(peaks > 0, np.clip(second, 0, None) / peaks, np.inf)
+    return shifts, peaks, peak_ratios
+
+
+def register_stack_projection_profiles(image, blur=5, fallback=True, min_peak=0.3, max_peak_ratio=0.8, nthreads=1):
+    """
+    Register an image using 1D cross-correlation of projection profiles (sum over rows and sum over columns),
+    estimating the shift between each pair of consecutive time frames (vectorized over time frames).
+
+    Only suited to translations (e.g. stage drift). It is much faster than registration methods using the whole 2D time frames,
+    but less robust. When the cross-correlation peak is ambiguous (low peak or second local maximum close to the peak),
+    the pair of time frames can be registered using phase correlation instead (see register_stack_phase_correlation_pairwise()).
+
+    Parameters
+    ----------
+    image: ndarray
+        a 3D (TYX) 16bit unsigned integer (uint16) numpy array.
+    blur: int
+        kernel size for gaussian blur (of the profiles, and of the time frames when using phase correlation).
+    fallback: bool
+        register pairs of time frames with an ambiguous cross-correlation peak using phase correlation.
+    min_peak: float
+        cross-correlation peak (normalized, between -1 and 1) below which the peak is considered as ambiguous.
+    max_peak_ratio: float
+        ratio between the second highest local maximum and the cross-correlation peak above which the peak is considered as ambiguous.
+    nthreads: int
+        number of threads used to register ambiguous pairs of time frames with phase correlation concurrently.
+
+    Returns
+    -------
+    list of tuples
+        list with one (x,y) tuple per time frame.
+        Each (x,y) tuple corresponds to the shift between images at the corresponding time frame and previous time frame.
+    """
+    if image.shape[0] < 2:
+        return [(0, 0)] * image.shape[0]
+
+    # x profile: sum over rows (axis Y), y profile: sum over columns (axis X)
+    pair_shifts = np.zeros((image.shape[0]-1, 2))
+    ambiguous = np.full(image.shape[0]-1, False)
+    for axis, profiles in enumerate((image.sum(axis=1, dtype=np.float64), image.sum(axis=2, dtype=np.float64))):
+        shifts, peaks, peak_ratios = _profile_pair_shifts(profiles, blur=blur)
+        pair_shifts[:, axis] = shifts
+        ambiguous |= (peaks < min_peak) | (peak_ratios > max_peak_ratio)
+
+    ambiguous_pairs = np.flatnonzero(ambiguous)
+    if len(ambiguous_pairs) > 0:
+        logging.getLogger(__name__).info("Ambiguous projection profiles cross-correlation for %s/%s pairs of time frames%s", len(ambiguous_pairs), image.shape[0]-1, ", using phase correlation" if fallback else "")
+    if fallback and len(ambiguous_pairs) > 0:
+        def register_pair(i):
+            logging.getLogger(__name__).debug("Evaluating transformation matrix with phase correlation (%s/%s)", i+1, image.shape[0]-1)
+            return register_stack_phase_correlation_pairwise(image[i:i+2], blur=blur)[1]
+        if nthreads > 1 and len(ambiguous_pairs) > 1:
+            # opencv functions release the GIL
+            with concurrent.futures.ThreadPoolExecutor(max_workers=nthreads) as executor:
+                pair_shifts[ambiguous_pairs] = list(executor.map(register_pair, ambiguous_pairs))
+        else:
+            pair_shifts[ambiguous_pairs] = [register_pair(i) for i in ambiguous_pairs]
+
+    # cumulate shifts
+    shifts = np.zeros((image.shape[0], 2))
+    shifts[1:] = np.cumsum(pair_shifts, axis=0)
+    return [(x, y) for x, y in shifts]
+
+
+def downsample_stack(image, levels):
+    """
+    Downsample each time frame of an image by a factor 2**`levels` (pyramid level `levels`).
+
+    Parameters
+    ----------
+    image: ndarray
+        a 3D (TYX) numpy array.
+    levels: int
+        pyramid level (0: no downsampling).
+
+    Returns
+    -------
+    ndarray
+        3D (TYX) array with same dtype as `image`.
+    """
+    factor = 2**levels
+    if factor == 1:
+        return image
+    h = max(1, image.shape[1] // factor)
+    w = max(1, image.shape[2] // factor)
+    downsampled = np.empty((image.shape[0], h, w), dtype=image.dtype)
+    for i in range(image.shape[0]):
+        # area interpolation: average of factor x factor pixels
+        downsampled[i] = cv.resize(image[i], (w, h), interpolation=cv.INTER_AREA)
+    return downsampled
+
+
+def refine_shifts_phase_correlation(image, shifts, search_range, window_size=512, blur=5, nthreads=1):
+    """
+    Refine shifts estimated at low resolution (see downsample_stack()) using phase correlation at full resolution,
+    on a small window (centered on the overlapping part of each pair of consecutive time frames).
+
+    Parameters
+    ----------
+    image: ndarray
+        a 3D (TYX) 16bit unsigned integer (uint16) numpy array (full resolution).
+    shifts: list of tuples or ndarray
+        estimated shifts (in full resolution pixels) as returned by register_stack_phase_correlation().
+    search_range: float
+        maximum correction of the shift between two consecutive time frames (larger corrections are ignored).
+    window_size: int
+        size of the window used for phase correlation.
+    blur: int
+        kernel size for gaussian blue
+    nthreads: int
+        number of threads used to refine pairs of time frames concurrently.
+
+    Returns
+    -------
+    list of tuples
+        list with one (x,y) tuple per time frame.
+        Each (x,y) tuple corresponds to the shift between images at the corresponding time frame and previous time frame.
+    """
+    # make sure blur is odd
+    if blur != 0:
+        blur = blur // 2 * 2 + 1
+
+    h = image.shape[1]
+    w = image.shape[2]
+    shifts = np.asarray(shifts, dtype=float)
+    # estimated shift between time frames i-1 and i, same convention as cv.phaseCorrelate()
+    pair_shifts = -np.diff(shifts, axis=0)
+
+    def preprocess(frame):
+        if blur > 1:
+            return cv.GaussianBlur(cv.normalize(frame, None, 0, 1, cv.NORM_MINMAX, dtype=cv.CV_32F), (blur, blur), 0)
+        return cv.normalize(frame, None, 0, 1, cv.NORM_MINMAX, dtype=cv.CV_32F)
+
+    def refine_pair(i):
+        logging.getLogger(__name__).debug("Refining transformation matrix (%s/%s)", i, image.shape[0]-1)
+        pairshift = (round(pair_shifts[i-1][0]), round(pair_shifts[i-1][1]))
+        # overlapping parts of prev and curr
+        xmin1 = max(pairshift[0], 0)
+        xmax1 = min(w+pairshift[0], w)
+        ymin1 = max(pairshift[1], 0)
+        ymax1 = min(h+pairshift[1], h)
+        xmin2 = max(-pairshift[0], 0)
+        ymin2 = max(-pairshift[1], 0)
+        # central window within the overlapping parts
+        ww = min(window_size, xmax1 - xmin1)
+        wh = min(window_size, ymax1 - ymin1)
+        if ww < 2 or wh < 2:
+            return tuple(pair_shifts[i-1])
+        x0 = (xmax1 - xmin1 - ww) // 2
+        y0 = (ymax1 - ymin1 - wh) // 2
+        window = _hanning_window(ww, wh)
+        curr = cv.multiply(preprocess(image[i, ymin2+y0:ymin2+y0+wh, xmin2+x0:xmin2+x0+ww]), window)
+        prev = cv.multiply(preprocess(image[i-1, ymin1+y0:ymin1+y0+wh, xmin1+x0:xmin1+x0+ww]), window)
+        shift, response = cv.phaseCorrelate(curr, prev)
+        if abs(shift[0]) > search_range or abs(shift[1]) > search_range:
+            # correction too large (e.g. featureless window): keep estimated shift
+            return tuple(pair_shifts[i-1])
+        return (pairshift[0]+shift[0], pairshift[1]+shift[1])
+
+    if nthreads > 1:
+        # opencv functions release the GIL
+        with concurrent.futures.ThreadPoolExecutor(max_workers=nthreads) as executor:
+            refined_pair_shifts = list(executor.map(refine_pair, range(1, image.shape[0])))
+    else:
+        refined_pair_shifts = [refine_pair(i) for i in range(1, image.shape[0])]
+
+    # cumulate shifts
+    refined_shifts = np.zeros((image.shape[0], 2))
+    if len(refined_pair_shifts) > 0:
+        refined_shifts[1:] = np.cumsum(refined_pair_shifts, axis=0)
+    return [(-x, -y) for x, y in refined_shifts]
+
+
+def _feature_detector(feature_type):
+    """
+    Create an opencv keypoints detector and descriptor extractor.
+
+    Parameters
+    ----------
+    feature_type: str
+        the algorithm use for feature detection.
+        Possible feature types: AKAZE, BRISK, KAZE, ORB and SIFT.
+
+    Returns
+    -------
+    cv.Feature2D
+    """
+    if feature_type == "SIFT":
+        return cv.SIFT_create()
+    elif feature_type == "ORB":
+        return cv.ORB_create()
+    elif feature_type == "AKAZE":
+        return cv.AKAZE_create()
+    elif feature_type == "KAZE":
+        return cv.KAZE_create()
+    elif feature_type == "BRISK":
+        return cv.BRISK_create()
+    logging.getLogger(__name__).error('Error unknown feature type %s', feature_type)
+    raise ValueError(f"Error unknown feature type {feature_type}")
+
+
+def register_stack_feature_matching(image, feature_type="ORB", blur=0, seed=76249, reuse_features=False, nthreads=1):
     """
     Register an image using feature matching implemented in opencv followed by parameter estimatimtion with RANSAC.
 
@@ -557,6 +933,12 @@ def register_stack_feature_matching(image, feature_type="ORB", blur=0, seed=7624
         kernel size for gaussian blue
     seed: int
         seed for the random number generator
+    reuse_features: bool
+        If True, detect keypoints and evaluate descriptors once per time frame (on the whole time frame)
+        and match keypoints of consecutive time frames within the overlapping region, instead of detecting
+        keypoints again on the previous time frame shifted (faster).
+    nthreads: int
+        number of threads used to detect keypoints in time frames concurrently (only with `reuse_features`).
 
     Returns
     -------
@@ -572,19 +954,7 @@ def register_stack_feature_matching(image, feature_type="ORB", blur=0, seed=7624
     h = image.shape[1]
     w = image.shape[2]
 
-    if feature_type == "SIFT":
-        feature = cv.SIFT_create()
-    elif feature_type == "ORB":
-        feature = cv.ORB_create()
-    elif feature_type == "AKAZE":
-        feature = cv.AKAZE_create()
-    elif feature_type == "KAZE":
-        feature = cv.KAZE_create()
-    elif feature_type == "BRISK":
-        feature = cv.BRISK_create()
-    else:
-        logging.getLogger(__name__).error('Error unknown feature type %s', feature_type)
-        raise ValueError(f"Error unknown feature type {feature_type}")
+    feature = _feature_detector(feature_type)
 
     cv.setRNGSeed(seed)
     # taken from https://docs.opencv.org/4.x/dc/dc3/tutorial_py_matcher.html
@@ -602,6 +972,9 @@ def register_stack_feature_matching(image, feature_type="ORB", blur=0, seed=7624
     search_params = dict(checks=50)
     flann = cv.FlannBasedMatcher(index_params, search_params)
 
+    if reuse_features:
+        return _register_stack_feature_matching_reuse(image, feature_type, flann, blur, seed, nthreads)
+
     shifts = [(0, 0)]
     if blur > 1:
         prev = cv.GaussianBlur(cv.normalize(image[0], None, 0, np.iinfo('uint8').max, cv.NORM_MINMAX, dtype=cv.CV_8U), (blur, blur), 0)
@@ -662,7 +1035,99 @@ def register_stack_feature_matching(image, feature_type="ORB", blur=0, seed=7624
     return [(-x, -y) for x, y in shifts]
 
 
-def registration_with_tmat(tmat, image, skip_crop, output_path, output_basename, metadata):
+def _register_stack_feature_matching_reuse(image, feature_type, flann, blur, seed, nthreads):
+    """
+    Feature matching registration with keypoints and descriptors evaluated once per time frame
+    (see register_stack_feature_matching() with `reuse_features` = True).
+    """
+    h = image.shape[1]
+    w = image.shape[2]
+
+    def detect(start, end):
+        # keypoints coordinates and descriptors of time frames start <= i < end
+        # (one detector per thread, opencv functions release the GIL)
+        feature = _feature_detector(feature_type)
+        features = []
+        for i in range(start, end):
+            logging.getLogger(__name__).debug("Detecting features (%s/%s)", i, image.shape[0]-1)
+            if blur > 1:
+                frame = cv.GaussianBlur(cv.normalize(image[i], None, 0, np.iinfo('uint8').max, cv.NORM_MINMAX, dtype=cv.CV_8U), (blur, blur), 0)
+            else:
+                frame = cv.normalize(image[i], None, 0, np.iinfo('uint8').max, cv.NORM_MINMAX, dtype=cv.CV_8U)
+            kp, des = feature.detectAndCompute(frame, None)
+            points = np.float32([k.pt for k in kp]).reshape(-1, 2)
+            features.append((points, des))
+        return features
+
+    def overlap(points, des, lastshift):
+        # keep keypoints in the region overlapping the first time frame (same region as cropping in
+        # register_stack_feature_matching() without `reuse_features`), coordinates relative to this region
+        xmin = max(-lastshift[0], 0)
+        xmax = min(w-lastshift[0], w)
+        ymin = max(-lastshift[1], 0)
+        ymax = min(h-lastshift[1], h)
+        mask = (points[:, 0] >= xmin) & (points[:, 0] < xmax) & (points[:, 1] >= ymin) & (points[:, 1] < ymax)
+        if des is None:
+            return points[mask] - (xmin, ymin), None
+        return points[mask] - (xmin, ymin), des[mask]
+
+    cv.setRNGSeed(seed)
+    shifts = [(0, 0)]
+    prev = None
+    # detect features in batches of time frames (memory usage independent of the number of time frames)
+    batch_size = 4*max(1, nthreads)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, nthreads)) as executor:
+        for batch_start in range(0, image.shape[0], batch_size):
+            batch_end = min(batch_start+batch_size, image.shape[0])
+            bounds = np.linspace(batch_start, batch_end, min(nthreads, batch_end-batch_start)+1).round().astype(int)
+            if nthreads > 1:
+                batch = [f for chunk_features in executor.map(lambda chunk: detect(*chunk), zip(bounds[:-1], bounds[1:])) for f in chunk_features]
+            else:
+                batch = detect(batch_start, batch_end)
+
+            for curr in batch:
+                if prev is None:
+                    prev = curr
+                    continue
+                logging.getLogger(__name__).debug("Evaluating transformation matrix (%s/%s)", len(shifts), image.shape[0]-1)
+                lastshift = (round(shifts[-1][0]), round(shifts[-1][1]))
+                points1, des1 = overlap(*prev, lastshift)
+                points2, des2 = overlap(*curr, lastshift)
+
+                matches = []
+                if des1 is not None and des2 is not None and len(des1) >= 2 and len(des2) >= 2:
+                    matches = flann.knnMatch(des1, des2, k=2)
+
+                # Filter out poor matches (ratio test as per Lowe's paper)
+                good_matches = []
+                for m in matches:
+                    if len(m) >= 2 and m[0].distance < 0.75*m[1].distance:
+                        good_matches.append(m[0])
+
+                matches = good_matches
+
+                points1 = np.float32([points1[m.queryIdx] for m in matches])
+                points2 = np.float32([points2[m.trainIdx] for m in matches])
+
+                # ransac
+                shift = (0, 0)
+                if len(matches) > 3:
+                    if Version(skimage_version) >= Version('0.21.0'):
+                        model_robust, inliers = ransac((points1, points2), MoveTransform, min_samples=3,
+                                                       residual_threshold=2, max_trials=100, rng=seed)
+                    else:
+                        model_robust, inliers = ransac((points1, points2), MoveTransform, min_samples=3,
+                                                       residual_threshold=2, max_trials=100, random_state=seed)
+                    if model_robust is not None:
+                        shift = -model_robust.translation
+
+                shifts.append((lastshift[0]+shift[0], lastshift[1]+shift[1]))
+                prev = curr
+
+    return [(-x, -y) for x, y in shifts]
+
+
+def registration_with_tmat(tmat, image, skip_crop, output_path, output_basename, metadata, output_compression=None, virtual_output=False, log_handler=None):
     """
     This function uses a transformation matrix to performs registration and eventually cropping of an image
     Note - always assuming FoV dimension of the image as empty
@@ -672,83 +1137,89 @@ def registration_with_tmat(tmat, image, skip_crop, output_path, output_basename,
     tmat:
         transformation matrix
     image: Image object
+        image.image can be a memory-mapped or chunk-backed array (see gf.Image.imread(lazy=True)),
+        only the part of each time frame within the crop window is read.
     skip_crop: boolean
         indicates whether to crop or not the registered image
     output_path: str
         output directory
     output_basename: str
-        output basename. Output file will be saved as `output_path`/`output_basename`.ome.tif
+        output basename. Output file will be saved as `output_path`/`output_basename`.ome.tif (or .ome.zarr, see `output_compression`)
     metadata: list of str
         metadata from input file(s).
+    output_compression: dict or None
+        output compression settings (see gf.get_tifffile_kwargs()).
+    virtual_output: bool
+        save a virtual registered image `output_path`/`output_basename`.vreg referencing the image and
+        the transformation matrix, with shifts and cropping applied when reading (see gf.write_virtual_registered_image()),
+        instead of the registered image.
+    log_handler: gf.BufferedHandler or None
+        handler with the log messages saved in the output metadata and log file (None: module `buffered_handler`).
 
     Saves
     ---------------------
     image : ndarray
         registered and eventually cropped image (optional: also save co-aligned images)
     """
+    if log_handler is None:
+        log_handler = buffered_handler
     logging.getLogger(__name__).info('Transforming image')
-    registeredFilepath = os.path.join(output_path, output_basename+'.ome.tif')
+    if virtual_output:
+        registeredFilepath = os.path.join(output_path, output_basename+gf.virtualtypes[0])
+    else:
+        registeredFilepath = os.path.join(output_path, output_basename+gf.get_output_extension(output_compression))
 
     # Assuming empty dimension F
-    image6D = image.image
-    registered_image = image6D.copy()
-    for z in range(0, image.sizes['Z']):
-        for c in range(0, image.sizes['C']):
-            for timepoint in range(0, image.sizes['T']):
-                if tmat[timepoint, 2] == 1:
-                    xyShift = (-tmat[timepoint, 0], -tmat[timepoint, 1])
-                    registered_image[0, timepoint, c, z, :, :] = np.roll(image6D[0, timepoint, c, z, :, :], xyShift, axis=(1, 0))
-
-    if skip_crop:
-        t_start = np.nonzero(tmat[:, 2])[0].min()
-        t_end = np.nonzero(tmat[:, 2])[0].max() + 1
-        registered_image = registered_image[:, t_start:t_end, :, :, :, :]
-        # Save the registered and un-cropped image
-        logging.getLogger(__name__).info('Saving transformed image to %s', registeredFilepath)
-        ome_metadata = OmeTiffWriter.build_ome(data_shapes=[registered_image[0, :, :, :, :, :].shape],
-                                               data_types=[registered_image[0, :, :, :, :, :].dtype],
-                                               dimension_order=["TCZYX"],
-                                               channel_names=[image.channel_names],
-                                               physical_pixel_sizes=[PhysicalPixelSizes(X=image.physical_pixel_sizes[0], Y=image.physical_pixel_sizes[1], Z=image.physical_pixel_sizes[2])])
-        ome_metadata.structured_annotations.append(CommentAnnotation(value=buffered_handler.get_messages(), namespace="VLabApp"))
-        for x in metadata:
-            ome_metadata.structured_annotations.append(CommentAnnotation(value=x, namespace="VLabApp"))
-        OmeTiffWriter.save(registered_image[0, :, :, :, :, :], registeredFilepath, ome_xml=ome_metadata)
-    else:
+    if not skip_crop:
         logging.getLogger(__name__).info('Cropping image')
-        # Crop to desired area
-        y_start = 0 - min(d[1] for d in tmat if d[2] == 1)
-        y_end = image.sizes['Y'] - max(d[1] for d in tmat if d[2] == 1)
-        x_start = 0 - min([d[0] for d in tmat if d[2] == 1])
-        x_end = image.sizes['X'] - max(d[0] for d in tmat if d[2] == 1)
-        t_start = np.nonzero(tmat[:, 2])[0].min()
-        t_end = np.nonzero(tmat[:, 2])[0].max() + 1
-
-        # Crop along the y-axis
-        image_cropped = registered_image[:, t_start:t_end, :, :, y_start:y_end, x_start:x_end]
-
-        if image_cropped.shape[4] == 0 or image_cropped.shape[5] == 0:
-            raise ValueError('Empty image after cropping (due to registration shift too large). To avoid this error: do not crop or limit the range of time frames.')
-
-        # Save the registered and cropped image
-        logging.getLogger(__name__).info('Saving transformed image to %s', registeredFilepath)
-        ome_metadata = OmeTiffWriter.build_ome(data_shapes=[image_cropped[0, :, :, :, :, :].shape],
-                                               data_types=[image_cropped[0, :, :, :, :, :].dtype],
-                                               dimension_order=["TCZYX"],
-                                               channel_names=[image.channel_names],
-                                               physical_pixel_sizes=[PhysicalPixelSizes(X=image.physical_pixel_sizes[0], Y=image.physical_pixel_sizes[1], Z=image.physical_pixel_sizes[2])])
-        ome_metadata.structured_annotations.append(CommentAnnotation(value=buffered_handler.get_messages(), namespace="VLabApp"))
+    t_start, t_end, y_range, x_range = gf.registration_crop_window(tmat, image.sizes['Y'], image.sizes['X'], skip_crop)
+    output_shape = (t_end - t_start,
+                    image.sizes['C'],
+                    image.sizes['Z'],
+                    len(y_range),
+                    len(x_range))
+    if output_shape[3] == 0 or output_shape[4] == 0:
+        raise ValueError('Empty image after cropping (due to registration shift too large). To avoid this error: do not crop or limit the range of time frames.')
+
+    if virtual_output:
+        logging.getLogger(__name__).info('Saving virtual registered image to %s', registeredFilepath)
+        gf.write_virtual_registered_image(registeredFilepath, image.path if image.field_of_view is None else gf.field_of_view_path(image.path, image.field_of_view),
+                                          tmat, skip_crop, [log_handler.get_messages()] + list(metadata))
+        # create logfile
+        logfile = os.path.join(output_path, output_basename+".log")
+        with open(logfile, 'w') as f:
+            f.write(log_handler.get_messages())
+        return
+
+    # Save the registered (and cropped) image, one time frame at a time.
+    # Shifted time frames are copied directly into a preallocated cropped time frame.
+    logging.getLogger(__name__).info('Saving transformed image to %s', registeredFilepath)
+    frame = np.empty(output_shape[1:], dtype=image.dtype)
+    with gf.open_image_writer(registeredFilepath, output_shape, image.dtype,
+                                dimension_order="TCZYX",
+                                channel_names=image.channel_names,
+                                physical_pixel_sizes=PhysicalPixelSizes(X=image.physical_pixel_sizes[0], Y=image.physical_pixel_sizes[1], Z=image.physical_pixel_sizes[2]),
+                                output_compression=output_compression) as writer:
+        for timepoint in range(t_start, t_end):
+            if tmat[timepoint, 2] == 1:
+                x_shift, y_shift = tmat[timepoint, 0], tmat[timepoint, 1]
+            else:
+                x_shift, y_shift = 0, 0
+            for y_dst, y_src in gf.shift_segments(y_range.start, y_range.stop, y_shift, image.sizes['Y']):
+                for x_dst, x_src in gf.shift_segments(x_range.start, x_range.stop, x_shift, image.sizes['X']):
+                    frame[:, :, y_dst, x_dst] = image.image[0, timepoint, :, :, y_src, x_src]
+            writer.write(frame)
+        writer.ome_metadata.structured_annotations.append(CommentAnnotation(value=log_handler.get_messages(), namespace="VLabApp"))
         for x in metadata:
-            ome_metadata.structured_annotations.append(CommentAnnotation(value=x, namespace="VLabApp"))
-        OmeTiffWriter.save(image_cropped[0, :, :, :, :, :], registeredFilepath, ome_xml=ome_metadata)
+            writer.ome_metadata.structured_annotations.append(CommentAnnotation(value=x, namespace="VLabApp"))
 
     # create logfile
     logfile = os.path.join(output_path, output_basename+".log")
     with open(logfile, 'w') as f:
-        f.write(buffered_handler.get_messages())
+        f.write(log_handler.get_messages())
 
 
-def registration_values(image, projection_type, projection_zrange, channel_position, output_path, output_basename, registration_method, metadata, timepoint_range=None):
+def registration_values(image, projection_type, projection_zrange, channel_position, output_path, output_basename, registration_method, metadata, timepoint_range=None, projection_nthreads=1, registration_nthreads=1, registration_pyramid_levels=0, registration_reuse_features=False, registration_profile_fallback=True):
     """
     This function calculates the transformation matrices.
     Trnasformation matrices are saved  saved as `output_path`/`output_basename`.csv.
@@ -771,13 +1242,28 @@ def registration_values(image, projection_type, projection_zrange, channel_posit
     output_basename: str
         output basename. Output file will be saved as `output_path`/`output_basename`.csv
     registration_method : str
-        method to use for registration. Can be "stackreg", "phase correlation",
-        "feature matching (ORB)", "feature matching (BRISK)", "feature matching (AKAZE)"
+        method to use for registration. Can be "stackreg", "phase correlation", "phase correlation (pairwise)",
+        "projection profiles", "feature matching (ORB)", "feature matching (BRISK)", "feature matching (AKAZE)"
         or "feature matching (SIFT)".
     metadata: list of str
         metadata from input file(s).
     timepoint_range : tuple (start, end) or None
         If not None, only evaluate the transformation matrix for time frames T such that start <= T <= end.
+    projection_nthreads: int
+        number of threads used for z-projection (see gf.Image.z_projection()).
+    registration_nthreads: int
+        number of threads used to evaluate the transformation matrix (phase correlation (pairwise) method,
+        feature detection with `registration_reuse_features`, phase correlation fallback of projection profiles method
+        and full resolution refinement).
+    registration_pyramid_levels: int
+        If > 0, evaluate the transformation matrix on time frames downsampled by a factor 2**registration_pyramid_levels
+        and refine it at full resolution (phase correlation on a small window, see refine_shifts_phase_correlation()).
+    registration_reuse_features: bool
+        feature matching methods only. If True, detect keypoints once per time frame, in parallel
+        (see register_stack_feature_matching()).
+    registration_profile_fallback: bool
+        projection profiles method only. If True, register pairs of time frames with an ambiguous projection profiles
+        cross-correlation peak using phase correlation (see register_stack_projection_profiles()).
 
     Returns
     ---------------------
@@ -795,7 +1281,8 @@ def registration_values(image, projection_type, projection_zrange, channel_posit
     if image.sizes['Z'] > 1:
         try:
             logging.getLogger(__name__).info('Preparing image to evaluate transformation matrix: performing Z-projection')
-            projection = image.z_projection(projection_type, projection_zrange)
+            # only estimate best focus on the channel to register
+            projection = image.z_projection(projection_type, projection_zrange, nthreads=projection_nthreads, focus_channel=channel_position if channel_position < image.sizes['C'] else None)
         except Exception:
             logging.getLogger(__name__).exception('Z-projection failed for image %s', image.basename)
             remove_all_log_handlers()
@@ -824,6 +1311,11 @@ def registration_values(image, projection_type, projection_zrange, channel_posit
         logging.getLogger(__name__).info('Preparing image to evaluate transformation matrix: selecting time frames %s<=T<=%s', timepoint_range[0], timepoint_range[1])
         image3D = image3D[timepoint_range[0]:(timepoint_range[1]+1), :, :]
 
+    if registration_pyramid_levels > 0:
+        logging.getLogger(__name__).info('Preparing image to evaluate transformation matrix: downsampling by a factor %s', 2**registration_pyramid_levels)
+        image3D_full = image3D
+        image3D = downsample_stack(image3D, registration_pyramid_levels)
+
     if registration_method == "stackreg":
         logging.getLogger(__name__).info('Evaluating transformation matrix with stackreg')
         # Translation = only movements on x and y axis
@@ -835,19 +1327,27 @@ def registration_values(image, projection_type, projection_zrange, channel_posit
         logging.getLogger(__name__).info('Evaluating transformation matrix with phase correlation')
         shifts = register_stack_phase_correlation(image3D, blur=5)
         shifts = np.array(shifts)
+    elif registration_method == "phase correlation (pairwise)":
+        logging.getLogger(__name__).info('Evaluating transformation matrix with phase correlation (pairwise, %s threads)', registration_nthreads)
+        shifts = register_stack_phase_correlation_pairwise(image3D, blur=5, nthreads=registration_nthreads)
+        shifts = np.array(shifts)
+    elif registration_method == "projection profiles":
+        logging.getLogger(__name__).info('Evaluating transformation matrix with projection profiles')
+        shifts = register_stack_projection_profiles(image3D, blur=5, fallback=registration_profile_fallback, nthreads=registration_nthreads)
+        shifts = np.array(shifts)
     elif registration_method.startswith("feature matching"):
         if registration_method == "feature matching (ORB)":
             logging.getLogger(__name__).info('Evaluating transformation matrix with feature matching (ORB)')
-            shifts = register_stack_feature_matching(image3D, feature_type="ORB")
+            shifts = register_stack_feature_matching(image3D, feature_type="ORB", reuse_features=registration_reuse_features, nthreads=registration_nthreads)
         elif registration_method == "feature matching (BRISK)":
             logging.getLogger(__name__).info('Evaluating transformation matrix with feature matching (BRISK)')
-            shifts = register_stack_feature_matching(image3D, feature_type="BRISK")
+            shifts = register_stack_feature_matching(image3D, feature_type="BRISK", reuse_features=registration_reuse_features, nthreads=registration_nthreads)
         elif registration_method == "feature matching (AKAZE)":
             logging.getLogger(__name__).info('Evaluating transformation matrix with feature matching (AKAZE)')
-            shifts = register_stack_feature_matching(image3D, feature_type="AKAZE")
+            shifts = register_stack_feature_matching(image3D, feature_type="AKAZE", reuse_features=registration_reuse_features, nthreads=registration_nthreads)
         elif registration_method == "feature matching (SIFT)":
             logging.getLogger(__name__).info('Evaluating transformation matrix with feature matching (SIFT)')
-            shifts = register_stack_feature_matching(image3D, feature_type="SIFT")
+            shifts = register_stack_feature_matching(image3D, feature_type="SIFT", reuse_features=registration_reuse_features, nthreads=registration_nthreads)
         else:
             logging.getLogger(__name__).error('Error unknown registration method %s', registration_method)
             remove_all_log_handlers()
@@ -858,6 +1358,13 @@ def registration_values(image, projection_type, projection_zrange, channel_posit
         remove_all_log_handlers()
         raise ValueError(f"Error unknown registration method {registration_method}")
 
+    if registration_pyramid_levels > 0:
+        logging.getLogger(__name__).info('Refining transformation matrix at full resolution with phase correlation')
+        factor = 2**registration_pyramid_levels
+        # shifts evaluated on downsampled frames are only accurate to about factor pixels
+        shifts = refine_shifts_phase_correlation(image3D_full, shifts*factor, search_range=2*factor, blur=5, nthreads=registration_nthreads)
+        shifts = np.array(shifts)
+
     # Transformation matrix has 5 columns:
     # x, y, keep, x_raw, y_raw 
     transformation_matrices = np.zeros((image.sizes['T'], 5), dtype=int)
@@ -892,7 +1399,7 @@ def registration_values(image, projection_type, projection_zrange, channel_posit
 ################################################################
 
 
-def registration_main(image_path, output_path, output_basename, channel_position, projection_type, projection_zrange, timepoint_range, skip_crop_decision, registration_method, coalign_image_paths=None, coalign_output_basenames=None):
+def registration_main(image_path, output_path, output_basename, channel_position, projection_type, projection_zrange, timepoint_range, skip_crop_decision, registration_method, coalign_image_paths=None, coalign_output_basenames=None, output_compression=None, projection_nthreads=1, registration_nthreads=1, registration_pyramid_levels=0, registration_reuse_features=False, registration_profile_fallback=True, virtual_output=False):
 
     try:
         # Setup logging to file in output_path
@@ -928,6 +1435,12 @@ def registration_main(image_path, output_path, output_basename, channel_position
 
         logger.info("Input image path: %s", image_path)
         logger.info("Registration method: %s", registration_method)
+        if registration_pyramid_levels > 0:
+            logger.info("Pyramid levels: %s", registration_pyramid_levels)
+        if registration_reuse_features and registration_method.startswith("feature matching"):
+            logger.info("Detect features once per time frame: %s", registration_reuse_features)
+        if registration_method == "projection profiles":
+            logger.info("Phase correlation fallback: %s", registration_profile_fallback)
 
         # Load image
         # Note: by default the image have to be ALWAYS 3D with TYX
@@ -962,11 +1475,11 @@ def registration_main(image_path, output_path, output_basename, channel_position
             raise ValueError('Invalid timepoint range')
 
         # Calculate transformation matrix
-        tmat = registration_values(image, projection_type, projection_zrange, channel_position, output_path, output_basename, registration_method, image_metadata, timepoint_range)
+        tmat = registration_values(image, projection_type, projection_zrange, channel_position, output_path, output_basename, registration_method, image_metadata, timepoint_range, projection_nthreads, registration_nthreads, registration_pyramid_levels, registration_reuse_features, registration_profile_fallback)
 
         # Align and save
         try:
-            registration_with_tmat(tmat, image, skip_crop_decision, output_path, output_basename, image_metadata)
+            registration_with_tmat(tmat, image, skip_crop_decision, output_path, output_basename, image_metadata, output_compression, virtual_output)
         except Exception:
             logger.exception('Registration failed for image %s', image_path)
             remove_all_log_handlers()
@@ -975,11 +1488,9 @@ def registration_main(image_path, output_path, output_basename, channel_position
         remove_all_log_handlers()
 
         # Co-alignment
-        if coalign_image_paths is not None and coalign_output_basenames is not None:
+        if coalign_image_paths is not None and coalign_output_basenames is not None and len(coalign_image_paths) > 0:
             tmat_path = os.path.join(output_path, output_basename+'.csv')
-            for coalign_image_path, coalign_output_basename in zip(coalign_image_paths, coalign_output_basenames):
-                logger.info("Co-aligning image: %s", image_path)
-                alignment_main(coalign_image_path, tmat_path, output_path, coalign_output_basename, skip_crop_decision)
+            coalignment_main(coalign_image_paths, tmat_path, output_path, coalign_output_basenames, skip_crop_decision, output_compression, virtual_output, registration_nthreads)
 
     except Exception:
         # Remove all handlers for this module
@@ -989,7 +1500,7 @@ def registration_main(image_path, output_path, output_basename, channel_position
 ################################################################
 
 
-def alignment_main(image_path, tmat_path, output_path, output_basename, skip_crop_decision):
+def alignment_main(image_path, tmat_path, output_path, output_basename, skip_crop_decision, output_compression=None, virtual_output=False):
     try:
         # Setup logging to file in output_path
         logger = logging.getLogger(__name__)
@@ -1010,37 +1521,6 @@ def alignment_main(image_path, tmat_path, output_path, output_basename, skip_cro
         buffered_handler.setLevel(logging.INFO)
         logger.addHandler(buffered_handler)
 
-        logger.info("System info:")
-        logger.info("- platform: %s", platform())
-        logger.info("- python version: %s", python_version())
-        logger.info("- VLabApp version: %s", vlabapp_version)
-        logger.info("- numpy version: %s", np.__version__)
-        logger.info("- pystackreg version: %s", StackReg_version)
-        logger.info("- opencv version: %s", cv.__version__)
-        logger.info("- skimage version: %s", skimage_version)
-
-        logger.info("Input image path: %s", image_path)
-        logger.info("Input transformation matrix path: %s", tmat_path)
-
-        # Load image and matrix
-        try:
-            logger.debug('loading %s', image_path)
-            image = gf.Image(image_path)
-            image.imread()
-        except Exception:
-            logging.getLogger(__name__).exception('Error loading image %s', image_path)
-            remove_all_log_handlers()
-            raise
-        # load image metadata
-        image_metadata = []
-        if image.ome_metadata:
-            for x in image.ome_metadata.structured_annotations:
-                if isinstance(x, CommentAnnotation) and x.namespace == "VLabApp":
-                    if len(image_metadata) == 0:
-                        image_metadata.append("Metadata for "+image.path+":\n"+x.value)
-                    else:
-                        image_metadata.append(x.value)
-
         try:
             logger.debug('loading %s', tmat_path)
             tmat, tmat_metadata = read_transformation_matrix(tmat_path)
@@ -1048,24 +1528,8 @@ def alignment_main(image_path, tmat_path, output_path, output_basename, skip_cro
             logging.getLogger(__name__).exception('Error loading transformation matrix for image %s', image_path)
             remove_all_log_handlers()
             raise
-        # Check image and transformation matrix have same number of time frames
-        if image.sizes['T'] != tmat.shape[0]:
-            logging.getLogger(__name__).error('Image and transformation matrix do not have the same number of time frames')
-            remove_all_log_handlers()
-            raise TypeError('Image and transformation matrix do not have the same number of time frames')
-        # Check 'F' axis has size 1
-        if image.sizes['F'] != 1:
-            logging.getLogger(__name__).error('Image %s has a F axis with size > 1', image_path)
-            remove_all_log_handlers()
-            raise TypeError(f"Image {image_path} has a F axis with size > 1")
 
-        # Align and save - registration works with multidimensional files, as long as the TYX axes are specified
-        try:
-            registration_with_tmat(tmat, image, skip_crop_decision, output_path, output_basename, image_metadata+tmat_metadata)
-        except Exception:
-            logging.getLogger(__name__).exception('Alignment failed for image %s', image_path)
-            remove_all_log_handlers()
-            raise
+        align_image(image_path, tmat, tmat_metadata, tmat_path, output_path, output_basename, skip_crop_decision, output_compression, virtual_output, buffered_handler)
 
         remove_all_log_handlers()
 
@@ -1075,6 +1539,129 @@ def alignment_main(image_path, tmat_path, output_path, output_basename, skip_cro
         raise
 
 
+def align_image(image_path, tmat, tmat_metadata, tmat_path, output_path, output_basename, skip_crop_decision, output_compression, virtual_output, log_handler):
+    """
+    Load an image and align it with a transformation matrix (see alignment_main()).
+
+    Parameters
+    ----------
+    image_path: str
+        input image path.
+    tmat, tmat_metadata:
+        transformation matrix and its metadata (see read_transformation_matrix()).
+    tmat_path: str
+        transformation matrix path (only logged).
+    output_path, output_basename, skip_crop_decision, output_compression, virtual_output:
+        see registration_with_tmat().
+    log_handler: gf.BufferedHandler
+        handler with the log messages saved in the output metadata and log file.
+    """
+    logger = logging.getLogger(__name__)
+    logger.info("System info:")
+    logger.info("- platform: %s", platform())
+    logger.info("- python version: %s", python_version())
+    logger.info("- VLabApp version: %s", vlabapp_version)
+    logger.info("- numpy version: %s", np.__version__)
+    logger.info("- pystackreg version: %s", StackReg_version)
+    logger.info("- opencv version: %s", cv.__version__)
+    logger.info("- skimage version: %s", skimage_version)
+
+    logger.info("Input image path: %s", image_path)
+    logger.info("Input transformation matrix path: %s", tmat_path)
+
+    # Load image
+    try:
+        logger.debug('loading %s', image_path)
+        image = gf.Image(image_path)
+        # time frames are read from disk when aligned (one time frame at a time)
+        image.imread(lazy=True)
+    except Exception:
+        logger.exception('Error loading image %s', image_path)
+        raise
+    # load image metadata
+    image_metadata = []
+    if image.ome_metadata:
+        for x in image.ome_metadata.structured_annotations:
+            if isinstance(x, CommentAnnotation) and x.namespace == "VLabApp":
+                if len(image_metadata) == 0:
+                    image_metadata.append("Metadata for "+image.path+":\n"+x.value)
+                else:
+                    image_metadata.append(x.value)
+
+    # Check image and transformation matrix have same number of time frames
+    if image.sizes['T'] != tmat.shape[0]:
+        logger.error('Image and transformation matrix do not have the same number of time frames')
+        raise TypeError('Image and transformation matrix do not have the same number of time frames')
+    # Check 'F' axis has size 1
+    if image.sizes['F'] != 1:
+        logger.error('Image %s has a F axis with size > 1', image_path)
+        raise TypeError(f"Image {image_path} has a F axis with size > 1")
+
+    # Align and save - registration works with multidimensional files, as long as the TYX axes are specified
+    try:
+        registration_with_tmat(tmat, image, skip_crop_decision, output_path, output_basename, image_metadata+tmat_metadata, output_compression, virtual_output, log_handler)
+    except Exception:
+        logger.exception('Alignment failed for image %s', image_path)
+        raise
+
+
+def coalignment_main(image_paths, tmat_path, output_path, output_basenames, skip_crop_decision, output_compression=None, virtual_output=False, nthreads=1):
+    """
+    Align multiple images (e.g. all images co-aligned with a registered image) with the same transformation matrix.
+    The transformation matrix is read once and images are aligned concurrently (one image per thread),
+    one time frame at a time. Output files are the same as with alignment_main() for each image.
+
+    Parameters
+    ----------
+    image_paths: list of str
+        input image paths.
+    tmat_path: str
+        transformation matrix path.
+    output_path: str
+        output directory.
+    output_basenames: list of str
+        output basenames (one per input image).
+    skip_crop_decision, output_compression, virtual_output:
+        see registration_with_tmat().
+    nthreads: int
+        number of images aligned concurrently.
+    """
+    logger = logging.getLogger(__name__)
+    logger.info("REGISTRATION MODULE (co-alignment)")
+    if not os.path.isdir(output_path):
+        logger.debug("creating: %s", output_path)
+        os.makedirs(output_path)
+
+    logger.setLevel(logging.DEBUG)
+
+    try:
+        logger.debug('loading %s', tmat_path)
+        tmat, tmat_metadata = read_transformation_matrix(tmat_path)
+    except Exception:
+        logger.exception('Error loading transformation matrix %s', tmat_path)
+        raise
+
+    def align(image_path, output_basename):
+        # Log to memory, only messages from this thread
+        log_handler = gf.BufferedHandler()
+        log_handler.setFormatter(logging.Formatter('%(asctime)s (VLabApp - registration module) [%(levelname)s] %(message)s'))
+        log_handler.setLevel(logging.INFO)
+        thread = threading.get_ident()
+        log_handler.addFilter(lambda record: record.thread == thread)
+        logger.addHandler(log_handler)
+        try:
+            logger.info("Co-aligning image: %s", image_path)
+            align_image(image_path, tmat, tmat_metadata, tmat_path, output_path, output_basename, skip_crop_decision, output_compression, virtual_output, log_handler)
+        finally:
+            logger.removeHandler(log_handler)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(nthreads, len(image_paths)))) as executor:
+        futures = [executor.submit(align, image_path, output_basename) for image_path, output_basename in zip(image_paths, output_basenames)]
+        # raise the first error (after all images are processed)
+        for future in futures:
+            future.result()
+
+
 ################################################################
 
 
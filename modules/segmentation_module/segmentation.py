@@ -45,7 +45,7 @@ class Segmentation(QWidget):
         self.image_list = gf.FileListWidget(filetypes=gf.imagetypes, filenames_filter='_BF')
         self.image_list.file_list_changed.connect(self.image_list_changed)
 
-        self.output_settings = gf.OutputSettings(extensions=['.ome.tif'], output_suffix=self.output_suffix, pipeline_layout=self.pipeline_layout)
+        self.output_settings = gf.OutputSettings(extensions=['.ome.tif'], output_suffix=self.output_suffix, pipeline_layout=self.pipeline_layout, allow_zarr=True)
 
         self.segmentation_method = QComboBox()
         self.segmentation_method.addItem("cellpose")
@@ -278,7 +278,8 @@ class Segmentation(QWidget):
             'projection_mode_fixed_zmin': self.zprojection_settings.projection_mode_fixed_zmin.value(),
             'projection_mode_fixed_zmax': self.zprojection_settings.projection_mode_fixed_zmax.value(),
             'projection_mode_all': self.zprojection_settings.projection_mode_all.isChecked(),
-            'projection_type': self.zprojection_settings.projection_type.currentText(),
+            'projection_type': self.zprojection_settings.get_projection_type(),
+            'projection_nthreads': self.zprojection_settings.nthreads.value(),
             'use_gpu': self.use_gpu.isChecked(),
             'coarse_grain': self.coarse_grain.isChecked(),
             'nprocesses': self.nprocesses.value(),
@@ -306,7 +307,8 @@ class Segmentation(QWidget):
         self.zprojection_settings.projection_mode_fixed_zmin.setValue(widgets_state['projection_mode_fixed_zmin'])
         self.zprojection_settings.projection_mode_fixed_zmax.setValue(widgets_state['projection_mode_fixed_zmax'])
         self.zprojection_settings.projection_mode_all.setChecked(widgets_state['projection_mode_all'])
-        self.zprojection_settings.projection_type.setCurrentText(widgets_state['projection_type'])
+        self.zprojection_settings.set_projection_type(widgets_state['projection_type'])
+        self.zprojection_settings.nthreads.setValue(widgets_state.get('projection_nthreads', 1))
         if self.use_gpu.isEnabled():
             self.use_gpu.setChecked(widgets_state['use_gpu'])
         self.coarse_grain.setChecked(widgets_state['coarse_grain'])
@@ -321,6 +323,8 @@ class Segmentation(QWidget):
         projection_zrange = self.zprojection_settings.get_projection_zrange()
 
         image_paths = self.image_list.get_file_list()
+        # one job per field of view for multi-position images
+        image_paths = gf.expand_fields_of_view(image_paths)
         segmentation_method = self.segmentation_method.currentText()
         cellpose_model_type = self.cellpose_model_type.currentText()
         cellpose_diameter = self.cellpose_diameter.value()
@@ -335,7 +339,7 @@ class Segmentation(QWidget):
             self.logger.error('Image missing')
             return
         for path in image_paths:
-            if not os.path.isfile(path):
+            if not gf.isfile(path):
                 self.logger.error('Image not found: %s', path)
                 return
         if segmentation_method == "cellpose":
@@ -383,6 +387,7 @@ class Segmentation(QWidget):
         arguments = []
         nprocesses = self.nprocesses.value()
 
+        output_compression = self.output_settings.get_output_compression()
         run_parallel = True
         if self.use_gpu.isChecked():
             nprocesses = 1
@@ -430,7 +435,7 @@ class Segmentation(QWidget):
             hide_status_dialog = True
             for i, args in enumerate(arguments):
                 try:
-                    f.main(*args, run_parallel=run_parallel)
+                    f.main(*args, run_parallel=run_parallel, output_compression=output_compression, projection_nthreads=self.zprojection_settings.get_nthreads())
                     status_dialog.set_status(i, 'Success')
                 except Exception as e:
                     self.logger.exception("Segmentation failed")
@@ -443,7 +448,7 @@ class Segmentation(QWidget):
             with concurrent.futures.ProcessPoolExecutor(max_workers=nprocesses, initializer=process_initializer) as executor:
                 QApplication.processEvents()
                 time.sleep(0.01)
-                future_reg = {executor.submit(f.main, *args, run_parallel=False): i for i, args in enumerate(arguments)}
+                future_reg = {executor.submit(f.main, *args, run_parallel=False, output_compression=output_compression, projection_nthreads=self.zprojection_settings.get_nthreads()): i for i, args in enumerate(arguments)}
                 for future in concurrent.futures.as_completed(future_reg):
                     try:
                         future.result()
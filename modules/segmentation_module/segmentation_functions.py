@@ -12,7 +12,6 @@ from general import general_functions as gf
 from PyQt5.QtGui import QCursor
 from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import QMessageBox
-from bioio.writers import OmeTiffWriter
 from bioio import PhysicalPixelSizes
 from ome_types.model import CommentAnnotation
 from version import __version__ as vlabapp_version
@@ -108,7 +107,7 @@ def parallel_run_microsam(image, mask, predictor, segmenter, logger, tot_iterati
     return mask
 
 
-def main(image_path, segmentation_method, cellpose_model_type, cellpose_model_path, cellpose_diameter, cellpose_cellprob_threshold, cellpose_flow_threshold, microsam_model_type, output_path, output_basename, channel_position, projection_type, projection_zrange, nprocesses, display_results=True, use_gpu=True, run_parallel=True):
+def main(image_path, segmentation_method, cellpose_model_type, cellpose_model_path, cellpose_diameter, cellpose_cellprob_threshold, cellpose_flow_threshold, microsam_model_type, output_path, output_basename, channel_position, projection_type, projection_zrange, nprocesses, display_results=True, use_gpu=True, run_parallel=True, output_compression=None, projection_nthreads=1):
     """
     Load image, segment with cellpose and save the resulting mask
     into `output_path` directory using filename `output_basename`.ome.tif.
@@ -134,7 +133,7 @@ def main(image_path, segmentation_method, cellpose_model_type, cellpose_model_pa
     output_path: str
         output directory
     output_basename: str
-        output basename. Output file will be saved as `output_path`/`output_basename`.ome.tif and `output_path`/`output_basename`.log.
+        output basename. Output file will be saved as `output_path`/`output_basename`.ome.tif (or .ome.zarr, see `output_compression`) and `output_path`/`output_basename`.log.
     channel_position : int
         position of the channel to segment if the image is a c-stack
     projection_type : str
@@ -153,6 +152,10 @@ def main(image_path, segmentation_method, cellpose_model_type, cellpose_model_pa
         use GPU for cellpose segmentation
     run_parallel: bool
         activate fine grain parallelism
+    output_compression: dict or None
+        output compression settings (see gf.get_tifffile_kwargs()).
+    projection_nthreads: int
+        number of threads used for z-projection (see gf.Image.z_projection()).
     """
 
     try:
@@ -217,7 +220,6 @@ def main(image_path, segmentation_method, cellpose_model_type, cellpose_model_pa
         logger.debug("loading %s", image_path)
         try:
             image = gf.Image(image_path)
-            image.imread()
         except Exception:
             logging.getLogger(__name__).exception('Error loading image %s', image_path)
             # Remove all handlers for this module
@@ -241,21 +243,30 @@ def main(image_path, segmentation_method, cellpose_model_type, cellpose_model_pa
             remove_all_log_handlers()
             raise TypeError(f"Image {image_path} has a F axis with size > 1")
 
-        # Project Z axis if needed and select channel
-        if image.sizes['Z'] > 1:
-            logger.info('Preparing image to segment: performing Z-projection')
-            image3D = image.z_projection(projection_type, projection_zrange)
-        else:
-            image3D = image.image
         # keep only selected channel ('C' axis)
         if image.sizes['C'] > channel_position:
             logging.getLogger(__name__).info('Preparing image to segment: selecting channel %s', channel_position)
-            image3D = image3D[0, :, channel_position, 0, :, :]
         else:
             logging.getLogger(__name__).error('Position of the channel given (%s) is out of range for image %s', channel_position, image.basename)
             # Remove all handlers for this module
             remove_all_log_handlers()
             raise TypeError(f"Position of the channel given ({channel_position}) is out of range for image {image.basename}")
+        # read only the selected channel
+        try:
+            image.imread(C=channel_position)
+        except Exception:
+            logging.getLogger(__name__).exception('Error loading image %s', image_path)
+            # Remove all handlers for this module
+            remove_all_log_handlers()
+            raise
+
+        # Project Z axis if needed
+        if image.sizes['Z'] > 1:
+            logger.info('Preparing image to segment: performing Z-projection')
+            image3D = image.z_projection(projection_type, projection_zrange, nthreads=projection_nthreads)
+        else:
+            image3D = image.image
+        image3D = image3D[0, :, 0, 0, :, :]
 
         tot_iterations = image.sizes['T']
 
@@ -280,87 +291,96 @@ def main(image_path, segmentation_method, cellpose_model_type, cellpose_model_pa
         # limit number of theads used by torch on CPU
         set_num_threads(1)
 
-        if segmentation_method == "cellpose":
-            # Create cellpose model
-            if Version(cellpose_version).major == 4:
-                if cellpose_model_type == "User trained model":
-                    logger.debug("loading cellpose model %s", cellpose_model_path)
-                    cellpose_model = models.CellposeModel(gpu=use_gpu, pretrained_model=cellpose_model_path)
-                    cellpose_diameter = None
-                else:
-                    logger.debug("loading cellpose model %s", cellpose_model_type)
-                    cellpose_model = models.CellposeModel(gpu=use_gpu, pretrained_model=cellpose_model_type)
-                    if cellpose_diameter == 0:
-                        cellpose_diameter = None
-            elif Version(cellpose_version).major == 3:
-                if cellpose_model_type == "User trained model":
-                    logger.debug("loading cellpose model %s", cellpose_model_path)
-                    cellpose_model = models.CellposeModel(gpu=use_gpu, pretrained_model=cellpose_model_path)
-                    cellpose_diameter = cellpose_model.diam_labels
-                elif cellpose_model_type in ['cyto', 'cyto2', 'cyto3', 'nuclei']:
-                    logger.debug("loading cellpose model %s", cellpose_model_type)
-                    cellpose_model = models.Cellpose(gpu=use_gpu, model_type=cellpose_model_type)
-                    if cellpose_diameter == 0:
+        # Segment and save the mask, one time frame at a time
+        output_name = os.path.join(output_path, output_basename+gf.get_output_extension(output_compression))
+        logger.info("Saving segmentation mask to %s", output_name)
+        with gf.open_image_writer(output_name, image3D.shape, 'uint16',
+                                    dimension_order="TYX",
+                                    channel_names=['Segmentation mask'],
+                                    physical_pixel_sizes=PhysicalPixelSizes(X=image.physical_pixel_sizes[0], Y=image.physical_pixel_sizes[1], Z=image.physical_pixel_sizes[2]),
+                                    output_compression=output_compression) as writer:
+            if segmentation_method == "cellpose":
+                # Create cellpose model
+                if Version(cellpose_version).major == 4:
+                    if cellpose_model_type == "User trained model":
+                        logger.debug("loading cellpose model %s", cellpose_model_path)
+                        cellpose_model = models.CellposeModel(gpu=use_gpu, pretrained_model=cellpose_model_path)
                         cellpose_diameter = None
+                    else:
+                        logger.debug("loading cellpose model %s", cellpose_model_type)
+                        cellpose_model = models.CellposeModel(gpu=use_gpu, pretrained_model=cellpose_model_type)
+                        if cellpose_diameter == 0:
+                            cellpose_diameter = None
+                elif Version(cellpose_version).major == 3:
+                    if cellpose_model_type == "User trained model":
+                        logger.debug("loading cellpose model %s", cellpose_model_path)
+                        cellpose_model = models.CellposeModel(gpu=use_gpu, pretrained_model=cellpose_model_path)
+                        cellpose_diameter = cellpose_model.diam_labels
+                    elif cellpose_model_type in ['cyto', 'cyto2', 'cyto3', 'nuclei']:
+                        logger.debug("loading cellpose model %s", cellpose_model_type)
+                        cellpose_model = models.Cellpose(gpu=use_gpu, model_type=cellpose_model_type)
+                        if cellpose_diameter == 0:
+                            cellpose_diameter = None
+                    else:
+                        logger.debug("loading cellpose model %s", cellpose_model_type)
+                        cellpose_model = models.CellposeModel(gpu=use_gpu, model_type=cellpose_model_type)
+
+                # Cellpose segmentation
+                logger.info("Cellpose segmentation (diameter=%s)", cellpose_diameter)
+
+                iteration = 0
+                # whole mask is only kept in memory when needed (parallel run or display results)
+                mask = np.zeros(image3D.shape, dtype='uint16') if display_results or (run_parallel and nprocesses > 1) else None
+                if run_parallel and nprocesses > 1:
+                    mask = parallel_run_cellpose(image3D, mask, cellpose_model, cellpose_diameter, cellpose_cellprob_threshold, cellpose_flow_threshold, logger, tot_iterations, nprocesses, pbr)
+                    writer.write(mask)
                 else:
-                    logger.debug("loading cellpose model %s", cellpose_model_type)
-                    cellpose_model = models.CellposeModel(gpu=use_gpu, model_type=cellpose_model_type)
-
-            # Cellpose segmentation
-            logger.info("Cellpose segmentation (diameter=%s)", cellpose_diameter)
-
-            iteration = 0
-            mask = np.zeros(image3D.shape, dtype='uint16')
-            if run_parallel and nprocesses > 1:
-                mask = parallel_run_cellpose(image3D, mask, cellpose_model, cellpose_diameter, cellpose_cellprob_threshold, cellpose_flow_threshold, logger, tot_iterations, nprocesses, pbr)
-            else:
-                for t in range(image3D.shape[0]):
-                    iteration += 1
-                    image_2D = image3D[t, :, :]
-                    if display_results:
-                        # Logging into napari window
-                        pbr.set_description(f"cellpose segmentation {iteration}/{tot_iterations}")
-                        pbr.update(1)
-                    logger.debug("cellpose segmentation %s/%s", iteration, tot_iterations)
-                    _, mask[t, :, :], *_ = run_cellpose(t, image_2D, cellpose_model, cellpose_diameter, cellpose_cellprob_threshold, cellpose_flow_threshold)
-        elif segmentation_method == "Segment Anything for Microscopy":
-            # create predictor and segmenter
-            logger.debug("loading Segment Anything for Microscopy model %s", microsam_model_type)
-            microsam_predictor, microsam_segmenter = get_predictor_and_segmenter(model_type=microsam_model_type, device=None if use_gpu else 'cpu')
-
-            # Cellpose segmentation
-            logger.info("Segment Anything for Microscopy segmentation")
-
-            iteration = 0
-            mask = np.zeros(image3D.shape, dtype='uint16')
-            if run_parallel and nprocesses > 1:
-                mask = parallel_run_microsam(image3D, mask, microsam_predictor, microsam_segmenter, logger, tot_iterations, nprocesses, pbr)
-            else:
-                for t in range(image3D.shape[0]):
-                    iteration += 1
-                    image_2D = image3D[t, :, :]
-                    if display_results:
-                        # Logging into napari window
-                        pbr.set_description(f"Segment Anything for Microscopy segmentation {iteration}/{tot_iterations}")
-                        pbr.update(1)
-                    logger.debug("Segment Anything for Microscopy segmentation %s/%s", iteration, tot_iterations)
-                    _, mask[t, :, :] = run_microsam(t, image_2D, microsam_predictor, microsam_segmenter)
-
-        if use_gpu:
-            cuda.empty_cache()
-
-        # Save the mask
-        output_name = os.path.join(output_path, output_basename+".ome.tif")
-        logger.info("Saving segmentation mask to %s", output_name)
-        ome_metadata = OmeTiffWriter.build_ome(data_shapes=[mask.shape],
-                                               data_types=[mask.dtype],
-                                               dimension_order=["TYX"],
-                                               channel_names=[['Segmentation mask']],
-                                               physical_pixel_sizes=[PhysicalPixelSizes(X=image.physical_pixel_sizes[0], Y=image.physical_pixel_sizes[1], Z=image.physical_pixel_sizes[2])])
-        ome_metadata.structured_annotations.append(CommentAnnotation(value=buffered_handler.get_messages(), namespace="VLabApp"))
-        for x in image_metadata:
-            ome_metadata.structured_annotations.append(CommentAnnotation(value=x, namespace="VLabApp"))
-        OmeTiffWriter.save(mask, output_name, ome_xml=ome_metadata)
+                    for t in range(image3D.shape[0]):
+                        iteration += 1
+                        image_2D = image3D[t, :, :]
+                        if display_results:
+                            # Logging into napari window
+                            pbr.set_description(f"cellpose segmentation {iteration}/{tot_iterations}")
+                            pbr.update(1)
+                        logger.debug("cellpose segmentation %s/%s", iteration, tot_iterations)
+                        _, mask_2D, *_ = run_cellpose(t, image_2D, cellpose_model, cellpose_diameter, cellpose_cellprob_threshold, cellpose_flow_threshold)
+                        writer.write(mask_2D)
+                        if display_results:
+                            mask[t, :, :] = mask_2D
+            elif segmentation_method == "Segment Anything for Microscopy":
+                # create predictor and segmenter
+                logger.debug("loading Segment Anything for Microscopy model %s", microsam_model_type)
+                microsam_predictor, microsam_segmenter = get_predictor_and_segmenter(model_type=microsam_model_type, device=None if use_gpu else 'cpu')
+
+                # Cellpose segmentation
+                logger.info("Segment Anything for Microscopy segmentation")
+
+                iteration = 0
+                # whole mask is only kept in memory when needed (parallel run or display results)
+                mask = np.zeros(image3D.shape, dtype='uint16') if display_results or (run_parallel and nprocesses > 1) else None
+                if run_parallel and nprocesses > 1:
+                    mask = parallel_run_microsam(image3D, mask, microsam_predictor, microsam_segmenter, logger, tot_iterations, nprocesses, pbr)
+                    writer.write(mask)
+                else:
+                    for t in range(image3D.shape[0]):
+                        iteration += 1
+                        image_2D = image3D[t, :, :]
+                        if display_results:
+                            # Logging into napari window
+                            pbr.set_description(f"Segment Anything for Microscopy segmentation {iteration}/{tot_iterations}")
+                            pbr.update(1)
+                        logger.debug("Segment Anything for Microscopy segmentation %s/%s", iteration, tot_iterations)
+                        _, mask_2D = run_microsam(t, image_2D, microsam_predictor, microsam_segmenter)
+                        writer.write(mask_2D)
+                        if display_results:
+                            mask[t, :, :] = mask_2D
+
+            if use_gpu:
+                cuda.empty_cache()
+
+            writer.ome_metadata.structured_annotations.append(CommentAnnotation(value=buffered_handler.get_messages(), namespace="VLabApp"))
+            for x in image_metadata:
+                writer.ome_metadata.structured_annotations.append(CommentAnnotation(value=x, namespace="VLabApp"))
 
         # create logfile
         logfile = os.path.join(output_path, output_basename+".log")
@@ -67,7 +67,7 @@ class ImageMaskGraphViewer(QWidget):
         self.input_mask.setToolTip('')
         self.input_graph.setPlaceholderText('')
         self.input_graph.setToolTip('')
-        if os.path.isfile(mask_path):
+        if gf.isfile(mask_path):
             graph_path = gf.splitext(mask_path)[0] + '.graphmlz'
             if os.path.isfile(graph_path):
                 self.input_graph.setPlaceholderText(graph_path)
@@ -76,7 +76,7 @@ class ImageMaskGraphViewer(QWidget):
             if res:
                 for ext in gf.imagetypes:
                     image_path = os.path.join(os.path.dirname(mask_path), res.group(1)) + ext
-                    if os.path.isfile(image_path):
+                    if gf.isfile(image_path):
                         self.input_image.setPlaceholderText(image_path)
                         self.input_image.setToolTip(image_path)
                         break
@@ -91,14 +91,14 @@ class ImageMaskGraphViewer(QWidget):
         self.input_graph.setToolTip('')
         if os.path.isfile(graph_path):
             mask_path = gf.splitext(graph_path)[0] + '.ome.tif'
-            if os.path.isfile(mask_path):
+            if gf.isfile(mask_path):
                 self.input_mask.setPlaceholderText(mask_path)
                 self.input_mask.setToolTip(mask_path)
             res = re.match('(.*)'+gf.output_suffixes['segmentation']+'.*$', os.path.basename(graph_path))
             if res:
                 for ext in gf.imagetypes:
                     image_path = os.path.join(os.path.dirname(graph_path), res.group(1)) + ext
-                    if os.path.isfile(image_path):
+                    if gf.isfile(image_path):
                         self.input_image.setPlaceholderText(image_path)
                         self.input_image.setToolTip(image_path)
                         break
@@ -121,11 +121,11 @@ class ImageMaskGraphViewer(QWidget):
             self.logger.error('Missing mask path (mandatory when graph path is not empty)')
             self.input_graph.setFocus()
             return
-        if image_path != '' and not os.path.isfile(image_path):
+        if image_path != '' and not gf.isfile(image_path):
             self.logger.error('Invalid image path')
             self.input_image.setFocus()
             return
-        if mask_path != '' and not os.path.isfile(mask_path):
+        if mask_path != '' and not gf.isfile(mask_path):
             self.logger.error('Invalid mask path')
             self.input_mask.setFocus()
             return
@@ -257,7 +257,7 @@ class RegistrationViewer(QWidget):
         self.input_image.setToolTip('')
         self.input_matrix.setPlaceholderText('')
         self.input_matrix.setToolTip('')
-        if os.path.isfile(image_path):
+        if gf.isfile(image_path):
             # get path with matrix filetype (self.matricestype), containing gf.output_suffixes['registration'] and with same unique identifier
             matrix_paths = [path for path in os.listdir(os.path.dirname(image_path)) if any(path.endswith(matricestype) for matricestype in gf.matrixtypes) and gf.output_suffixes['registration'] in path and os.path.basename(path).split('_')[0] == gf.splitext(os.path.basename(image_path))[0].split('_')[0]]
             if len(matrix_paths) > 0:
@@ -277,7 +277,7 @@ class RegistrationViewer(QWidget):
             if res:
                 for ext in gf.imagetypes:
                     image_path = os.path.join(os.path.dirname(matrix_path), res.group(1)) + ext
-                    if os.path.isfile(image_path):
+                    if gf.isfile(image_path):
                         self.input_image.setPlaceholderText(image_path)
                         self.input_image.setToolTip(image_path)
                         break
@@ -298,7 +298,7 @@ class RegistrationViewer(QWidget):
             self.logger.error('Missing matrix path')
             self.input_matrix.setFocus()
             return
-        if not os.path.isfile(image_path):
+        if not gf.isfile(image_path):
             self.logger.error('Invalid image path')
             self.input_image.setFocus()
             return
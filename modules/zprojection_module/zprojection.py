@@ -47,9 +47,11 @@ class zProjection(QWidget):
         self.output_filename_label.setFrame(False)
         self.output_filename_label.setEnabled(False)
         self.output_filename_label.textChanged.connect(self.output_filename_label.setToolTip)
+        self.output_compression = gf.OutputCompressionSettings()
+        self.output_compression.changed.connect(self.update_output_filename_label)
 
         # Z-Projection
-        self.zprojection_settings = gf.ZProjectionSettings()
+        self.zprojection_settings = gf.ZProjectionSettings(show_focus_channel=True, show_focus_tracking=True)
         self.zprojection_settings.projection_type.setCurrentText("mean")
         self.zprojection_settings.changed.connect(self.update_output_filename_label)
 
@@ -95,6 +97,8 @@ class zProjection(QWidget):
         suffix.setAlignment(Qt.AlignRight)
         layout3.addRow("Suffix:", suffix)
         layout3.addRow("Filename:", self.output_filename_label)
+        if not self.pipeline_layout:
+            layout3.addRow("Format:", self.output_compression)
         layout2.addLayout(layout3)
         groupbox.setLayout(layout2)
         layout.addWidget(groupbox)
@@ -130,7 +134,8 @@ class zProjection(QWidget):
         projection_zrange = self.zprojection_settings.get_projection_zrange()
         projection_suffix = self.get_projection_suffix(None, projection_zrange, projection_type)
 
-        self.output_filename_label.setText(os.path.normpath(os.path.join(output_path, "<input basename>" + self.output_suffix + projection_suffix + ".ome.tif")))
+        extension = '.ome.tif' if self.pipeline_layout else gf.get_output_extension(self.output_compression.get_output_compression())
+        self.output_filename_label.setText(os.path.normpath(os.path.join(output_path, "<input basename>" + self.output_suffix + projection_suffix + extension)))
 
     def get_projection_suffix(self, image_path, projection_zrange, projection_type):
         if projection_zrange is None:
@@ -159,6 +164,8 @@ class zProjection(QWidget):
         else:
             self.logger.error('Invalid projection_zrange: %s', str(projection_zrange))
             raise TypeError(f"Invalid projection_zrange: {projection_zrange}")
+        # e.g. percentile:25 -> percentile25, trimmed_mean:10 -> trimmedmean10 (valid file name, no '_' separator)
+        output_suffix_projection_type = output_suffix_projection_type.replace(':', '').replace('_', '')
         return output_suffix_reference + output_suffix_range + output_suffix_projection_type
 
     def get_widgets_state(self):
@@ -174,7 +181,10 @@ class zProjection(QWidget):
             'projection_mode_fixed_zmin': self.zprojection_settings.projection_mode_fixed_zmin.value(),
             'projection_mode_fixed_zmax': self.zprojection_settings.projection_mode_fixed_zmax.value(),
             'projection_mode_all': self.zprojection_settings.projection_mode_all.isChecked(),
-            'projection_type': self.zprojection_settings.projection_type.currentText(),
+            'projection_type': self.zprojection_settings.get_projection_type(),
+            'projection_nthreads': self.zprojection_settings.nthreads.value(),
+            'projection_focus_channel': self.zprojection_settings.focus_channel.value(),
+            'projection_focus_tracking': self.zprojection_settings.focus_tracking.value(),
             'nprocesses': self.nprocesses.value()}
         return widgets_state
 
@@ -190,14 +200,20 @@ class zProjection(QWidget):
         self.zprojection_settings.projection_mode_fixed_zmin.setValue(widgets_state['projection_mode_fixed_zmin'])
         self.zprojection_settings.projection_mode_fixed_zmax.setValue(widgets_state['projection_mode_fixed_zmax'])
         self.zprojection_settings.projection_mode_all.setChecked(widgets_state['projection_mode_all'])
-        self.zprojection_settings.projection_type.setCurrentText(widgets_state['projection_type'])
+        self.zprojection_settings.set_projection_type(widgets_state['projection_type'])
+        self.zprojection_settings.nthreads.setValue(widgets_state.get('projection_nthreads', 1))
+        self.zprojection_settings.focus_channel.setValue(widgets_state.get('projection_focus_channel', -1))
+        self.zprojection_settings.focus_tracking.setValue(widgets_state.get('projection_focus_tracking', 0))
         self.nprocesses.setValue(widgets_state['nprocesses'])
 
     def submit(self):
         projection_type = self.zprojection_settings.get_projection_type()
         projection_zrange = self.zprojection_settings.get_projection_zrange()
+        output_compression = self.output_compression.get_output_compression()
 
         image_paths = self.image_list.get_file_list()
+        # one job per field of view for multi-position images
+        image_paths = gf.expand_fields_of_view(image_paths)
         # prepare output suffix (incl. projection)
         output_basenames = [gf.splitext(os.path.basename(path))[0] + self.output_suffix + self.get_projection_suffix(path, projection_zrange, projection_type) for path in image_paths]
         if self.use_input_folder.isChecked():
@@ -210,7 +226,7 @@ class zProjection(QWidget):
             self.logger.error('Image missing')
             return
         for path in image_paths:
-            if not os.path.isfile(path):
+            if not gf.isfile(path):
                 self.logger.error('Image not found: %s', path)
                 return
         if self.output_folder.text() == '' and not self.use_input_folder.isChecked():
@@ -244,7 +260,7 @@ class zProjection(QWidget):
 
         arguments = []
         for image_path, output_path, output_basename in zip(image_paths, output_paths, output_basenames):
-            arguments.append((image_path, output_path, output_basename, projection_type, projection_zrange))
+            arguments.append((image_path, output_path, output_basename, projection_type, projection_zrange, output_compression, self.zprojection_settings.get_nthreads(), self.zprojection_settings.get_focus_channel(), self.zprojection_settings.get_focus_tracking()))
         if not arguments:
             return
         nprocesses = min(len(arguments), self.nprocesses.value())
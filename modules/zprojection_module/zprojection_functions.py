@@ -4,7 +4,6 @@ from platform import python_version, platform
 from numpy import __version__ as np_version
 from cv2 import __version__ as cv_version
 from general import general_functions as gf
-from bioio.writers import OmeTiffWriter
 from bioio import PhysicalPixelSizes
 from ome_types.model import CommentAnnotation
 from version import __version__ as vlabapp_version
@@ -19,7 +18,7 @@ def remove_all_log_handlers():
         logging.getLogger('general.general_functions').removeHandler(logging.getLogger('general.general_functions').handlers[0])
 
 
-def main(image_path, output_path, output_basename, projection_type, projection_zrange):
+def main(image_path, output_path, output_basename, projection_type, projection_zrange, output_compression=None, projection_nthreads=1, projection_focus_channel=None, projection_focus_tracking=None):
     """
     Perform z projection of the image given
 
@@ -30,7 +29,7 @@ def main(image_path, output_path, output_basename, projection_type, projection_z
     output_path: str
         output directory
     output_basename: str
-        output basename. Output file will be saved as `output_path`/`output_basename`.ome.tif and `output_path`/`output_basename`.log.
+        output basename. Output file will be saved as `output_path`/`output_basename`.ome.tif (or .ome.zarr, see `output_compression`) and `output_path`/`output_basename`.log.
     projection_type: str
         type of the projection to perfrom
     projection_zrange:  int or (int,int) or None
@@ -39,6 +38,16 @@ def main(image_path, output_path, output_basename, projection_type, projection_z
         If zrange is an integer, use all z sections in the interval [z_best-zrange,z_best+zrange]
         where z_best is the Z corresponding to best focus.
         If zrange is tuple (zmin,zmax), use all z sections in the interval [zmin,zmax].
+    output_compression: dict or None
+        output compression settings (see gf.get_tifffile_kwargs()).
+    projection_nthreads: int
+        number of threads used for z-projection (see gf.Image.z_projection()).
+    projection_focus_channel: int or None
+        position of the channel used to estimate the Z section with best focus for all channels,
+        or None to estimate it independently for each channel (see gf.Image.z_projection()).
+    projection_focus_tracking: int or None
+        range around the Z section with best focus in the previous time frame used to track best focus over time,
+        or None to search for best focus over all z sections (see gf.Image.z_projection()).
 
     Saves
     ---------------------
@@ -82,7 +91,8 @@ def main(image_path, output_path, output_basename, projection_type, projection_z
         logger.debug("Loading %s", image_path)
         try:
             image = gf.Image(image_path)
-            image.imread()
+            # z-stacks are read from disk when projected (one time frame at a time)
+            image.imread(lazy=True)
         except Exception:
             logging.getLogger(__name__).exception('Error loading image %s', image_path)
             # Remove all handlers for this module
@@ -106,29 +116,27 @@ def main(image_path, output_path, output_basename, projection_type, projection_z
             remove_all_log_handlers()
             raise TypeError(f"Image {image_path} has a F axis with size > 1")
 
-        # Perform projection
+        # Perform projection and save the projected image, one time frame at a time
+        output_file_name = os.path.join(output_path, output_basename+gf.get_output_extension(output_compression))
+        # TODO: properly deal with 'F' axis.
+        logger.info("Saving projected image to %s", output_file_name)
         try:
-            projected_image = image.z_projection(projection_type, projection_zrange)
+            with gf.open_image_writer(output_file_name, (image.sizes['T'], image.sizes['C'], image.sizes['Y'], image.sizes['X']), image.dtype,
+                                      dimension_order="TCYX",
+                                      channel_names=image.channel_names,
+                                      physical_pixel_sizes=PhysicalPixelSizes(X=image.physical_pixel_sizes[0], Y=image.physical_pixel_sizes[1], Z=image.physical_pixel_sizes[2]),
+                                      output_compression=output_compression) as writer:
+                for (f, t), projected_frame in image.z_projection_frames(projection_type, projection_zrange, nthreads=projection_nthreads, focus_channel=projection_focus_channel, focus_tracking=projection_focus_tracking):
+                    writer.write(projected_frame)
+                writer.ome_metadata.structured_annotations.append(CommentAnnotation(value=buffered_handler.get_messages(), namespace="VLabApp"))
+                for x in image_metadata:
+                    writer.ome_metadata.structured_annotations.append(CommentAnnotation(value=x, namespace="VLabApp"))
         except Exception:
             logging.getLogger(__name__).exception('Error projecting image %s', image_path)
             # Remove all handlers for this module
             remove_all_log_handlers()
             raise
 
-        # Save the projection
-        output_file_name = os.path.join(output_path, output_basename+".ome.tif")
-        # TODO: properly deal with 'F' axis.
-        logger.info("Saving projected image to %s", output_file_name)
-        ome_metadata = OmeTiffWriter.build_ome(data_shapes=[projected_image[0, :, :, 0, :, :].shape],
-                                               data_types=[projected_image[0, :, :, 0, :, :].dtype],
-                                               dimension_order=["TCYX"],
-                                               channel_names=[image.channel_names],
-                                               physical_pixel_sizes=[PhysicalPixelSizes(X=image.physical_pixel_sizes[0], Y=image.physical_pixel_sizes[1], Z=image.physical_pixel_sizes[2])])
-        ome_metadata.structured_annotations.append(CommentAnnotation(value=buffered_handler.get_messages(), namespace="VLabApp"))
-        for x in image_metadata:
-            ome_metadata.structured_annotations.append(CommentAnnotation(value=x, namespace="VLabApp"))
-        OmeTiffWriter.save(projected_image[0, :, :, 0, :, :], output_file_name, ome_xml=ome_metadata)
-
         # create logfile
         logfile = os.path.join(output_path, output_basename+".log")
         with open(logfile, 'w') as f:
@@ -92,7 +92,8 @@ class Widget(QWidget):
     def submit(self):
         mask_paths = self.mask_list.get_file_list()
 
-        for input_path in mask_paths:
+        # read the next mask in background while processing the current one
+        for input_path in gf.prefetch_images(mask_paths):
             logging.getLogger(__name__).info("Processing mask %s", input_path)
             try:
                 output_filename = os.path.join(self.output_settings.get_path(input_path),